@@ -18,53 +18,61 @@ import base64
 import sys
 import re
 import html
+import time
 import streamlit as st
 import torch
 import transformers
 import huggingface_hub
-from fhirpy import SyncFHIRClient
 from dotenv import load_dotenv
 from datetime import datetime
 
+# Configuration loading (before the services, which read their settings at import)
+load_dotenv()
+
 # Resource wrappers
 from resources.administration.patient import AppPatient
-from resources.administration.device import AppDevice
-from resources.clinical.allergyIntolerance import AppAllergyIntolerance
-from resources.clinical.carePlan import AppCarePlan
-from resources.clinical.condition import AppCondition
-from resources.clinical.procedure import AppProcedure
-from resources.diagnostics.diagnosticReport import AppDiagnosticReport
-from resources.diagnostics.documentReference import AppDocumentReference
-from resources.diagnostics.observation import AppObservation
-from resources.medications.immunization import AppImmunization
-from resources.medications.medication import AppMedication
-from resources.medications.medicationRequests import AppMedicationRequest
-
-# Configuration loading
-load_dotenv()
+
+# Clinical data retrieval
+from services.clinical_fetch import COUNTED_TYPES, build_clinical_context, invalidate_patient_resources
+from services.context_cache import get_context_cache
+from services.fhir_transport import create_fhir_client
+from services.metrics import STAGES, StageTrace, activate, append_metrics_log
+from services.patient_directory import clean_patient_name, get_patient_directory
+from services.patient_index import fetch_patient_page, get_patient_label_cache
+from services.prefetch import get_prefetch_scheduler, rank_prefetch_candidates
+
 SERVER_URL = os.getenv("SERVER_URL")
 HF_TOKEN = os.getenv("HF_TOKEN")
 HISTORY_FILE = "chat_history.json"
-
-def format_patient_dropdown_label(p: AppPatient) -> str:
+# Seconds a page of patient search results is reused across reruns
+PATIENT_SEARCH_TTL = 60
+# Patient picker: "server" (FHIR search per query) or "local" (in-memory patient directory)
+PATIENT_PICKER = os.getenv("PATIENT_PICKER", "server")
+# Show the per-stage timings of the last patient open in the sidebar
+SHOW_METRICS_PANEL = os.getenv("SHOW_METRICS_PANEL", "0") == "1"
+# Number of prompts whose token count is kept across reruns
+PROMPT_TOKEN_CACHE_ENTRIES = 32
+
+def format_patient_label(name: str, gender_val, dob, is_deceased: bool) -> str:
     """
     Formats the patient label for the selection dropdown.
     Format: [Icon] Name | Gender | DOB
     """
-    icon = "🔴" if p.is_deceased else "🟢"     
+    icon = "🔴" if is_deceased else "🟢"     
     gender_map = {'male': 'M', 'female': 'F', 'other': 'O', 'unknown': '?'}
-    
+    g = gender_map.get(gender_val, '?')
+    return f"{icon} {name} | {g} | {dob or 'Unknown'}"
+
+def format_patient_dropdown_label(p: AppPatient) -> str:
+    """
+    Formats the dropdown label of an AppPatient (see format_patient_label).
+    """
     # Handle gender extraction (enum or string)
     gender_val = p.gender.value if hasattr(p.gender, 'value') else p.gender
-    g = gender_map.get(gender_val, '?')
-    
-    dob = p.birth_date.strftime('%Y-%m-%d') if p.birth_date else "Unknown"
+    dob = p.birth_date.strftime('%Y-%m-%d') if p.birth_date else None
     
     # Clean up name (remove ordinal prefixes if present, e.g., "1st: John")
-    raw_name = p.full_name.split('\n')[0]
-    clean_name = raw_name.split(':', 1)[1].strip() if ":" in raw_name else raw_name
-    
-    return f"{icon} {clean_name} | {g} | {dob}"
+    return format_patient_label(clean_patient_name(p.full_name), gender_val, dob, p.is_deceased)
 
 def clean_medical_markdown(text: str) -> str:
     """
@@ -115,83 +123,42 @@ def load_llm():
         device_map="auto"
     )
 
-@st.cache_data(show_spinner="Downloading data from FHIR Server...")
-def get_patient_clinical_context(patient_json: dict, _client):
+@st.cache_data(ttl=PATIENT_SEARCH_TTL, show_spinner=False)
+def search_patients(query: str, page_url, _client):
     """
-    Orchestrates the retrieval of all clinical resources for a selected patient.
-    1. Parses the base Patient resource.
-    2. Fetches Medications first to build a resolution map.
-    3. Iterates through all other resource types (Conditions, Observations, etc.),
-       fetches them, and adds them to the patient object.
-    4. Generates the final text summary (prompt) for the LLM.
+    Returns one page of the server-side patient search and the link to the next page.
+    Pages are cached for a short time, so reruns of the script do not hit the server.
     """
-    try:
-        selected_patient = AppPatient(patient_json)
-    except Exception as e:
-        return f"Error parsing patient data: {e}", {}, "N/A"
-        
-    counts = {}
-    medication_map = {} 
+    return fetch_patient_page(_client, query, page_url)
 
-    # --- Step 1: Fetch Medications for resolution ---
-    try:
-        med_bundle = _client.resources('MedicationRequest') \
-                            .search(patient=selected_patient.id) \
-                            .include('MedicationRequest', 'medication') \
-                            .fetch_raw()
-                            
-        if med_bundle and med_bundle.entry:
-            for entry in med_bundle.entry:
-                res = entry.resource
-                if res.resource_type == 'Medication':
-                    try:
-                        app_med = AppMedication(res.serialize())
-                        medication_map[res.id] = app_med
-                    except Exception as e:
-                        print(f"[WARNING] Could not parse Medication {res.id}: {e}")
-    except Exception as e:
-        st.error(f"[ERROR] Error fetching medications map: {e}")
-    
-    # --- Step 2: Fetch all other clinical resources ---
-    resource_configs = [
-        ('Device',            AppDevice,            selected_patient.add_devices),
-        ('AllergyIntolerance',AppAllergyIntolerance,selected_patient.add_allergies),
-        ('CarePlan',          AppCarePlan,          selected_patient.add_care_plans),
-        ('Condition',         AppCondition,         selected_patient.add_conditions),
-        ('Procedure',         AppProcedure,         selected_patient.add_procedures),
-        ('DiagnosticReport',  AppDiagnosticReport,  selected_patient.add_diagnostic_reports),
-        ('DocumentReference', AppDocumentReference, selected_patient.add_document_references),
-        ('Observation',       AppObservation,       selected_patient.add_observations),
-        ('Immunization',      AppImmunization,      selected_patient.add_immunizations),
-        ('MedicationRequest', AppMedicationRequest, selected_patient.add_medication_requests)
-    ]
-
-    for resource_type, AppClass, add_method in resource_configs:
-        fetched_resources = []
-        try:
-            # Fetch resources sorted by last updated to get recent data first
-            fetched_resources = _client.resources(resource_type) \
-                                       .search(patient=selected_patient.id) \
-                                       .sort('-_lastUpdated') \
-                                       .fetch_all()
-            counts[resource_type] = len(fetched_resources)
-        except Exception as e:
-            print(f"[ERROR] Error fetching {resource_type} for patient {selected_patient.id}: {e}")
-            counts[resource_type] = 0
-            continue
-            
-        app_objects = []
-        for res in fetched_resources:
-            try:
-                app_obj = AppClass(res.serialize())
-                app_objects.append(app_obj)
-            except Exception as e:
-                r_id = res.id if hasattr(res, 'id') else "Unknown"
-                print(f"[WARNING] Could not parse {resource_type} {r_id}: {e}")
+@st.cache_data(ttl=PATIENT_SEARCH_TTL, show_spinner=False)
+def read_patient(patient_id: str, _client) -> dict:
+    """
+    Downloads the full Patient resource selected from the local directory.
+    """
+    return _client.execute(f'Patient/{patient_id}', method='get')
 
-        add_method(app_objects)
+@st.cache_data(show_spinner="Downloading data from FHIR Server...")
+def get_patient_clinical_context(patient_json: dict, revision: int, _client):
+    """
+    Orchestrates the retrieval of all clinical resources for a selected patient.
+    The searches for every resource type (and the Medication resolution map) run
+    concurrently, see services.clinical_fetch.build_clinical_context.
+    The revision comes from the context cache: it changes only when this patient's
+    data is invalidated, so other patients keep their cached context.
+    Returns the clinical context string, the resource counts and the patient age.
+    """
+    return build_clinical_context(patient_json, _client)
 
-    return selected_patient.generate_clinical_context(medication_map), counts, selected_patient.age
+@st.cache_data(max_entries=PROMPT_TOKEN_CACHE_ENTRIES, show_spinner=False)
+def count_prompt_tokens(model_history: list, _tokenizer) -> int:
+    """
+    Returns the number of tokens of the chat prompt built from model_history.
+    Streamlit reruns the script on every interaction: the count is cached on the
+    messages, so the prompt is tokenized again only when the clinical context or
+    the conversation changed.
+    """
+    return len(_tokenizer.apply_chat_template(model_history, tokenize=True, add_generation_prompt=True))
 
 def generate_cda_xml(app_patient, title, content):
     """
@@ -371,47 +338,96 @@ st.title("💬 Dr. Llama - CDSS Assistant")
 # --- INITIALIZATION ---
 if "history_per_patient" not in st.session_state:
     st.session_state.history_per_patient = load_json_history()
+if "recent_patients" not in st.session_state:
+    # Patients opened in this session (most recent first), used to rank the prefetch
+    st.session_state.recent_patients = []
+if "patient_traces" not in st.session_state:
+    # Stage timings of the last context build, per patient
+    st.session_state.patient_traces = {}
 
 llm = load_llm()
 
 try:
-    client = SyncFHIRClient(SERVER_URL)
+    client = create_fhir_client(SERVER_URL)
 except Exception:
     st.error("Could not connect to FHIR Server. Check .env")
     st.stop()
 
+prefetcher = get_prefetch_scheduler(client)
+
 # --- SIDEBAR: PATIENT SELECTION & CONTEXT ---
 with st.sidebar:
     st.title("🏥 Patient Selection")
     try:
-        # Fetch recent patients for dropdown
-        raw_patients = client.resources('Patient').sort('_lastUpdated').limit(100).fetch()   
+        # Server-side search (name, birth date or FHIR ID), most recently updated first
+        search_query = st.text_input(
+            label="Search patient",
+            placeholder="🔍 Name, birth date (YYYY-MM-DD) or FHIR ID...",
+            label_visibility="collapsed"
+        )
+        if st.session_state.get("patient_query") != search_query:
+            st.session_state.patient_query = search_query
+            st.session_state.patient_pages = 1
+
         patient_options = {}
-        for raw_p in raw_patients:
-            try:
-                temp_p = AppPatient(raw_p.serialize())
-                label = format_patient_dropdown_label(temp_p)
-                # Ensure uniqueness in dropdown keys
-                unique_key = f"{label} ##{temp_p.id}" 
-                patient_options[unique_key] = raw_p.serialize()
-            except Exception: pass
+        has_more = False
+        if PATIENT_PICKER == "local":
+            # In-memory directory (refreshed incrementally), no server round-trip per query
+            directory = get_patient_directory()
+            directory.refresh(client)
+            if directory.last_error:
+                st.caption("⚠️ Patient list could not be refreshed, showing the last loaded one.")
+            limit = 50 * st.session_state.patient_pages
+            entries = directory.search(search_query, limit=limit)
+            has_more = len(entries) == limit
+            for entry in entries:
+                label = format_patient_label(entry.name, entry.gender, entry.birth_date, entry.is_deceased)
+                # The full Patient is downloaded only once selected (see read_patient)
+                patient_options[f"{label} ##{entry.id}"] = {'id': entry.id, 'meta': {'lastUpdated': entry.last_updated}}
+        else:
+            raw_patients = []
+            next_url = None
+            for _ in range(st.session_state.patient_pages):
+                page, next_url = search_patients(search_query, next_url, client)
+                raw_patients.extend(page)
+                if not next_url:
+                    break
+            has_more = next_url is not None
+
+            # Labels are cached per patient version (no validation on reruns)
+            label_cache = get_patient_label_cache()
+            for raw_p in raw_patients:
+                try:
+                    label = label_cache.get_label(raw_p, lambda raw: format_patient_dropdown_label(AppPatient(raw)))
+                    # Ensure uniqueness in dropdown keys
+                    unique_key = f"{label} ##{raw_p['id']}" 
+                    patient_options[unique_key] = raw_p
+                except Exception: pass
 
         if not patient_options:
             st.warning("No patients found.")
         else:
             selected_key = st.selectbox(
-                label="Search patient", 
+                label="Select patient", 
                 options=list(patient_options.keys()),
                 format_func=lambda x: x.split(" ##")[0],
                 index=None, 
-                placeholder="🔍 Search patient...", 
+                placeholder=f"Select patient ({len(patient_options)} shown)...", 
                 label_visibility="collapsed"
             )    
+            if has_more and st.button("⬇️ Load more patients", use_container_width=True):
+                st.session_state.patient_pages += 1
+                st.rerun()
             
             if selected_key:
                 patient_data_json = patient_options[selected_key]
+                if PATIENT_PICKER == "local":
+                    patient_data_json = read_patient(patient_data_json['id'], client)
                 app_patient = AppPatient(patient_data_json)
                 pid = app_patient.id                
+                if pid in st.session_state.recent_patients:
+                    st.session_state.recent_patients.remove(pid)
+                st.session_state.recent_patients.insert(0, pid)
                 
                 # --- Patient Demographics Display ---
                 st.markdown('<hr class="compact">', unsafe_allow_html=True)
@@ -440,7 +456,12 @@ with st.sidebar:
                 
                 # --- Fetch Clinical Context ---
                 calculated_age = "N/A"
-                clinical_context_str, fetched_counts, calculated_age = get_patient_clinical_context(patient_data_json, client)
+                # The background prefetch pauses while the selected patient is loaded
+                patient_trace = StageTrace(pid)
+                with activate(patient_trace), prefetcher.interactive(pid):
+                    clinical_context_str, fetched_counts, calculated_age = get_patient_clinical_context(patient_data_json, get_context_cache().revision(pid), client)
+                # Nothing is recorded when the context comes from st.cache_data
+                context_built = bool(patient_trace.rows())
                 
                 # Update Age Placeholder
                 if calculated_age != "N/A" and calculated_age != -1:
@@ -452,14 +473,15 @@ with st.sidebar:
                 st.markdown('<hr class="compact">', unsafe_allow_html=True)
                 st.markdown("**📂 Clinical Records**")
                 
-                required_res = [ "Device", "AllergyIntolerance", "CarePlan", "Condition", "Procedure", "DiagnosticReport", "DocumentReference", "Observation", "Immunization" ]
-                
                 col_left, col_right = st.columns(2)
                 left_content = ""
                 right_content = ""
                 
-                for idx, r_type in enumerate(required_res):
+                for idx, r_type in enumerate(COUNTED_TYPES):
                     count = fetched_counts.get(r_type, 0)
+                    # None: the resource type could not be retrieved from the server
+                    if count is None:
+                        count = "unavailable"
                     display_name = r_type.replace("MedicationRequest", "Medications").replace("AllergyIntolerance", "Allergies").replace("DocumentReference", "Documents")
                     line = f"<div style='line-height:1.2; font-size:0.9em;'>{display_name}: <b>{count}</b></div>"
                     
@@ -469,6 +491,14 @@ with st.sidebar:
                 with col_left: st.markdown(left_content, unsafe_allow_html=True)
                 with col_right: st.markdown(right_content, unsafe_allow_html=True)
 
+                # Failed resource types are not cached: a retry downloads only those
+                unavailable_types = [r_type for r_type, count in fetched_counts.items() if count is None]
+                if unavailable_types:
+                    st.warning(f"Some records could not be retrieved: {', '.join(unavailable_types)}")
+                    if st.button("🔄 Retry", use_container_width=True):
+                        invalidate_patient_resources(pid, unavailable_types)
+                        st.rerun()
+
                 # --- LLM Context Preview ---
                 st.markdown('<hr class="compact">', unsafe_allow_html=True)
                 st.markdown("### 🧠 LLM Context View")
@@ -485,6 +515,11 @@ with st.sidebar:
                         save_json_history(st.session_state.history_per_patient)
                     st.rerun()
 
+            # --- Background Prefetch ---
+            # Recently opened patients (this session, then those with a chat history) first
+            recent_ids = st.session_state.recent_patients + list(st.session_state.history_per_patient.keys())
+            prefetcher.schedule(rank_prefetch_candidates(list(patient_options.values()), recent_ids))
+
     except Exception as e:
         st.error(f"Connection/Loading Error: {e}")
 
@@ -525,9 +560,10 @@ if 'pid' in locals() and llm and clinical_context_str:
                             if upload_cda_to_fhir(xml_content, auto_title, pid, client):
                                 
                                 # --- FIX CACHE ---
-                                # Tell Streamlit to invalidate cache for patient data
-                                # Next recalculation will fetch the new DocumentReference
-                                get_patient_clinical_context.clear()
+                                # Invalidate only this patient's DocumentReferences:
+                                # next recalculation fetches the new DocumentReference
+                                # and reuses every other cached resource type
+                                invalidate_patient_resources(pid, ['DocumentReference'])
                                 
                                 # --- FIX PERSISTENCE ---
                                 # Mark message as saved in history
@@ -594,8 +630,9 @@ CRITICAL GUIDELINES:
             content = f"CLINICAL QUESTION:\n{content}"
         model_history.append({"role": msg["role"], "content": content})
 
-    temp_prompt_ids = llm.tokenizer.apply_chat_template(model_history, tokenize=True, add_generation_prompt=True)
-    current_tokens = len(temp_prompt_ids)
+    tokenize_start = time.perf_counter()
+    current_tokens = count_prompt_tokens(model_history, llm.tokenizer)
+    patient_trace.add('tokenize', 'prompt', time.perf_counter() - tokenize_start, count=current_tokens)
     model_limit = 8192
     safety_margin = 512 
     remaining_space = model_limit - current_tokens
@@ -667,4 +704,21 @@ CRITICAL GUIDELINES:
 else:
     # --- NO PATIENT SELECTED ---
     st.markdown("<div style='height: 0vh;'></div>", unsafe_allow_html=True)
-    st.info("👈 Please select a patient from the sidebar to start.")
\ No newline at end of file
+    st.info("👈 Please select a patient from the sidebar to start.")
+
+# --- PERFORMANCE METRICS ---
+if 'patient_trace' in locals() and context_built:
+    patient_trace.finish()
+    append_metrics_log(patient_trace)
+    st.session_state.patient_traces[pid] = patient_trace
+
+if SHOW_METRICS_PANEL and 'pid' in locals() and pid in st.session_state.patient_traces:
+    last_trace = st.session_state.patient_traces[pid]
+    with st.sidebar:
+        st.markdown('<hr class="compact">', unsafe_allow_html=True)
+        with st.expander("⏱️ Performance (last patient open)"):
+            st.write(f"**Total:** {last_trace.total_seconds:.2f} s")
+            stage_totals = last_trace.stage_totals()
+            st.write(" | ".join(f"{stage}: {stage_totals[stage]:.2f} s" for stage in STAGES if stage in stage_totals))
+            st.caption("Concurrent downloads overlap, so stage times can add up to more than the total.")
+            st.dataframe(last_trace.rows(), hide_index=True, use_container_width=True)
@@ -13,7 +13,8 @@ from fhir.resources.device import Device as FhirDevice
 from enum import Enum
 from typing import Optional, List, Dict
 
-from resources.core.types import AppCodeableConcept
+from resources.core.types import AppCodeableConcept, MemoizedResource, memoized_property
+from resources.core.model_view import parse_fhir_resource
 
 class DeviceStatus(str, Enum):
     ACTIVE = "active"
@@ -32,15 +33,17 @@ class DeviceStatus(str, Enum):
         }
         return definitions.get(self.value, "Definition not available.")
 
-class AppDevice:
+class AppDevice(MemoizedResource):
+    FHIR_ELEMENTS = ['status', 'deviceName', 'type']
+
     def __init__(self, raw_json_data: dict):
-        self.resource = FhirDevice(**raw_json_data)
+        self.resource = parse_fhir_resource(FhirDevice, raw_json_data)
 
     @property
     def id(self):
         return self.resource.id
 
-    @property
+    @memoized_property
     def status(self) -> Optional[DeviceStatus]:
         if not self.resource.status:
             return None
@@ -49,7 +52,7 @@ class AppDevice:
         except ValueError:
             return None
 
-    @property
+    @memoized_property
     def device_names(self) -> Optional[str]:
         if not self.resource.deviceName:
             return None
@@ -58,13 +61,13 @@ class AppDevice:
             return None
         return ", ".join(names)
 
-    @property
+    @memoized_property
     def type_text(self) -> Optional[str]:
         if not self.resource.type:
             return None
         return AppCodeableConcept(self.resource.type).readable_value
 
-    @property
+    @memoized_property
     def type_details(self) -> List[Dict[str, Optional[str]]]:
         if not self.resource.type:
             return []    
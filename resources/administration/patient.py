@@ -11,9 +11,14 @@ Group: Carmine Vardaro, Marco Savastano, Francesco Ferrara.
 
 from fhir.resources.patient import Patient as FhirPatient
 
+import heapq
+from bisect import insort
 from datetime import date, datetime
 from enum import Enum
-from typing import Optional, List
+from typing import Any, Callable, Dict, Iterable, Optional, List, Set, Tuple
+
+from resources.core.model_view import parse_fhir_resource
+from resources.core.types import MemoizedResource, memoized_property
 
 from resources.administration.device import *
 from resources.clinical.allergyIntolerance import *
@@ -23,6 +28,7 @@ from resources.clinical.procedure import *
 from resources.diagnostics.diagnosticReport import *
 from resources.diagnostics.documentReference import *
 from resources.diagnostics.observation import *
+from resources.diagnostics.observation_store import ObservationStore
 from resources.medications.immunization import *
 from resources.medications.medicationRequests import *
 
@@ -33,25 +39,173 @@ class Gender(str, Enum):
     OTHER = "other"
     UNKNOWN = "unknown"
     
-class AppPatient:
+# Observation statuses shown in the clinical context
+CONTEXT_OBSERVATION_STATUSES = (ObservationStatus.FINAL, ObservationStatus.AMENDED, ObservationStatus.CORRECTED)
+
+# Procedure statuses shown in the procedures history
+CONTEXT_PROCEDURE_STATUSES = (ProcedureStatus.COMPLETED, ProcedureStatus.IN_PROGRESS, None)
+
+# Line of the sections whose resources could not be retrieved from the server
+UNAVAILABLE_NOTE = "- Data unavailable (could not be retrieved from the FHIR server)"
+
+class _StatusIndex:
+    """
+    Resources bucketed by status as they are added, so selecting some statuses
+    does not scan the others. Selections keep the order in which resources were added.
+    """
+    def __init__(self, status_of: Callable[[Any], Any]):
+        self._status_of = status_of
+        self._buckets: Dict[Any, List[Tuple[int, Any]]] = {}
+        self._added = 0
+
+    def add(self, items: Iterable):
+        for item in items:
+            self._buckets.setdefault(self._status_of(item), []).append((self._added, item))
+            self._added += 1
+
+    def select(self, statuses: Iterable) -> list:
+        buckets = [self._buckets[status] for status in statuses if status in self._buckets]
+        # Positions are unique, so the resources themselves are never compared
+        return [item for _, item in heapq.merge(*buckets)]
+
+    def statuses(self) -> list:
+        return list(self._buckets)
+
+# Resource types behind the simulated current date (see last_interaction_date)
+_DATED_TYPES = ('DiagnosticReport', 'Observation', 'Procedure', 'MedicationRequest', 'Condition')
+
+class AppPatient(MemoizedResource):
+    # Manifest of the clinical context: the resource types read by each section of
+    # generate_clinical_context (the elements read from each type are declared by
+    # its wrapper in FHIR_ELEMENTS). Keep it in sync when a section changes.
+    CONTEXT_SECTIONS = {
+        'Current Date': _DATED_TYPES,
+        'PATIENT PROFILE': _DATED_TYPES,
+        'ACTIVE DEVICES': ('Device',),
+        'ALLERGIES & INTOLERANCES': ('AllergyIntolerance',),
+        'ACTIVE CARE PLANS & GOALS': ('CarePlan',),
+        'ACTIVE CONDITIONS (PROBLEM LIST)': ('Condition',),
+        'PROCEDURES HISTORY': ('Procedure',),
+        'IMMUNIZATION HISTORY': ('Immunization',),
+        'CURRENT MEDICATIONS (ACTIVE)': ('MedicationRequest', 'Medication'),
+        'OBSERVATIONS': ('Observation',),
+        'LATEST CLINICAL NOTE': ('DiagnosticReport',),
+    }
+
+    # Sections rendered (and cached) independently, in context order; the Current Date
+    # and PATIENT PROFILE header is rebuilt every time
+    _SECTION_RENDERERS = (
+        ('ACTIVE DEVICES', '_render_devices'),
+        ('ALLERGIES & INTOLERANCES', '_render_allergies'),
+        ('ACTIVE CARE PLANS & GOALS', '_render_care_plans'),
+        ('ACTIVE CONDITIONS (PROBLEM LIST)', '_render_conditions'),
+        ('PROCEDURES HISTORY', '_render_procedures'),
+        ('IMMUNIZATION HISTORY', '_render_immunizations'),
+        ('CURRENT MEDICATIONS (ACTIVE)', '_render_medications'),
+        ('OBSERVATIONS', '_render_observations'),
+        ('LATEST CLINICAL NOTE', '_render_latest_note'),
+    )
+
+    @classmethod
+    def context_resource_types(cls) -> Set[str]:
+        """
+        Returns the resource types read by at least one section of the clinical context.
+        """
+        return {resource_type for types in cls.CONTEXT_SECTIONS.values() for resource_type in types}
+
+    # Resource type -> aggregator method
+    _ADD_METHODS = {
+        'Device': 'add_devices',
+        'AllergyIntolerance': 'add_allergies',
+        'CarePlan': 'add_care_plans',
+        'Condition': 'add_conditions',
+        'Procedure': 'add_procedures',
+        'DiagnosticReport': 'add_diagnostic_reports',
+        'DocumentReference': 'add_document_references',
+        'Observation': 'add_observations',
+        'Immunization': 'add_immunizations',
+        'MedicationRequest': 'add_medication_requests',
+    }
+
     def __init__(self, raw_json_data: dict):
-        self.resource = FhirPatient(**raw_json_data)
-        self._devices: List[AppDevice] = []
-        self._allergies: List[AppAllergyIntolerance] = []
-        self._care_plans: List[AppCarePlan] = []
-        self._conditions: List[AppCondition] = []
-        self._procedures: List[AppProcedure] = []
-        self._diagnostic_reports: List[AppDiagnosticReport] = []
-        self._document_references: List[AppDocumentReference] = []
-        self._observations: List[AppObservation] = []
-        self._immunizations: List[AppImmunization] = []
-        self._medication_requests: List[AppMedicationRequest] = []
-        
+        self.resource = parse_fhir_resource(FhirPatient, raw_json_data)
+        # Most recent date of the resources of each type (see last_interaction_date)
+        self._latest_dates: Dict[str, date] = {}
+        # Revision of the resources of each type, as given to replace_resources
+        self._revisions: Dict[str, Any] = {}
+        # Rendered context sections {section -> (key, text)} (see generate_clinical_context)
+        self._rendered_sections: Dict[str, Tuple[tuple, str]] = {}
+        for resource_type in self._ADD_METHODS:
+            self._clear_resources(resource_type)
+
+    def _clear_resources(self, resource_type: str):
+        """
+        Drops the resources of one type together with their indexes. The indexes are
+        maintained by the add_* methods, so the clinical context reads only what it
+        renders instead of rescanning the whole history.
+        """
+        if resource_type == 'Device':
+            self._devices: List[AppDevice] = []
+            self._device_index = _StatusIndex(lambda d: d.status)
+        elif resource_type == 'AllergyIntolerance':
+            self._allergies: List[AppAllergyIntolerance] = []
+            self._allergy_index = _StatusIndex(lambda a: a.clinical_status)
+        elif resource_type == 'CarePlan':
+            self._care_plans: List[AppCarePlan] = []
+            self._care_plan_index = _StatusIndex(lambda cp: cp.status)
+        elif resource_type == 'Condition':
+            self._conditions: List[AppCondition] = []
+            self._condition_index = _StatusIndex(lambda c: c.clinical_status)
+        elif resource_type == 'Procedure':
+            self._procedures: List[AppProcedure] = []
+            # (name, code string) -> sorted dates of the valid procedures, plus the undated ones
+            self._procedure_groups: Dict[Tuple[str, str], list] = {}
+            self._undated_procedures: Set[str] = set()
+            self._has_valid_procedures = False
+        elif resource_type == 'DiagnosticReport':
+            self._diagnostic_reports: List[AppDiagnosticReport] = []
+            # Reports that may hold a clinical note (see AppDiagnosticReport.has_text)
+            self._text_reports: List[AppDiagnosticReport] = []
+        elif resource_type == 'DocumentReference':
+            self._document_references: List[AppDocumentReference] = []
+        elif resource_type == 'Observation':
+            self._observations: List[AppObservation] = []
+            self._observation_store = ObservationStore()
+        elif resource_type == 'Immunization':
+            self._immunizations: List[AppImmunization] = []
+            # (name, code string) -> sorted dates of the completed immunizations
+            self._immunization_groups: Dict[Tuple[str, str], list] = {}
+            self._has_completed_immunizations = False
+        elif resource_type == 'MedicationRequest':
+            self._medication_requests: List[AppMedicationRequest] = []
+            self._medication_request_index = _StatusIndex(lambda m: m.status)
+        self._revisions.pop(resource_type, None)
+        if self._latest_dates.pop(resource_type, None) is not None:
+            self.reset_memoized('age')
+
+    def replace_resources(self, resource_type: str, items: list, revision: Any = None):
+        """
+        Replaces all the resources of one type (e.g. after they were downloaded again):
+        only the indexes of that type are rebuilt, the other types are left untouched.
+        Args:
+            revision: Identifies the given resources (see resource_revision).
+        """
+        self._clear_resources(resource_type)
+        if items:
+            getattr(self, self._ADD_METHODS[resource_type])(items)
+        self._revisions[resource_type] = revision
+
+    def resource_revision(self, resource_type: str) -> Any:
+        """
+        Returns the revision given with the current resources of the type (None if not set).
+        """
+        return self._revisions.get(resource_type)
+
     @property
     def id(self):
         return self.resource.id
 
-    @property
+    @memoized_property
     def gender(self) -> Gender:
         if not self.resource.gender:
             return None
@@ -60,11 +214,11 @@ class AppPatient:
         except ValueError:
             return None
 
-    @property
+    @memoized_property
     def birth_date(self) -> Optional[date]:
         return self.resource.birthDate
 
-    @property
+    @memoized_property
     def age(self) -> int:
         if not self.birth_date:
             return -1
@@ -73,7 +227,7 @@ class AppPatient:
 
         return simulated_today.year - born.year - ((simulated_today.month, simulated_today.day) < (born.month, born.day))
 
-    @property
+    @memoized_property
     def is_deceased(self) -> bool:
         if self.resource.deceasedDateTime:
             return True
@@ -81,13 +235,13 @@ class AppPatient:
             return True
         return False
 
-    @property
+    @memoized_property
     def deceased_date(self) -> Optional[datetime]:
         if not self.is_deceased:
             return None
         return self.resource.deceasedDateTime
 
-    @property  
+    @memoized_property  
     def full_name(self) -> str:
         # If no name
         if not self.resource.name:
@@ -110,6 +264,7 @@ class AppPatient:
 
     def add_devices(self, devices: List[AppDevice]):
         self._devices.extend(devices)
+        self._device_index.add(devices)
 
     @property
     def allergies(self) -> List[AppAllergyIntolerance]:
@@ -117,6 +272,7 @@ class AppPatient:
 
     def add_allergies(self, allergies: List[AppAllergyIntolerance]):
         self._allergies.extend(allergies)
+        self._allergy_index.add(allergies)
 
     @property
     def care_plans(self) -> List[AppCarePlan]:
@@ -124,6 +280,7 @@ class AppPatient:
 
     def add_care_plans(self, plans: List[AppCarePlan]):
         self._care_plans.extend(plans)
+        self._care_plan_index.add(plans)
 
     @property
     def conditions(self) -> List[AppCondition]:
@@ -131,6 +288,8 @@ class AppPatient:
 
     def add_conditions(self, conditions: List[AppCondition]):
         self._conditions.extend(conditions)
+        self._condition_index.add(conditions)
+        self._note_dates('Condition', (c.onset_date for c in conditions))
 
     @property
     def procedures(self) -> List[AppProcedure]:
@@ -138,6 +297,15 @@ class AppPatient:
 
     def add_procedures(self, procedures: List[AppProcedure]):
         self._procedures.extend(procedures)
+        for p in procedures:
+            if p.status not in CONTEXT_PROCEDURE_STATUSES:
+                continue
+            self._has_valid_procedures = True
+            if p.start_date:
+                insort(self._procedure_groups.setdefault((p.code_text or "Unknown Procedure", p.simple_code_str), []), p.start_date)
+            else:
+                self._undated_procedures.add(p.to_prompt_string())
+        self._note_dates('Procedure', (p.end_date or p.start_date for p in procedures))
 
     @property
     def diagnostic_reports(self) -> List[AppDiagnosticReport]:
@@ -145,6 +313,8 @@ class AppPatient:
 
     def add_diagnostic_reports(self, reports: List[AppDiagnosticReport]):
         self._diagnostic_reports.extend(reports)
+        self._text_reports.extend(r for r in reports if r.has_text)
+        self._note_dates('DiagnosticReport', (r.effective_date for r in reports))
 
     @property
     def document_references(self) -> List[AppDocumentReference]:
@@ -157,8 +327,17 @@ class AppPatient:
     def observations(self) -> List[AppObservation]:
         return self._observations
 
+    @property
+    def observation_store(self) -> ObservationStore:
+        """
+        Columnar view of the observations (status and time filters, latest per name, category buckets).
+        """
+        return self._observation_store
+
     def add_observations(self, observations: List[AppObservation]):
         self._observations.extend(observations)
+        self._observation_store.add(observations)
+        self._note_dates('Observation', (o.effective_date for o in observations))
 
     @property
     def immunizations(self) -> List[AppImmunization]:
@@ -166,6 +345,12 @@ class AppPatient:
 
     def add_immunizations(self, immunizations: List[AppImmunization]):
         self._immunizations.extend(immunizations)
+        for imm in immunizations:
+            if imm.status != ImmunizationStatus.COMPLETED:
+                continue
+            self._has_completed_immunizations = True
+            if imm.occurrence_date:
+                insort(self._immunization_groups.setdefault((imm.code_text or "Unknown Vaccine", imm.simple_code_str), []), imm.occurrence_date)
 
     @property
     def medication_requests(self) -> List[AppMedicationRequest]:
@@ -173,84 +358,119 @@ class AppPatient:
 
     def add_medication_requests(self, requests: List[AppMedicationRequest]):
         self._medication_requests.extend(requests)
+        self._medication_request_index.add(requests)
+        self._note_dates('MedicationRequest', (m.authored_on for m in requests))
+
+    def _note_dates(self, resource_type: str, values: Iterable):
+        """
+        Moves the most recent date of the resource type forward with the dates of
+        one added batch (None values are ignored); the memoized age is dropped once,
+        and only if the date changed.
+        """
+        dates = [d.date() if isinstance(d, datetime) else d for d in values if isinstance(d, date)]
+        if not dates:
+            return
+        latest = max(dates)
+        current = self._latest_dates.get(resource_type)
+        if current is None or latest > current:
+            self._latest_dates[resource_type] = latest
+            self.reset_memoized('age')
 
     @property
     def last_interaction_date(self) -> date:
         """
-        Finds the most recent date across all clinical resources (excluding death date).
+        The most recent date across all clinical resources (excluding death date):
+        DiagnosticReports, Observations, Procedures, MedicationRequests and Conditions.
         This date acts as the simulated "TODAY" for context generation.
+        Maintained by the add_* methods.
         """
-        dates = []
-        
-        # Collect dates from all resources
-        dates.extend([r.effective_date for r in self.diagnostic_reports if r.effective_date])
-        dates.extend([o.effective_date for o in self.observations if o.effective_date])
-        dates.extend([p.end_date or p.start_date for p in self.procedures if p.start_date or p.end_date])
-        dates.extend([m.authored_on for m in self.medication_requests if m.authored_on])
-        dates.extend([c.onset_date for c in self.conditions if c.onset_date])
-
-        # Convert everything to pure date (without time) and filter None
-        valid_dates = []
-        for d in dates:
-            if isinstance(d, datetime):
-                valid_dates.append(d.date())
-            elif isinstance(d, date):
-                valid_dates.append(d)
-        
-        if not valid_dates:
+        if not self._latest_dates:
             return date.today() # Fallback if patient history is empty
-            
-        return max(valid_dates)
+        return max(self._latest_dates.values())
 
-
-    def generate_clinical_context(self, medication_map: Dict[str, 'AppMedication']) -> str:
+    def generate_clinical_context(self, medication_map: Dict[str, 'AppMedication'],
+                                  unavailable_types: Optional[List[str]] = None,
+                                  revisions: Optional[Dict[str, Any]] = None) -> str:
         """
         Generates a comprehensive clinical summary of the patient for LLM grounding.
+        Every section of CONTEXT_SECTIONS is rendered on its own (see _SECTION_RENDERERS).
         Args:
             medication_map: A dictionary mapping reference IDs to Medication resources (used to resolve medication details in requests).
+            unavailable_types: Resource types that could not be retrieved from the server. Their sections
+                are marked as unavailable, so missing data is not mistaken for an absence of findings.
+            revisions: Optional revisions {resource type -> revision} of the resources and of the
+                medication map (see services.context_cache). When given, the rendered sections are
+                kept in the patient object and a section is rendered again only when the revision
+                or the availability of one of the types it reads changed. Callers sharing the
+                patient object must serialize the calls (see PatientContextCache.patient_lock).
         Returns:
             A formatted string containing the patient's clinical context.
         """
-        
+        unavailable = set(unavailable_types or [])
+
         simulated_today = self.last_interaction_date
         simulated_today_str = simulated_today.strftime('%Y-%m-%d')
 
         context_parts = []
-        
+
         context_parts.append(f"(Current Date: {simulated_today_str})")
-                
+
         # --- DEMOGRAPHICS ---
         context_parts.append("### PATIENT PROFILE")
         gender_str = self.gender.value if self.gender else "Unknown"
         age_str = f"{self.age} years old" if self.age >= 0 else "Age unknown"
         context_parts.append(f"- Demographics: {gender_str}, {age_str}")
 
-        # --- DEVICES ---
-        active_devices = [d for d in self.devices if d.status == DeviceStatus.ACTIVE]
+        for section, renderer_name in self._SECTION_RENDERERS:
+            key = None
+            if revisions is not None:
+                types = self.CONTEXT_SECTIONS[section]
+                key = (tuple(t in unavailable for t in types), tuple(revisions.get(t) for t in types))
+            cached = self._rendered_sections.get(section)
+            if key is not None and cached is not None and cached[0] == key:
+                text = cached[1]
+            else:
+                text = "\n".join(getattr(self, renderer_name)(unavailable, medication_map))
+                if key is not None:
+                    self._rendered_sections[section] = (key, text)
+            if text:
+                context_parts.append(text)
+
+        return "\n".join(context_parts)
+
+    def _render_devices(self, unavailable: Set[str], medication_map) -> List[str]:
+        context_parts = []
+        active_devices = self._device_index.select([DeviceStatus.ACTIVE])
         if active_devices:
             context_parts.append("\n### ACTIVE DEVICES")
             for device in active_devices:
                 context_parts.append(device.to_prompt_string())
+        elif 'Device' in unavailable:
+            context_parts.append(f"\n### ACTIVE DEVICES\n{UNAVAILABLE_NOTE}")
         else:
             context_parts.append("\n### ACTIVE DEVICES\n- None")
+        return context_parts
+
+    def _render_allergies(self, unavailable: Set[str], medication_map) -> List[str]:
+        context_parts = []
+        active_statuses = [
+            status for status in self._allergy_index.statuses()
+            if status not in [AllergyClinicalStatus.INACTIVE, AllergyClinicalStatus.RESOLVED]
+        ]
+        active_allergies = [
+            a for a in self._allergy_index.select(active_statuses)
+            if a.verification_status not in [AllergyVerificationStatus.REFUTED, AllergyVerificationStatus.ENTERED_IN_ERROR]
+        ]
 
-        # --- ALLERGIES & INTOLERANCES ---
-        active_allergies = []
-        for a in self.allergies:
-            is_active = a.clinical_status not in [AllergyClinicalStatus.INACTIVE, AllergyClinicalStatus.RESOLVED]
-            is_valid = a.verification_status not in [AllergyVerificationStatus.REFUTED, AllergyVerificationStatus.ENTERED_IN_ERROR]
-            if is_active and is_valid:
-                active_allergies.append(a)
-        
         if active_allergies:
             context_parts.append("\n### ALLERGIES & INTOLERANCES")
-            
+
             # Bucketing categories
             food_allergies = []
             med_allergies = []
             env_allergies = []
             other_allergies = [] # Biologic or null
-            
+
             for a in active_allergies:
                 cat = a.category
                 if cat == AllergyCategory.FOOD:
@@ -261,7 +481,7 @@ class AppPatient:
                     env_allergies.append(a)
                 else:
                     other_allergies.append(a)
-            
+
             # Helper function to print subsections
             def add_subsection(title, items):
                 if items:
@@ -275,14 +495,15 @@ class AppPatient:
             add_subsection("Environment", env_allergies)
             add_subsection("Other/Biologic", other_allergies)
 
+        elif 'AllergyIntolerance' in unavailable:
+            context_parts.append(f"\n### ALLERGIES & INTOLERANCES\n{UNAVAILABLE_NOTE}")
         else:
             context_parts.append("\n### ALLERGIES & INTOLERANCES\n- No known allergies")
+        return context_parts
 
-        # --- CARE PLANS ---
-        active_plans = [
-            cp for cp in self.care_plans 
-            if cp.status == CarePlanStatus.ACTIVE
-        ]
+    def _render_care_plans(self, unavailable: Set[str], medication_map) -> List[str]:
+        context_parts = []
+        active_plans = self._care_plan_index.select([CarePlanStatus.ACTIVE])
 
         if active_plans:
             context_parts.append("\n### ACTIVE CARE PLANS & GOALS")
@@ -290,25 +511,28 @@ class AppPatient:
                 plan_str = plan.to_prompt_string()
                 if plan_str: # Avoid empty plans without activities
                     context_parts.append(plan_str)
+        elif 'CarePlan' in unavailable:
+            context_parts.append(f"\n### ACTIVE CARE PLANS & GOALS\n{UNAVAILABLE_NOTE}")
+        return context_parts
 
-        # --- CONDITIONS (Problem List) ---
+    def _render_conditions(self, unavailable: Set[str], medication_map) -> List[str]:
+        context_parts = []
         relevant_statuses = [
             ConditionClinicalStatus.ACTIVE,
             ConditionClinicalStatus.RECURRENCE,
             ConditionClinicalStatus.RELAPSE,
-            None 
+            None
         ]
-        
+
         active_conditions = [
-            c for c in self.conditions
-            if c.clinical_status in relevant_statuses
-            and c.verification_status not in [ConditionVerificationStatus.REFUTED, ConditionVerificationStatus.ENTERED_IN_ERROR]
+            c for c in self._condition_index.select(relevant_statuses)
+            if c.verification_status not in [ConditionVerificationStatus.REFUTED, ConditionVerificationStatus.ENTERED_IN_ERROR]
         ]
 
         if active_conditions:
             active_conditions.sort(key=lambda x: x.onset_date or datetime.min)
             context_parts.append("\n### ACTIVE CONDITIONS (PROBLEM LIST)")
-            
+
             # Deduplication based on final string
             seen_conditions = set()
             for cond in active_conditions:
@@ -316,41 +540,21 @@ class AppPatient:
                 if s and s not in seen_conditions:
                     context_parts.append(s)
                     seen_conditions.add(s)
+        elif 'Condition' in unavailable:
+            context_parts.append(f"\n### ACTIVE CONDITIONS (PROBLEM LIST)\n{UNAVAILABLE_NOTE}")
         else:
              context_parts.append("\n### ACTIVE CONDITIONS (PROBLEM LIST)\n- No active conditions reported")
+        return context_parts
 
-        # --- PROCEDURES HISTORY ---
-        valid_statuses = [ProcedureStatus.COMPLETED, ProcedureStatus.IN_PROGRESS, None]
-        
-        valid_procedures = [
-            p for p in self.procedures 
-            if p.status in valid_statuses
-        ]
-
-        if valid_procedures:
+    def _render_procedures(self, unavailable: Set[str], medication_map) -> List[str]:
+        context_parts = []
+        # Valid procedures are grouped while adding:
+        # Key = (Name, CodeString) -> Value = [Dates] (sorted)
+        if self._has_valid_procedures:
             context_parts.append("\n### PROCEDURES HISTORY")
-            
-            # Grouping: Key = (Name, CodeString) -> Value = [Dates]
-            from collections import defaultdict
-            proc_groups = defaultdict(list)
-            
-            # List for undated procedures (rare but possible)
-            undated_procs = []
-
-            for p in valid_procedures:
-                name = p.code_text or "Unknown Procedure"
-                codes = p.simple_code_str
-                
-                if p.start_date:
-                    proc_groups[(name, codes)].append(p.start_date)
-                else:
-                    # If undated, use standard method and save separately
-                    undated_procs.append(p.to_prompt_string())
 
             # Formatting grouped dates
-            for (name, codes), dates in proc_groups.items():
-                dates.sort()
-                
+            for (name, codes), dates in self._procedure_groups.items():
                 if len(dates) == 1:
                     # Single case: Show simple date
                     date_display = f" [Date: {dates[0].strftime('%Y-%m-%d')}]"
@@ -364,43 +568,25 @@ class AppPatient:
                     first = dates[0].strftime('%Y-%m-%d')
                     last = dates[-1].strftime('%Y-%m-%d')
                     date_display = f" (Count: {len(dates)} occurrences, Range: {first} to {last})"
-                
+
                 context_parts.append(f"- {name}{date_display}{codes}")
 
-            # Add undated procedures (if any)
-            # Use set to deduplicate exact strings
-            if undated_procs:
-                for s in sorted(list(set(undated_procs))):
-                    context_parts.append(s)
-        
-        # --- IMMUNIZATIONS ---
-        valid_immunizations = [
-            i for i in self.immunizations 
-            if i.status == ImmunizationStatus.COMPLETED
-        ]
+            # Add undated procedures (if any), deduplicated
+            for s in sorted(self._undated_procedures):
+                context_parts.append(s)
+        elif 'Procedure' in unavailable:
+            context_parts.append(f"\n### PROCEDURES HISTORY\n{UNAVAILABLE_NOTE}")
+        return context_parts
 
-        if valid_immunizations:
+    def _render_immunizations(self, unavailable: Set[str], medication_map) -> List[str]:
+        context_parts = []
+        # Completed immunizations are grouped while adding:
+        # Key = (Name, CodeString) -> Value = [Dates] (sorted oldest to newest)
+        if self._has_completed_immunizations:
             context_parts.append("\n### IMMUNIZATION HISTORY")
-            
-            # Grouping Dictionary: Key = (Name, CodeString) -> Value = [Dates]
-            from collections import defaultdict
-            vaccine_groups = defaultdict(list)
-            
-            for imm in valid_immunizations:
-                name = imm.code_text or "Unknown Vaccine"
-                code_str = imm.simple_code_str 
-                
-                # Use tuple as unique key for vaccine
-                key = (name, code_str)
-                
-                if imm.occurrence_date:
-                    vaccine_groups[key].append(imm.occurrence_date)
-            
+
             # Iterate groups and format output intelligently
-            for (name, codes), dates in vaccine_groups.items():
-                # Sort dates oldest to newest
-                dates.sort()
-                
+            for (name, codes), dates in self._immunization_groups.items():
                 # Date formatting
                 if not dates:
                     date_display = ""
@@ -412,77 +598,59 @@ class AppPatient:
                     # NORMAL CASE: Show all dates
                     date_strings = [d.strftime('%Y-%m-%d') for d in dates]
                     date_display = f" (Dates: {', '.join(date_strings)})"
-                
+
                 # Final grouped output
                 context_parts.append(f"- {name}{date_display}{codes}")
+        elif 'Immunization' in unavailable:
+            context_parts.append(f"\n### IMMUNIZATION HISTORY\n{UNAVAILABLE_NOTE}")
+        return context_parts
 
-        # --- MEDICATION REQUESTS ---
+    def _render_medications(self, unavailable: Set[str], medication_map) -> List[str]:
+        context_parts = []
         valid_statuses = [MedicationRequestStatus.ACTIVE, MedicationRequestStatus.ON_HOLD]
-        
-        current_meds = [
-            m for m in self.medication_requests 
-            if m.status in valid_statuses
-        ]
+
+        current_meds = self._medication_request_index.select(valid_statuses)
 
         if current_meds:
             context_parts.append("\n### CURRENT MEDICATIONS (ACTIVE)")
-            
+            if 'Medication' in unavailable:
+                context_parts.append("- Note: medication details could not be retrieved, some names may be missing")
+
             # Sort by prescription date (newest first)
             current_meds.sort(key=lambda x: x.authored_on or datetime.min, reverse=True)
-            
+
             # Deduplication based on generated string
             seen_meds = set()
             for med in current_meds:
                 # Pass map to resource method
                 s = med.to_prompt_string(medication_map)
-                
+
                 if s and s not in seen_meds:
                     context_parts.append(s)
                     seen_meds.add(s)
+        elif 'MedicationRequest' in unavailable:
+            context_parts.append(f"\n### CURRENT MEDICATIONS (ACTIVE)\n{UNAVAILABLE_NOTE}")
         else:
              context_parts.append("\n### CURRENT MEDICATIONS (ACTIVE)\n- No active medications")
+        return context_parts
 
-        # --- OBSERVATIONS ---
-        valid_obs = [
-            o for o in self.observations 
-            if o.status in [ObservationStatus.FINAL, ObservationStatus.AMENDED, ObservationStatus.CORRECTED]
-        ]
-
-        if valid_obs:
-            # Group by (Name) -> List
-            obs_groups = {}
-            for o in valid_obs:
-                key = o.code_text or "Unknown"
-                if key not in obs_groups:
-                    obs_groups[key] = []
-                obs_groups[key].append(o)
-
-            # Snapshot (Take only the most recent for each type)
-            latest_observations = []
-            for key, obs_list in obs_groups.items():
-                # Sort by date (oldest to newest)
-                obs_list.sort(key=lambda x: x.effective_date or datetime.min)
-                latest_observations.append(obs_list[-1])
+    def _render_observations(self, unavailable: Set[str], medication_map) -> List[str]:
+        context_parts = []
+        # Latest valid Observation per name (vectorized selection)
+        store = self.observation_store
+        latest_rows = store.latest_per_name(store.select(statuses=CONTEXT_OBSERVATION_STATUSES))
 
+        if len(latest_rows):
             # Categorization (Bucketing)
-            vitals_list = []
-            labs_list = []
-            social_list = []
-            other_list = [] # Survey, Imaging, Exam, Procedure, etc.
-
-            for o in latest_observations:
-                cat = o.category
-                
-                if cat == ObservationCategory.VITAL_SIGNS:
-                    vitals_list.append(o)
-                elif cat == ObservationCategory.LABORATORY:
-                    labs_list.append(o)
-                elif cat == ObservationCategory.SOCIAL_HISTORY:
-                    social_list.append(o)
-                else:
-                    # Group Imaging, Exam, Survey, Procedure into one block "Findings"
-                    other_list.append(o)
-            
+            buckets = store.split_by_category(latest_rows, [
+                ObservationCategory.VITAL_SIGNS, ObservationCategory.LABORATORY, ObservationCategory.SOCIAL_HISTORY
+            ])
+            vitals_list = store.observations(buckets[ObservationCategory.VITAL_SIGNS])
+            labs_list = store.observations(buckets[ObservationCategory.LABORATORY])
+            social_list = store.observations(buckets[ObservationCategory.SOCIAL_HISTORY])
+            # Group Imaging, Exam, Survey, Procedure into one block "Findings"
+            other_list = store.observations(buckets[None])
+
             # Helper Print Function
             def print_obs_section(title, items):
                 if items:
@@ -497,18 +665,20 @@ class AppPatient:
             print_obs_section("SOCIAL HISTORY & LIFESTYLE", social_list)
             print_obs_section("LATEST LABORATORY RESULTS", labs_list)
             print_obs_section("OTHER CLINICAL FINDINGS (Surveys, Imaging, Exams)", other_list)
+        elif 'Observation' in unavailable:
+            context_parts.append(f"\n### OBSERVATIONS\n{UNAVAILABLE_NOTE}")
+        return context_parts
+
+    def _render_latest_note(self, unavailable: Set[str], medication_map) -> List[str]:
+        context_parts = []
+        # Candidates are chosen by date from the metadata: only the notes of the
+        # newest reports are decoded, until one has text content
+        text_reports = sorted(self._text_reports, key=lambda x: x.effective_date or datetime.min)
+        latest_report = next((r for r in reversed(text_reports) if r.report_text), None)
 
-        # --- DIAGNOSTIC REPORT (Latest Clinical Note) ---
-        text_reports = []
-        for r in self.diagnostic_reports:
-            # Check if report has text content
-            if r.report_text:
-                text_reports.append(r)
-                
-        if text_reports:
-            text_reports.sort(key=lambda x: x.effective_date or datetime.min)            
-            latest_report = text_reports[-1]
+        if latest_report:
             context_parts.append("\n### LATEST CLINICAL NOTE")
             context_parts.append(latest_report.to_prompt_string())
-
-        return "\n".join(context_parts)
\ No newline at end of file
+        elif 'DiagnosticReport' in unavailable:
+            context_parts.append(f"\n### LATEST CLINICAL NOTE\n{UNAVAILABLE_NOTE}")
+        return context_parts
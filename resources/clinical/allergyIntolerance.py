@@ -14,7 +14,8 @@ from fhir.resources.allergyintolerance import AllergyIntolerance as FhirAllergyI
 from enum import Enum
 from typing import Optional, List, Dict
 
-from resources.core.types import AppCodeableConcept
+from resources.core.types import AppCodeableConcept, MemoizedResource, memoized_property
+from resources.core.model_view import parse_fhir_resource
 
 class AllergyClinicalStatus(str, Enum):
     ACTIVE = "active"
@@ -96,28 +97,29 @@ class AllergyCriticality(str, Enum):
         }
         return definitions.get(self.value, "Definition not available.")
 
-class AppAllergyIntolerance:
+class AppAllergyIntolerance(MemoizedResource):
+    FHIR_ELEMENTS = ['clinicalStatus', 'verificationStatus', 'type', 'category', 'criticality', 'code', 'patient']
 
     def __init__(self, raw_json_data: dict):
-        self.resource = FhirAllergyIntolerance(**raw_json_data)
+        self.resource = parse_fhir_resource(FhirAllergyIntolerance, raw_json_data)
 
     @property
     def id(self):
         return self.resource.id
 
-    @property
+    @memoized_property
     def clinical_status(self) -> Optional[AllergyClinicalStatus]:
         if not self.resource.clinicalStatus:
             return None    
         return AppCodeableConcept(self.resource.clinicalStatus).bind_to(AllergyClinicalStatus)
     
-    @property
+    @memoized_property
     def verification_status(self) -> Optional[AllergyVerificationStatus]:
         if not self.resource.verificationStatus:
             return None 
         return AppCodeableConcept(self.resource.verificationStatus).bind_to(AllergyVerificationStatus)
 
-    @property
+    @memoized_property
     def type(self) -> Optional[AllergyType]:
         if not self.resource.type: 
             return None
@@ -126,7 +128,7 @@ class AppAllergyIntolerance:
         except ValueError: 
             return None
 
-    @property
+    @memoized_property
     def category(self) -> Optional[AllergyCategory]:
         if not self.resource.category:
             return None
@@ -137,7 +139,7 @@ class AppAllergyIntolerance:
                 continue
         return None
 
-    @property
+    @memoized_property
     def criticality(self) -> Optional[AllergyCriticality]:
         if not self.resource.criticality: 
             return None
@@ -146,13 +148,13 @@ class AppAllergyIntolerance:
         except ValueError: 
             return None
 
-    @property
+    @memoized_property
     def code_text(self) -> Optional[str]:
         if not self.resource.code: 
             return None
         return AppCodeableConcept(self.resource.code).readable_value
 
-    @property
+    @memoized_property
     def code_details(self) -> List[Dict[str, Optional[str]]]:
         if not self.resource.code: 
             return []    
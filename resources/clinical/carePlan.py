@@ -15,7 +15,8 @@ from enum import Enum
 from typing import Optional, List, Dict
 from datetime import datetime
 
-from resources.core.types import AppCodeableConcept
+from resources.core.types import AppCodeableConcept, MemoizedResource, memoized_property
+from resources.core.model_view import parse_fhir_resource
 
 class CarePlanStatus(str, Enum):
     DRAFT = "draft"
@@ -85,16 +86,17 @@ class CarePlanActivityStatus(str, Enum):
         return definitions.get(self.value, "Definition not available.")
 
 
-class AppCarePlan:
+class AppCarePlan(MemoizedResource):
+    FHIR_ELEMENTS = ['status', 'intent', 'category', 'period', 'activity', 'subject']
 
     def __init__(self, raw_json_data: dict):
-        self.resource = FhirCarePlan(**raw_json_data)
+        self.resource = parse_fhir_resource(FhirCarePlan, raw_json_data)
 
     @property
     def id(self):
         return self.resource.id
 
-    @property
+    @memoized_property
     def status(self) -> Optional[CarePlanStatus]:
         if not self.resource.status: 
             return None
@@ -103,7 +105,7 @@ class AppCarePlan:
         except ValueError: 
             return None
 
-    @property
+    @memoized_property
     def intent(self) -> Optional[CarePlanIntent]:
         if not self.resource.intent: 
             return None
@@ -112,7 +114,7 @@ class AppCarePlan:
         except ValueError: 
             return None
 
-    @property
+    @memoized_property
     def category_text(self) -> Optional[str]:
         if not self.resource.category: 
             return None
@@ -121,19 +123,19 @@ class AppCarePlan:
             if val: return val
         return None
 
-    @property
+    @memoized_property
     def start_date(self) -> Optional[datetime]:
         if self.resource.period and self.resource.period.start:
             return self.resource.period.start
         return None
 
-    @property
+    @memoized_property
     def end_date(self) -> Optional[datetime]:
         if self.resource.period and self.resource.period.end:
             return self.resource.period.end
         return None
 
-    @property
+    @memoized_property
     def activities_summary(self) -> List[Dict]:
         if not self.resource.activity:
             return []
@@ -14,7 +14,8 @@ from enum import Enum
 from datetime import datetime
 from typing import Optional, List, Dict
 
-from resources.core.types import AppCodeableConcept
+from resources.core.types import AppCodeableConcept, MemoizedResource, memoized_property
+from resources.core.model_view import parse_fhir_resource
 
 class ConditionClinicalStatus(str, Enum):
     ACTIVE = "active"
@@ -74,27 +75,29 @@ class ConditionCategory(str, Enum):
         }
         return definitions.get(self.value, "Definition not available.")
 
-class AppCondition:
+class AppCondition(MemoizedResource):
+    FHIR_ELEMENTS = ['clinicalStatus', 'verificationStatus', 'category', 'code', 'onset', 'abatement', 'subject']
+
     def __init__(self, raw_json_data: dict):
-        self.resource = FhirCondition(**raw_json_data)
+        self.resource = parse_fhir_resource(FhirCondition, raw_json_data)
 
     @property
     def id(self):
         return self.resource.id
 
-    @property
+    @memoized_property
     def clinical_status(self) -> Optional[ConditionClinicalStatus]:
         if not self.resource.clinicalStatus:
             return None    
         return AppCodeableConcept(self.resource.clinicalStatus).bind_to(ConditionClinicalStatus)
     
-    @property
+    @memoized_property
     def verification_status(self) -> Optional[ConditionVerificationStatus]:
         if not self.resource.verificationStatus:
             return None 
         return AppCodeableConcept(self.resource.verificationStatus).bind_to(ConditionVerificationStatus)
 
-    @property
+    @memoized_property
     def category(self) -> Optional[ConditionCategory]:
         if not self.resource.category:
             return None
@@ -104,23 +107,23 @@ class AppCondition:
                 return found_enum
         return None
 
-    @property
+    @memoized_property
     def code_text(self) -> Optional[str]:
         if not self.resource.code:
             return None
         return AppCodeableConcept(self.resource.code).readable_value
 
-    @property
+    @memoized_property
     def code_details(self) -> List[Dict[str, Optional[str]]]:
         if not self.resource.code:
             return []    
         return AppCodeableConcept(self.resource.code).coding_details
 
-    @property
+    @memoized_property
     def onset_date(self) -> Optional[datetime]:
         return self.resource.onsetDateTime
 
-    @property
+    @memoized_property
     def abatement_date(self) -> Optional[datetime]:
         return self.resource.abatementDateTime
 
@@ -12,10 +12,12 @@ Group: Carmine Vardaro, Marco Savastano, Francesco Ferrara.
 from fhir.resources.procedure import Procedure as FhirProcedure
 
 from enum import Enum
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, NamedTuple
 from datetime import datetime
 
-from resources.core.types import AppCodeableConcept
+from resources.core.types import AppCodeableConcept, MemoizedResource, memoized_property
+from resources.core.model_view import parse_fhir_resource
+from resources.core.records import CodePairs, code_pairs, format_code_pairs
 
 class ProcedureStatus(str, Enum):
     PREPARATION = "preparation"
@@ -42,15 +44,42 @@ class ProcedureStatus(str, Enum):
         }
         return definitions.get(self.value, "Definition not available.")
 
-class AppProcedure:
+class ProcedureRecord(NamedTuple):
+    """
+    Compact, immutable form of an AppProcedure (see AppProcedure.to_record).
+    """
+    id: Optional[str]
+    status: Optional[ProcedureStatus]
+    code_text: Optional[str]
+    codes: CodePairs
+    start_date: Optional[datetime]
+    end_date: Optional[datetime]
+
+    @property
+    def simple_code_str(self) -> str:
+        return format_code_pairs(self.codes)
+
+    def to_prompt_string(self) -> str:
+        # Fallback method (used for single instance printing)
+        name = self.code_text or "Unknown Procedure"
+
+        date_str = ""
+        if self.start_date:
+            date_str = f" [Date: {self.start_date.strftime('%Y-%m-%d')}]"
+            
+        return f"- {name}{date_str}{self.simple_code_str}"
+
+class AppProcedure(MemoizedResource):
+    FHIR_ELEMENTS = ['status', 'category', 'code', 'performed', 'subject']
+
     def __init__(self, raw_json_data: dict):
-        self.resource = FhirProcedure(**raw_json_data)
+        self.resource = parse_fhir_resource(FhirProcedure, raw_json_data)
 
     @property
     def id(self):
         return self.resource.id
 
-    @property
+    @memoized_property
     def status(self) -> Optional[ProcedureStatus]:
         if not self.resource.status:
             return None
@@ -59,61 +88,55 @@ class AppProcedure:
         except ValueError:
             return None
 
-    @property
+    @memoized_property
     def category_text(self) -> Optional[str]:
         if not self.resource.category:
             return None
         return AppCodeableConcept(self.resource.category).readable_value
 
-    @property
+    @memoized_property
     def category_details(self) -> List[Dict[str, Optional[str]]]:
         if not self.resource.category:
             return []    
         return AppCodeableConcept(self.resource.category).coding_details
 
-    @property
+    @memoized_property
     def code_text(self) -> Optional[str]:
         if not self.resource.code:
             return None
         return AppCodeableConcept(self.resource.code).readable_value
 
-    @property
+    @memoized_property
     def code_details(self) -> List[Dict[str, Optional[str]]]:
         if not self.resource.code:
             return []    
         return AppCodeableConcept(self.resource.code).coding_details
 
-    @property
+    @memoized_property
     def start_date(self) -> Optional[datetime]:
         if self.resource.performedPeriod and self.resource.performedPeriod.start:
             return self.resource.performedPeriod.start
         return None
 
-    @property
+    @memoized_property
     def end_date(self) -> Optional[datetime]:
         if self.resource.performedPeriod and self.resource.performedPeriod.end:
             return self.resource.performedPeriod.end
         return None
 
-    @property
+    @memoized_property
     def simple_code_str(self) -> str:
         """
         Helper property to generate a standardized code string for grouping purposes.
         """
-        if self.code_details:
-            code_parts = []
-            for c in self.code_details:
-                # Direct syntax formatting
-                code_parts.append(f"[{c['system']}: {c['code']}]")
-            return " " + " ".join(code_parts)
-        return ""
+        return format_code_pairs(code_pairs(self.code_details))
 
-    def to_prompt_string(self) -> str:
-        # Fallback method (used for single instance printing)
-        name = self.code_text or "Unknown Procedure"
+    def to_record(self) -> ProcedureRecord:
+        """
+        Extracts the fields used by the clinical context (the record does not keep the FHIR model alive).
+        """
+        return ProcedureRecord(self.id, self.status, self.code_text, code_pairs(self.code_details),
+                               self.start_date, self.end_date)
 
-        date_str = ""
-        if self.start_date:
-            date_str = f" [Date: {self.start_date.strftime('%Y-%m-%d')}]"
-            
-        return f"- {name}{date_str}{self.simple_code_str}"
\ No newline at end of file
+    def to_prompt_string(self) -> str:
+        return self.to_record().to_prompt_string()
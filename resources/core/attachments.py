@@ -0,0 +1,66 @@
+'''
+Script: attachments.py
+Digital Health Systems and Applications - Project work 2025-2026
+Description:
+Decoding of the base64 text attachments (clinical notes) of DiagnosticReport and
+DocumentReference. The data is decoded in chunks and decoding stops once the byte
+cap is reached, so a huge attachment cannot stall the opening of a patient; a
+truncated note ends with a marker line.
+
+Group: Carmine Vardaro, Marco Savastano, Francesco Ferrara.
+'''
+
+import base64
+import binascii
+import codecs
+import os
+from typing import Optional, Union
+
+# Maximum number of decoded bytes kept from a text attachment (0: no limit)
+NOTE_MAX_BYTES = int(os.getenv("FHIR_NOTE_MAX_BYTES", "262144"))
+
+# Base64 characters decoded per step (a multiple of 4)
+_DECODE_CHUNK_CHARS = 64 * 1024
+
+TRUNCATION_MARKER = "[... note truncated]"
+
+def decode_text_attachment(data: Union[str, bytes], max_bytes: Optional[int] = None) -> str:
+    """
+    Decodes base64 UTF-8 text, keeping at most max_bytes decoded bytes (default
+    NOTE_MAX_BYTES), and returns its non-empty lines, stripped.
+    Raises ValueError if the data is not valid base64 or UTF-8.
+    """
+    if max_bytes is None:
+        max_bytes = NOTE_MAX_BYTES
+    if isinstance(data, str):
+        data = data.encode('ascii')
+    if any(ch in data for ch in b' \t\r\n'):
+        # Whitespace anywhere (line-wrapped base64): chunks must be aligned on the
+        # encoded characters only
+        data = data.translate(None, b' \t\r\n')
+
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    parts = []
+    decoded_size = 0
+    truncated = False
+    try:
+        for start in range(0, len(data), _DECODE_CHUNK_CHARS):
+            chunk = base64.b64decode(data[start:start + _DECODE_CHUNK_CHARS])
+            if max_bytes and decoded_size + len(chunk) > max_bytes:
+                chunk = chunk[:max_bytes - decoded_size]
+                truncated = True
+            decoded_size += len(chunk)
+            is_last = start + _DECODE_CHUNK_CHARS >= len(data)
+            # An incomplete character at the cut is dropped by not finalizing the decoder
+            parts.append(decoder.decode(chunk, final=is_last and not truncated))
+            if truncated:
+                break
+    except (binascii.Error, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid text attachment: {e}") from e
+
+    raw_text = "".join(parts)
+    if truncated:
+        # The last line may be cut in the middle
+        raw_text = raw_text.rsplit("\n", 1)[0] + "\n" + TRUNCATION_MARKER
+    # Basic cleaning of empty lines
+    return "\n".join(line.strip() for line in raw_text.splitlines() if line.strip())
@@ -0,0 +1,141 @@
+'''
+Script: model_view.py
+Digital Health Systems and Applications - Project work 2025-2026
+Description:
+Fast construction path for the resource wrappers. The resources come from the FHIR
+server, which has already validated them, so by default the wrappers do not build a
+fully validated fhir.resources model: they get a thin read-only view over the raw JSON
+that exposes the same attributes (nested elements as views, lists as lists, dates,
+instants and decimals converted to the same Python types). Each attribute is
+converted only when first read, so building a wrapper costs almost nothing.
+Strict pydantic validation is still available with FHIR_STRICT_VALIDATION=1.
+The views read the field metadata of the pydantic v1 models (fhir.resources 6.x);
+with other versions these internals are missing and every resource is parsed with
+strict validation instead.
+
+Group: Carmine Vardaro, Marco Savastano, Francesco Ferrara.
+'''
+
+import os
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional, Tuple, Type
+
+from fhir.resources import fhirtypes, get_fhir_model_class
+
+try:
+    # Field metadata of the pydantic v1 models, read by the views
+    from pydantic.fields import SHAPE_SINGLETON
+except ImportError:
+    SHAPE_SINGLETON = None
+
+# Validate every resource with fhir.resources instead of using the fast views
+STRICT_VALIDATION = os.getenv("FHIR_STRICT_VALIDATION", "0") == "1"
+
+def _date_time(value):
+    # Full timestamps (the vast majority) are parsed natively; partial dates and
+    # anything fromisoformat rejects go through the fhir.resources validator
+    if isinstance(value, str) and len(value) > 10:
+        try:
+            return datetime.fromisoformat(value)
+        except ValueError:
+            pass
+    return fhirtypes.DateTime.validate(value)
+
+def _instant(value):
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return fhirtypes.Instant.validate(value)
+
+def _base64(value):
+    return value.encode() if isinstance(value, str) else value
+
+# Primitive types whose Python value differs from the JSON one
+try:
+    _PRIMITIVE_CONVERTERS: Dict[type, Callable[[Any], Any]] = {
+        fhirtypes.Date: fhirtypes.Date.validate,
+        fhirtypes.DateTime: _date_time,
+        fhirtypes.Instant: _instant,
+        fhirtypes.Time: fhirtypes.Time.validate,
+        fhirtypes.Decimal: next(fhirtypes.Decimal.__get_validators__()),
+        fhirtypes.Boolean: next(fhirtypes.Boolean.__get_validators__()),
+        fhirtypes.Base64Binary: _base64,
+    }
+except AttributeError:
+    _PRIMITIVE_CONVERTERS = {}
+
+# The views need the pydantic v1 internals; without them the resources are always validated
+VIEWS_SUPPORTED = SHAPE_SINGLETON is not None and bool(_PRIMITIVE_CONVERTERS)
+if not VIEWS_SUPPORTED:
+    print("[WARNING] Installed pydantic/fhir.resources do not expose the pydantic v1 field metadata: "
+          "resources are parsed with strict validation.")
+
+# (model class, attribute) -> (JSON key, is a list, element converter), or None if unknown
+_field_cache: Dict[Tuple[type, str], Optional[Tuple[str, bool, Callable[[Any], Any]]]] = {}
+
+def _element_converter(field_type) -> Callable[[Any], Any]:
+    resource_type = getattr(field_type, '__resource_type__', None)
+    if resource_type is None:
+        return _PRIMITIVE_CONVERTERS.get(field_type, lambda value: value)
+    if resource_type == 'Resource':
+        # Contained resources: the concrete type is in the JSON
+        return lambda value: FhirModelView(get_fhir_model_class(value['resourceType']), value)
+    model_class = get_fhir_model_class(resource_type)
+    return lambda value: FhirModelView(model_class, value)
+
+def _field_info(model_class: type, name: str):
+    key = (model_class, name)
+    if key not in _field_cache:
+        field = model_class.__fields__.get(name)
+        _field_cache[key] = None if field is None else (
+            field.alias, field.shape != SHAPE_SINGLETON, _element_converter(field.type_)
+        )
+    return _field_cache[key]
+
+class FhirModelView:
+    """
+    Read-only, unvalidated view over the raw JSON of a FHIR resource or element,
+    with the attribute names and value types of the matching fhir.resources model.
+    Missing elements read as None; unknown attribute names raise AttributeError.
+    A converted attribute is stored on the instance, so later reads are plain
+    attribute lookups.
+    """
+    def __init__(self, model_class: type, data: dict):
+        self._model_class = model_class
+        self._data = data
+
+    def __getattr__(self, name: str):
+        # Only called for attributes not converted yet
+        if name.startswith('_'):
+            raise AttributeError(name)
+        info = _field_info(self._model_class, name)
+        if info is None:
+            raise AttributeError(f"{self._model_class.__name__} has no element '{name}'")
+        json_key, is_list, convert = info
+        raw = self._data.get(json_key)
+        if raw is None:
+            value = None
+        elif is_list:
+            value = [convert(item) for item in raw]
+        else:
+            value = convert(raw)
+        self.__dict__[name] = value
+        return value
+
+    def __repr__(self) -> str:
+        return f"FhirModelView({self._model_class.__name__}, {self._data!r})"
+
+def parse_fhir_resource(model_class: Type, raw_json_data: dict, strict: Optional[bool] = None):
+    """
+    Returns the validated fhir.resources model of a raw resource (strict mode,
+    default STRICT_VALIDATION, always used if VIEWS_SUPPORTED is False) or a
+    FhirModelView over it. Raises if the JSON holds another resource type.
+    """
+    if strict is None:
+        strict = STRICT_VALIDATION
+    if strict or not VIEWS_SUPPORTED:
+        return model_class(**raw_json_data)
+    resource_type = raw_json_data.get('resourceType')
+    if resource_type is not None and resource_type != model_class.get_resource_type():
+        raise ValueError(f"Expected a {model_class.get_resource_type()} resource, got {resource_type}")
+    return FhirModelView(model_class, raw_json_data)
@@ -0,0 +1,32 @@
+'''
+Script: records.py
+Digital Health Systems and Applications - Project work 2025-2026
+Description:
+Shared helpers of the compact records. For the high-volume resource types
+(Observation, Procedure, Immunization, MedicationRequest) the wrappers can be
+reduced with to_record() to an immutable NamedTuple that keeps only the fields
+used by the clinical context. The record does not reference the FHIR model or the
+raw JSON, which can then be released. Records and wrappers share the same prompt
+formatting.
+
+Group: Carmine Vardaro, Marco Savastano, Francesco Ferrara.
+'''
+
+from typing import Dict, List, Optional, Tuple
+
+# (system, code) pairs of a CodeableConcept, with the system already cleaned (e.g. "LOINC")
+CodePairs = Tuple[Tuple[str, str], ...]
+
+def code_pairs(coding_details: List[Dict[str, Optional[str]]]) -> CodePairs:
+    """
+    Reduces AppCodeableConcept.coding_details to its (system, code) pairs.
+    """
+    return tuple((c['system'], c['code']) for c in coding_details)
+
+def format_code_pairs(codes: CodePairs) -> str:
+    """
+    Formats the codes as in the clinical context, e.g. " [SNOMED: 1234] [ICD-10: X1]".
+    """
+    if not codes:
+        return ""
+    return " " + " ".join(f"[{system}: {code}]" for system, code in codes)
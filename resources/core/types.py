@@ -5,25 +5,122 @@ Description:
 Helper class to handle HL7 FHIR CodeableConcept elements. It provides methods to
 extract readable text, clean system names (e.g., SNOMED, LOINC), and bind
 codes to Python Enums for easier logic handling.
+System names and enum bindings are resolved through shared lookup tables, and
+codes are interned, so building a concept costs dictionary hits only.
+It also provides the memoization layer of the resource wrappers: derived
+properties computed once per wrapper and dropped when the resource is replaced.
 
 Group: Carmine Vardaro, Marco Savastano, Francesco Ferrara.
 '''
 
+import sys
 from enum import Enum
-from typing import Optional, List, Dict, Type, TypeVar
+from functools import lru_cache
+from typing import Optional, List, Dict, Tuple, Type, TypeVar
 
 from fhir.resources.codeableconcept import CodeableConcept
 from fhir.resources.coding import Coding
 
 T = TypeVar('T', bound=Enum)
 
+class memoized_property:
+    """
+    Property computed on first access and then stored on the instance, so later
+    reads are plain attribute lookups. Unlike functools.cached_property it takes
+    no lock, so wrappers can be read from several threads without contention
+    (two threads may compute the same value once each, with the same result).
+    """
+    def __init__(self, func):
+        self.func = func
+        self.name = func.__name__
+        self.__doc__ = func.__doc__
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        value = instance.__dict__[self.name] = self.func(instance)
+        return value
+
+_memoized_names_by_class: Dict[type, Tuple[str, ...]] = {}
+
+def _memoized_names(cls: type) -> Tuple[str, ...]:
+    if cls not in _memoized_names_by_class:
+        _memoized_names_by_class[cls] = tuple(
+            name for klass in cls.__mro__ for name, value in vars(klass).items()
+            if isinstance(value, memoized_property)
+        )
+    return _memoized_names_by_class[cls]
+
+class MemoizedResource:
+    """
+    Base class of the resource wrappers. Derived properties declared with
+    @memoized_property are computed once; assigning a new `resource` drops them.
+    """
+    def __setattr__(self, name, value):
+        if name == 'resource':
+            self.reset_memoized()
+        object.__setattr__(self, name, value)
+
+    def reset_memoized(self, *names: str):
+        """
+        Drops the given memoized values (all of them if no name is given).
+        """
+        for name in names or _memoized_names(type(self)):
+            self.__dict__.pop(name, None)
+
+# Substring of a system URI (lower-case) -> standard short name, checked in order
+_SYSTEM_NAMES = (
+    ("snomed", "SNOMED"),
+    ("loinc", "LOINC"),
+    ("rxnorm", "RxNorm"),
+    ("icd-9", "ICD-9"),
+    ("icd-10", "ICD-10"),
+    ("unitsofmeasure", "UCUM"),
+    ("ucum", "UCUM"),
+    ("cvx", "CVX"),
+    ("ndc", "NDC"),
+    ("cpt", "CPT"),
+)
+
+@lru_cache(maxsize=1024)
+def clean_system_name(uri: str) -> str:
+    """
+    Normalizes a FHIR system URI into a readable standard name (e.g., SNOMED, LOINC),
+    or returns it unchanged. Results are cached: a record uses only a few systems.
+    """
+    uri_lower = uri.lower()
+    for fragment, name in _SYSTEM_NAMES:
+        if fragment in uri_lower:
+            return name
+    return sys.intern(uri)
+
+def intern_code(code: str) -> str:
+    """
+    Interns a code string, so the many copies of common codes share one object.
+    """
+    return sys.intern(code)
+
+_enum_members_by_class: Dict[type, Dict[str, Enum]] = {}
+
+def _enum_members(enum_class: Type[T]) -> Dict[str, T]:
+    """
+    Returns the {value: member} lookup table of an Enum class (built once).
+    """
+    members = _enum_members_by_class.get(enum_class)
+    if members is None:
+        members = _enum_members_by_class[enum_class] = {member.value: member for member in enum_class}
+    return members
+
 class AppCodeableConcept:
     def __init__(self, source: CodeableConcept):
         self._source = source
         self.text: Optional[str] = getattr(source, "text", None)
         self.codings: List[Coding] = source.coding if source.coding else []
 
-    @property
+    @memoized_property
     def readable_value(self) -> Optional[str]:
         """
         Returns the most human-readable text available:
@@ -41,19 +138,9 @@ class AppCodeableConcept:
         """
         Normalizes FHIR system URIs into readable standard names (e.g., SNOMED, LOINC).
         """
-        uri_lower = uri.lower()
-        if "snomed" in uri_lower: return "SNOMED"
-        if "loinc" in uri_lower: return "LOINC"
-        if "rxnorm" in uri_lower: return "RxNorm"
-        if "icd-9" in uri_lower: return "ICD-9"
-        if "icd-10" in uri_lower: return "ICD-10"
-        if "unitsofmeasure" in uri_lower or "ucum" in uri_lower: return "UCUM"
-        if "cvx" in uri_lower: return "CVX"
-        if "ndc" in uri_lower: return "NDC"
-        if "cpt" in uri_lower: return "CPT"
-        return uri
-
-    @property
+        return clean_system_name(uri)
+
+    @memoized_property
     def coding_details(self) -> List[Dict[str, Optional[str]]]:
         """
         Extracts a list of coding details (system, code, display) for the concept.
@@ -62,10 +149,9 @@ class AppCodeableConcept:
         for coding in self.codings:
             if not coding.system or not coding.code:
                 continue
-            clean_sys = self._clean_system_name(coding.system)
             entry = {
-                "system": clean_sys,
-                "code": coding.code,
+                "system": clean_system_name(coding.system),
+                "code": intern_code(coding.code),
                 "display": coding.display  # It can be None
             }
             results.append(entry)
@@ -78,11 +164,11 @@ class AppCodeableConcept:
         """
         if not self.codings:
             return None
+        members = _enum_members(enum_class)
         for coding in self.codings:
             if not coding.code: continue
-            try:
-                # Case-insensitive matching is safer for some systems
-                return enum_class(coding.code.lower())
-            except ValueError:
-                continue
-        return None
\ No newline at end of file
+            # Case-insensitive matching is safer for some systems
+            member = members.get(coding.code.lower())
+            if member is not None:
+                return member
+        return None
@@ -11,12 +11,13 @@ Group: Carmine Vardaro, Marco Savastano, Francesco Ferrara.
 
 from fhir.resources.diagnosticreport import DiagnosticReport as FhirDiagnosticReport
 
-import base64
 from enum import Enum
 from typing import Optional, List, Dict
 from datetime import datetime
 
-from resources.core.types import AppCodeableConcept
+from resources.core.types import AppCodeableConcept, MemoizedResource, memoized_property
+from resources.core.model_view import parse_fhir_resource
+from resources.core.attachments import decode_text_attachment
 
 class DiagnosticReportStatus(str, Enum):
     REGISTERED = "registered"
@@ -47,16 +48,18 @@ class DiagnosticReportStatus(str, Enum):
         }
         return definitions.get(self.value, "Definition not available.")
     
-class AppDiagnosticReport:
-    
+class AppDiagnosticReport(MemoizedResource):
+    # 'presentedForm' holds the base64 notes used for the latest clinical note
+    FHIR_ELEMENTS = ['status', 'category', 'code', 'effective', 'conclusion', 'presentedForm']
+
     def __init__(self, raw_json_data: dict):
-        self.resource = FhirDiagnosticReport(**raw_json_data)
+        self.resource = parse_fhir_resource(FhirDiagnosticReport, raw_json_data)
 
     @property
     def id(self) -> str:
         return self.resource.id
 
-    @property
+    @memoized_property
     def status(self) -> DiagnosticReportStatus:
         if not self.resource.status:
             return None
@@ -65,7 +68,7 @@ class AppDiagnosticReport:
         except ValueError:
             return None
 
-    @property
+    @memoized_property
     def category_text(self) -> Optional[str]:
         if not self.resource.category: 
             return None
@@ -74,26 +77,39 @@ class AppDiagnosticReport:
             if val: return val
         return None
 
-    @property
+    @memoized_property
     def code_text(self) -> Optional[str]:
         if not self.resource.code: return None
         return AppCodeableConcept(self.resource.code).readable_value
 
-    @property
+    @memoized_property
     def code_details(self) -> List[Dict[str, Optional[str]]]:
         if not self.resource.code: return []    
         return AppCodeableConcept(self.resource.code).coding_details
 
-    @property
+    @memoized_property
     def effective_date(self) -> Optional[datetime]:
         return self.resource.effectiveDateTime  
 
-    @property
+    @memoized_property
+    def has_text(self) -> bool:
+        """
+        Tells from the metadata only (nothing is decoded) whether the report may have
+        a text: a conclusion or a non-empty text/plain attachment.
+        """
+        if self.resource.conclusion:
+            return True
+        return any(
+            attachment.contentType and attachment.contentType.startswith("text/plain") and attachment.data
+            for attachment in self.resource.presentedForm or []
+        )
+
+    @memoized_property
     def report_text(self) -> Optional[str]:
         """
         Extracts the textual content of the report. 
         It prioritizes the 'conclusion' field, then falls back to decoding 
-        base64 'presentedForm' attachments (text/plain).
+        base64 'presentedForm' attachments (text/plain), up to NOTE_MAX_BYTES.
         """
         if self.resource.conclusion:
             return self.resource.conclusion
@@ -109,13 +125,7 @@ class AppDiagnosticReport:
                     continue
 
                 try:
-                    b64_string = attachment.data
-                    decoded_bytes = base64.b64decode(b64_string)
-                    raw_text = decoded_bytes.decode('utf-8')
-                    
-                    # Basic cleaning of empty lines
-                    clean_lines = [line.strip() for line in raw_text.splitlines() if line.strip()]
-                    return "\n".join(clean_lines)
+                    return decode_text_attachment(attachment.data)
                 except Exception:
                     continue
         
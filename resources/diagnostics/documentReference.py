@@ -4,19 +4,22 @@ Digital Health Systems and Applications - Project work 2025-2026
 Description:
 Wrapper class for the HL7 FHIR DocumentReference resource. It manages document metadata
 (status, type, category) and handles the extraction and decoding of embedded
-Base64 text content for use in the clinical summary.
+Base64 text content for use in the clinical summary. The attachments (often large
+CDA documents) are not part of the search projection, since no context section
+renders them: resources downloaded with the projection have no text content.
 
 Group: Carmine Vardaro, Marco Savastano, Francesco Ferrara.
 '''
 
 from fhir.resources.documentreference import DocumentReference as FhirDocumentReference
 
-import base64
 from enum import Enum
 from typing import Optional, List, Dict
 from datetime import datetime
 
-from resources.core.types import AppCodeableConcept
+from resources.core.types import AppCodeableConcept, MemoizedResource, memoized_property
+from resources.core.model_view import parse_fhir_resource
+from resources.core.attachments import decode_text_attachment
 
 class DocumentReferenceStatus(str, Enum):
    CURRENT = "current"
@@ -33,15 +36,21 @@ class DocumentReferenceStatus(str, Enum):
       }
       return definitions.get(self.value, "Definition not available.")
 
-class AppDocumentReference:
+class AppDocumentReference(MemoizedResource):
+    # 'content' holds the base64 attachments, which the clinical context does not render
+    FHIR_ELEMENTS = ['status', 'type', 'category', 'date']
+
     def __init__(self, raw_json_data: dict):
-        self.resource = FhirDocumentReference(**raw_json_data)
+        # 'content' is required by the model: a projected resource gets an empty one
+        if 'content' not in raw_json_data:
+            raw_json_data = dict(raw_json_data, content=[])
+        self.resource = parse_fhir_resource(FhirDocumentReference, raw_json_data)
 
     @property
     def id(self):
         return self.resource.id
 
-    @property
+    @memoized_property
     def status(self) -> Optional[DocumentReferenceStatus]:
         if not self.resource.status:
             return None
@@ -50,19 +59,19 @@ class AppDocumentReference:
         except ValueError:
             return None
 
-    @property
+    @memoized_property
     def type_text(self) -> Optional[str]:
         if not self.resource.type:
             return None
         return AppCodeableConcept(self.resource.type).readable_value
 
-    @property
+    @memoized_property
     def type_details(self) -> List[Dict[str, Optional[str]]]:
         if not self.resource.type:
             return []    
         return AppCodeableConcept(self.resource.type).coding_details
 
-    @property
+    @memoized_property
     def category_text(self) -> Optional[str]:
         if not self.resource.category:
             return None
@@ -72,7 +81,7 @@ class AppDocumentReference:
                 return val
         return None
 
-    @property
+    @memoized_property
     def category_details(self) -> List[Dict[str, Optional[str]]]:
         if not self.resource.category:
             return []
@@ -82,15 +91,16 @@ class AppDocumentReference:
             all_details.extend(details)
         return all_details
 
-    @property
+    @memoized_property
     def date(self) -> Optional[datetime]:
         return self.resource.date
         
-    @property
+    @memoized_property
     def content_text(self) -> Optional[str]:
         """
-        Decodes Base64 encoded text content from the document attachment.
-        Only processes attachments with 'text/' content types.
+        Decodes Base64 encoded text content from the document attachment
+        (up to NOTE_MAX_BYTES). Only processes attachments with 'text/' content types.
+        None for resources downloaded without their content (_elements projection).
         """
         if not self.resource.content:
             return None
@@ -98,16 +108,11 @@ class AppDocumentReference:
             attachment = content_entry.attachment
             if not attachment or not attachment.data:
                 continue
-            if not attachment.contentType.startswith("text/"):
+            if not attachment.contentType or not attachment.contentType.startswith("text/"):
                 continue
             try:
-                b64_string = attachment.data
-                decoded_bytes = base64.b64decode(b64_string)
-                raw_text = decoded_bytes.decode('utf-8')
-                # Clean up empty lines
-                clean_lines = [line.strip() for line in raw_text.splitlines() if line.strip()]
-                return "\n".join(clean_lines)
-            except Exception as e:
+                return decode_text_attachment(attachment.data)
+            except Exception:
                 continue
         return None
 
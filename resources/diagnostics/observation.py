@@ -12,10 +12,12 @@ Group: Carmine Vardaro, Marco Savastano, Francesco Ferrara.
 from fhir.resources.observation import Observation as FhirObservation
 
 from enum import Enum
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, NamedTuple
 from datetime import datetime
 
-from resources.core.types import AppCodeableConcept
+from resources.core.types import AppCodeableConcept, MemoizedResource, memoized_property
+from resources.core.model_view import parse_fhir_resource
+from resources.core.records import CodePairs, code_pairs
 
 class ObservationStatus(str, Enum):
     REGISTERED = "registered"
@@ -69,15 +71,69 @@ class ObservationCategory(str, Enum):
         }
         return definitions.get(self.value, "Definition not available.")
 
-class AppObservation:
+class ObservationRecord(NamedTuple):
+    """
+    Compact, immutable form of an AppObservation (see AppObservation.to_record).
+    """
+    id: Optional[str]
+    status: Optional[ObservationStatus]
+    category: Optional[ObservationCategory]
+    code_text: Optional[str]
+    codes: CodePairs
+    value_text: Optional[str]
+    component_text: Optional[str]
+    effective_date: Optional[datetime]
+    numeric_value: Optional[float]
+    unit: Optional[str]
+
+    def to_prompt_string(self) -> str:
+        # Test Name
+        name = self.code_text or "Unknown Test"
+        
+        # Value (handles valueQuantity, valueString or Components)
+        value_str = ""
+        val = self.value_text
+        comps = self.component_text
+        
+        if val:
+            value_str = val
+        elif comps:
+            # For blood pressure or similar multi-component tests
+            value_str = f"[{comps}]"
+        else:
+            return "" # Useless if no result is available
+
+        # Date (Date only, no time, to save token space)
+        date_str = ""
+        if self.effective_date:
+            date_str = f" ({self.effective_date.strftime('%Y-%m-%d')})"
+
+        # Codes (Only essential LOINC codes)
+        code_str = ""
+        if self.codes:
+             code_parts = []
+             for system, code in self.codes:
+                 # We filter only LOINC for observations as it is the standard
+                 if 'loinc' in system.lower():
+                     code_parts.append(f"[LOINC: {code}]")
+             if code_parts:
+                 code_str = " " + " ".join(code_parts)
+
+        # Output Example: "- Hemoglobin A1c: 5.4 % (2008-03-03) [LOINC: 4548-4]"
+        return f"- {name}: {value_str}{date_str}{code_str}"
+
+class AppObservation(MemoizedResource):
+    # Choice elements use their base name: 'effective' covers effectiveDateTime, etc.
+    FHIR_ELEMENTS = ['status', 'category', 'code', 'effective', 'value', 'component']
+
     def __init__(self, raw_json_data: dict):
-        self.resource = FhirObservation(**raw_json_data)
+        self.resource = parse_fhir_resource(FhirObservation, raw_json_data)
 
     @property
     def id(self):
         return self.resource.id
 
-    @property
+    @memoized_property
     def status(self) -> Optional[ObservationStatus]:
         if not self.resource.status:
             return None
@@ -86,7 +142,7 @@ class AppObservation:
         except ValueError:
             return None
 
-    @property
+    @memoized_property
     def category(self) -> Optional[ObservationCategory]:
         if not self.resource.category:
             return None
@@ -96,19 +152,19 @@ class AppObservation:
                 return found_enum
         return None
 
-    @property
+    @memoized_property
     def code_text(self) -> Optional[str]:
         if not self.resource.code:
             return None
         return AppCodeableConcept(self.resource.code).readable_value
 
-    @property
+    @memoized_property
     def code_details(self) -> List[Dict[str, Optional[str]]]:
         if not self.resource.code:
             return []    
         return AppCodeableConcept(self.resource.code).coding_details
 
-    @property
+    @memoized_property
     def effective_date(self) -> Optional[datetime]:
         return self.resource.effectiveDateTime
 
@@ -135,11 +191,28 @@ class AppObservation:
             
         return None
 
-    @property
+    @memoized_property
     def value_text(self) -> Optional[str]:
         return self._get_value_from_source(self.resource)
 
-    @property
+    @memoized_property
+    def numeric_value(self) -> Optional[float]:
+        """
+        Value of a valueQuantity as a float (None for other value types).
+        """
+        q = self.resource.valueQuantity
+        if q is None or q.value is None:
+            return None
+        return float(q.value)
+
+    @memoized_property
+    def unit(self) -> Optional[str]:
+        q = self.resource.valueQuantity
+        if q is None:
+            return None
+        return q.unit or q.code
+
+    @memoized_property
     def component_text(self) -> Optional[str]:
         """
         Handles observations with multiple components (e.g., Blood Pressure: Systolic/Diastolic).
@@ -154,38 +227,14 @@ class AppObservation:
                 items.append(f"{name}: {val}")
         return ", ".join(items) if items else None
 
-    def to_prompt_string(self) -> str:
-        # Test Name
-        name = self.code_text or "Unknown Test"
-        
-        # Value (handles valueQuantity, valueString or Components)
-        value_str = ""
-        val = self.value_text
-        comps = self.component_text
-        
-        if val:
-            value_str = val
-        elif comps:
-            # For blood pressure or similar multi-component tests
-            value_str = f"[{comps}]"
-        else:
-            return "" # Useless if no result is available
-
-        # Date (Date only, no time, to save token space)
-        date_str = ""
-        if self.effective_date:
-            date_str = f" ({self.effective_date.strftime('%Y-%m-%d')})"
-
-        # Codes (Only essential LOINC codes)
-        code_str = ""
-        if self.code_details:
-             code_parts = []
-             for c in self.code_details:
-                 # We filter only LOINC for observations as it is the standard
-                 if 'loinc' in c['system'].lower():
-                     code_parts.append(f"[LOINC: {c['code']}]")
-             if code_parts:
-                 code_str = " " + " ".join(code_parts)
+    def to_record(self) -> ObservationRecord:
+        """
+        Extracts the fields used by the clinical context (the record does not keep the FHIR model alive).
+        """
+        return ObservationRecord(self.id, self.status, self.category, self.code_text,
+                                 code_pairs(self.code_details), self.value_text,
+                                 self.component_text, self.effective_date,
+                                 self.numeric_value, self.unit)
 
-        # Output Example: "- Hemoglobin A1c: 5.4 % (2008-03-03) [LOINC: 4548-4]"
-        return f"- {name}: {value_str}{date_str}{code_str}"
\ No newline at end of file
+    def to_prompt_string(self) -> str:
+        return self.to_record().to_prompt_string()
@@ -0,0 +1,155 @@
+'''
+Script: observation_store.py
+Digital Health Systems and Applications - Project work 2025-2026
+Description:
+Columnar store of the Observations of one patient. Next to the Observation objects
+(wrappers or compact records) it keeps NumPy columns of timestamps, numeric values
+and interned status, category, name and unit ids, so that the selections used by
+the clinical context (valid statuses, latest Observation per name, bucketing by
+category, time windows) are vectorized operations.
+Observations can be added at any time; the columns are extended lazily.
+
+Group: Carmine Vardaro, Marco Savastano, Francesco Ferrara.
+'''
+
+import threading
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+from resources.diagnostics.observation import ObservationCategory, ObservationStatus
+
+# Fixed ids of the enum members (-1 when missing or not recognized)
+_STATUS_IDS = {status: i for i, status in enumerate(ObservationStatus)}
+_CATEGORY_IDS = {category: i for i, category in enumerate(ObservationCategory)}
+
+def _timestamp(value) -> float:
+    """
+    POSIX timestamp of a date or datetime (naive values are taken as UTC), NaN if missing.
+    """
+    if value is None:
+        return np.nan
+    if not isinstance(value, datetime):
+        value = datetime(value.year, value.month, value.day)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+def observation_name(observation) -> str:
+    """
+    Name under which Observations are grouped in the clinical context.
+    """
+    return observation.code_text or "Unknown"
+
+class ObservationStore:
+    def __init__(self, observations: Iterable = ()):
+        self._lock = threading.Lock()
+        self._observations: List = []
+        self._name_ids: Dict[str, int] = {}
+        self._unit_ids: Dict[str, int] = {}
+        # Column values of the observations added since the last rebuild
+        self._pending: List[tuple] = []
+        self._columns: Optional[Dict[str, np.ndarray]] = None
+        self.add(observations)
+
+    def __len__(self) -> int:
+        return len(self._observations)
+
+    def __getitem__(self, row: int):
+        return self._observations[row]
+
+    def _intern(self, table: Dict[str, int], value: Optional[str]) -> int:
+        if value is None:
+            return -1
+        return table.setdefault(value, len(table))
+
+    def add(self, observations: Iterable):
+        """
+        Appends Observations (AppObservation or ObservationRecord) to the store.
+        """
+        with self._lock:
+            for o in observations:
+                self._observations.append(o)
+                self._pending.append((
+                    _timestamp(o.effective_date),
+                    np.nan if o.numeric_value is None else o.numeric_value,
+                    _STATUS_IDS.get(o.status, -1),
+                    _CATEGORY_IDS.get(o.category, -1),
+                    self._intern(self._name_ids, observation_name(o)),
+                    self._intern(self._unit_ids, o.unit),
+                ))
+
+    def _get_columns(self) -> Dict[str, np.ndarray]:
+        with self._lock:
+            if self._pending or self._columns is None:
+                new = np.array(self._pending, dtype=float).reshape(-1, 6)
+                fresh = {
+                    'timestamp': new[:, 0],
+                    'value': new[:, 1],
+                    'status': new[:, 2].astype(np.int16),
+                    'category': new[:, 3].astype(np.int16),
+                    'name': new[:, 4].astype(np.int32),
+                    'unit': new[:, 5].astype(np.int32),
+                }
+                if self._columns is not None:
+                    fresh = {key: np.concatenate((self._columns[key], fresh[key])) for key in fresh}
+                self._columns = fresh
+                self._pending = []
+            return self._columns
+
+    def select(self, statuses: Optional[Sequence[ObservationStatus]] = None,
+               start: Optional[datetime] = None, end: Optional[datetime] = None,
+               name: Optional[str] = None) -> np.ndarray:
+        """
+        Returns the rows (ascending) matching all the given filters: status,
+        effective date in [start, end] (undated Observations are then excluded) and name.
+        """
+        columns = self._get_columns()
+        mask = np.ones(len(columns['timestamp']), dtype=bool)
+        if statuses is not None:
+            mask &= np.isin(columns['status'], [_STATUS_IDS[s] for s in statuses])
+        if start is not None:
+            mask &= columns['timestamp'] >= _timestamp(start)
+        if end is not None:
+            mask &= columns['timestamp'] <= _timestamp(end)
+        if name is not None:
+            name_id = self._name_ids.get(name)
+            if name_id is None:
+                return np.empty(0, dtype=np.intp)
+            mask &= columns['name'] == name_id
+        return np.flatnonzero(mask)
+
+    def latest_per_name(self, rows: np.ndarray) -> np.ndarray:
+        """
+        Keeps, among the given rows, the most recent Observation of every name.
+        Undated Observations count as the oldest; on equal dates the one added last wins.
+        """
+        if len(rows) == 0:
+            return rows
+        columns = self._get_columns()
+        names = columns['name'][rows]
+        timestamps = np.nan_to_num(columns['timestamp'][rows], nan=-np.inf)
+        order = np.lexsort((rows, timestamps, names))
+        sorted_names = names[order]
+        is_last = np.append(sorted_names[1:] != sorted_names[:-1], True)
+        return rows[order[is_last]]
+
+    def split_by_category(self, rows: np.ndarray,
+                          categories: Sequence[ObservationCategory]) -> Dict[Optional[ObservationCategory], np.ndarray]:
+        """
+        Buckets the given rows by category: one entry per requested category, plus
+        None for the rows in any other category (or without one).
+        """
+        row_categories = self._get_columns()['category'][rows]
+        buckets = {}
+        remaining = np.ones(len(rows), dtype=bool)
+        for category in categories:
+            in_category = row_categories == _CATEGORY_IDS[category]
+            buckets[category] = rows[in_category]
+            remaining &= ~in_category
+        buckets[None] = rows[remaining]
+        return buckets
+
+    def observations(self, rows: Iterable[int]) -> list:
+        return [self._observations[row] for row in rows]
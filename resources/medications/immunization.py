@@ -11,10 +11,12 @@ Group: Carmine Vardaro, Marco Savastano, Francesco Ferrara.
 
 from fhir.resources.immunization import Immunization as FhirImmunization
 from enum import Enum
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, NamedTuple
 from datetime import datetime
 
-from resources.core.types import AppCodeableConcept
+from resources.core.types import AppCodeableConcept, MemoizedResource, memoized_property
+from resources.core.model_view import parse_fhir_resource
+from resources.core.records import CodePairs, code_pairs, format_code_pairs
 
 class ImmunizationStatus(str, Enum):
     COMPLETED = "completed"
@@ -31,15 +33,41 @@ class ImmunizationStatus(str, Enum):
         }
         return definitions.get(self.value, "Definition not available.")
 
-class AppImmunization:
+class ImmunizationRecord(NamedTuple):
+    """
+    Compact, immutable form of an AppImmunization (see AppImmunization.to_record).
+    """
+    id: Optional[str]
+    status: Optional[ImmunizationStatus]
+    code_text: Optional[str]
+    codes: CodePairs
+    occurrence_date: Optional[datetime]
+
+    @property
+    def simple_code_str(self) -> str:
+        return format_code_pairs(self.codes)
+
+    def to_prompt_string(self) -> str:
+        # Fallback method (used if grouping is not applied)
+        header_name = self.code_text or "Unknown Vaccine"
+        
+        date_str = ""
+        if self.occurrence_date:
+            date_str = f" [Date: {self.occurrence_date.strftime('%Y-%m-%d')}]"
+            
+        return f"- {header_name}{date_str}{self.simple_code_str}"
+
+class AppImmunization(MemoizedResource):
+    FHIR_ELEMENTS = ['status', 'vaccineCode', 'occurrence', 'patient']
+
     def __init__(self, raw_json_data: dict):
-        self.resource = FhirImmunization(**raw_json_data)
+        self.resource = parse_fhir_resource(FhirImmunization, raw_json_data)
 
     @property
     def id(self):
         return self.resource.id
 
-    @property
+    @memoized_property
     def status(self) -> Optional[ImmunizationStatus]:
         if not self.resource.status:
             return None
@@ -48,41 +76,35 @@ class AppImmunization:
         except ValueError:
             return None
 
-    @property
+    @memoized_property
     def code_text(self) -> Optional[str]:
         if not self.resource.vaccineCode:
             return None
         return AppCodeableConcept(self.resource.vaccineCode).readable_value
 
-    @property
+    @memoized_property
     def code_details(self) -> List[Dict[str, Optional[str]]]:
         if not self.resource.vaccineCode:
             return []    
         return AppCodeableConcept(self.resource.vaccineCode).coding_details
 
-    @property
+    @memoized_property
     def occurrence_date(self) -> Optional[datetime]:
         return self.resource.occurrenceDateTime
 
-    @property
+    @memoized_property
     def simple_code_str(self) -> str:
         """
         Helper property to facilitate grouping by generating a standard code string.
         """
-        if self.code_details:
-            code_parts = []
-            for c in self.code_details:
-                # Direct syntax formatting
-                code_parts.append(f"[{c['system']}: {c['code']}]")
-            return " " + " ".join(code_parts)
-        return ""
+        return format_code_pairs(code_pairs(self.code_details))
+
+    def to_record(self) -> ImmunizationRecord:
+        """
+        Extracts the fields used by the clinical context (the record does not keep the FHIR model alive).
+        """
+        return ImmunizationRecord(self.id, self.status, self.code_text, code_pairs(self.code_details),
+                                  self.occurrence_date)
 
     def to_prompt_string(self) -> str:
-        # Fallback method (used if grouping is not applied)
-        header_name = self.code_text or "Unknown Vaccine"
-        
-        date_str = ""
-        if self.occurrence_date:
-            date_str = f" [Date: {self.occurrence_date.strftime('%Y-%m-%d')}]"
-            
-        return f"- {header_name}{date_str}{self.simple_code_str}"
\ No newline at end of file
+        return self.to_record().to_prompt_string()
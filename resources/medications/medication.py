@@ -11,29 +11,32 @@ Group: Carmine Vardaro, Marco Savastano, Francesco Ferrara.
 from fhir.resources.medication import Medication as FhirMedication
 from typing import Optional, List, Dict
 
-from resources.core.types import AppCodeableConcept
+from resources.core.types import AppCodeableConcept, MemoizedResource, memoized_property
+from resources.core.model_view import parse_fhir_resource
+
+class AppMedication(MemoizedResource):
+    FHIR_ELEMENTS = ['code']
 
-class AppMedication:
     def __init__(self, raw_json_data: dict):
-        self.resource = FhirMedication(**raw_json_data)
+        self.resource = parse_fhir_resource(FhirMedication, raw_json_data)
 
     @property
     def id(self) -> str:
         return self.resource.id
 
-    @property
+    @memoized_property
     def code_text(self) -> Optional[str]:
         if not self.resource.code:
             return None
         return AppCodeableConcept(self.resource.code).readable_value
 
-    @property
+    @memoized_property
     def code_details(self) -> List[Dict[str, Optional[str]]]:
         if not self.resource.code:
             return []    
         return AppCodeableConcept(self.resource.code).coding_details
 
-    @property
+    @memoized_property
     def simple_code_str(self) -> str:
         """
         Helper property to generate a standardized code string.
@@ -12,10 +12,12 @@ Group: Carmine Vardaro, Marco Savastano, Francesco Ferrara.
 from fhir.resources.medicationrequest import MedicationRequest as FhirMedicationRequest
 
 from enum import Enum
-from typing import Optional, List, Dict, TYPE_CHECKING
+from typing import Optional, List, Dict, NamedTuple, TYPE_CHECKING
 from datetime import datetime
 
-from resources.core.types import AppCodeableConcept
+from resources.core.types import AppCodeableConcept, MemoizedResource, memoized_property
+from resources.core.model_view import parse_fhir_resource
+from resources.core.records import CodePairs, code_pairs, format_code_pairs
 
 if TYPE_CHECKING:
     from .medication import AppMedication
@@ -70,15 +72,65 @@ class MedicationRequestIntent(str, Enum):
       }
       return definitions.get(self.value, "Definition not available.")
    
-class AppMedicationRequest:
+class MedicationRequestRecord(NamedTuple):
+    """
+    Compact, immutable form of an AppMedicationRequest (see AppMedicationRequest.to_record).
+    """
+    id: Optional[str]
+    status: Optional[MedicationRequestStatus]
+    intent: Optional[MedicationRequestIntent]
+    authored_on: Optional[datetime]
+    medication_reference_id: Optional[str]
+    medication_concept_text: Optional[str]
+    medication_codes: CodePairs
+    dosage_text: Optional[str]
+
+    def to_prompt_string(self, medication_map: Dict[str, 'AppMedication']) -> str:
+        # 1. Medication Name Resolution
+        med_name_str = "Unknown Medication"
+        
+        ref_id = self.medication_reference_id
+        if ref_id and ref_id in medication_map:
+            # Case A: Reference to external Medication resource
+            med_name_str = medication_map[ref_id].to_prompt_string()
+        elif self.medication_concept_text:
+            # Case B: Inline concept
+            med_name_str = f"{self.medication_concept_text}{format_code_pairs(self.medication_codes)}"
+
+        # 2. Date Management (AuthoredOn)
+        date_str = ""
+        if self.authored_on:
+            date_str = f" (Start: {self.authored_on.strftime('%Y-%m-%d')})"
+
+        # 3. Dosage Management (Using existing dosage_text logic)
+        dosage_info = ""
+        d_text = self.dosage_text
+        if d_text:
+            # Indent dosage for visual clarity
+            dosage_info = f"\n  Sig: {d_text}"
+
+        # 4. Status On-Hold (If active we don't write it, it's the section default)
+        status_warning = ""
+        if self.status == MedicationRequestStatus.ON_HOLD:
+            status_warning = " [STATUS: ON-HOLD/SUSPENDED]"
+
+        # Output Example: 
+        # "- Simvastatin 10 MG [RxNorm: 314231] (Start: 2008-03-03)
+        #    Sig: 1, Once a day"
+        return f"- {med_name_str}{date_str}{status_warning}{dosage_info}"
+
+class AppMedicationRequest(MemoizedResource):
+    # 'subject' and 'intent' are not used but required by the FHIR model
+    FHIR_ELEMENTS = ['status', 'intent', 'authoredOn', 'medication', 'dosageInstruction', 'subject']
+
     def __init__(self, raw_json_data: dict):
-        self.resource = FhirMedicationRequest(**raw_json_data)
+        self.resource = parse_fhir_resource(FhirMedicationRequest, raw_json_data)
 
     @property
     def id(self) -> str:
         return self.resource.id
 
-    @property
+    @memoized_property
     def status(self) -> Optional[MedicationRequestStatus]:
         if not self.resource.status: 
             return None
@@ -87,7 +139,7 @@ class AppMedicationRequest:
         except ValueError: 
             return None
 
-    @property
+    @memoized_property
     def intent(self) -> Optional[MedicationRequestIntent]:
         if not self.resource.intent: 
             return None
@@ -96,29 +148,29 @@ class AppMedicationRequest:
         except ValueError: 
             return None
 
-    @property
+    @memoized_property
     def authored_on(self) -> Optional[datetime]:
         return self.resource.authoredOn
 
-    @property
+    @memoized_property
     def medication_reference_id(self) -> Optional[str]:
         if self.resource.medicationReference and self.resource.medicationReference.reference:
             return self.resource.medicationReference.reference.split("/")[-1]
         return None
 
-    @property
+    @memoized_property
     def medication_concept_text(self) -> Optional[str]:
         if self.resource.medicationCodeableConcept:
             return AppCodeableConcept(self.resource.medicationCodeableConcept).readable_value
         return None
 
-    @property
+    @memoized_property
     def medication_concept_details(self) -> List[Dict[str, Optional[str]]]:
         if self.resource.medicationCodeableConcept:
             return AppCodeableConcept(self.resource.medicationCodeableConcept).coding_details
         return []
 
-    @property
+    @memoized_property
     def dosage_text(self) -> Optional[str]:
         """
         'Humanized' version of dosage instructions.
@@ -202,44 +254,13 @@ class AppMedicationRequest:
         return "; ".join(all_lines)
 
 
-    def to_prompt_string(self, medication_map: Dict[str, 'AppMedication']) -> str:
-        # 1. Medication Name Resolution
-        med_name_str = "Unknown Medication"
-        
-        ref_id = self.medication_reference_id
-        if ref_id and ref_id in medication_map:
-            # Case A: Reference to external Medication resource
-            med_name_str = medication_map[ref_id].to_prompt_string()
-        elif self.medication_concept_text:
-            # Case B: Inline concept
-            name = self.medication_concept_text
-            
-            # Construct code string
-            codes_str = ""
-            if self.medication_concept_details:
-                code_parts = [f"[{d['system']}: {d['code']}]" for d in self.medication_concept_details]
-                codes_str = " " + " ".join(code_parts)
-            
-            med_name_str = f"{name}{codes_str}"
-
-        # 2. Date Management (AuthoredOn)
-        date_str = ""
-        if self.authored_on:
-            date_str = f" (Start: {self.authored_on.strftime('%Y-%m-%d')})"
-
-        # 3. Dosage Management (Using existing dosage_text logic)
-        dosage_info = ""
-        d_text = self.dosage_text
-        if d_text:
-            # Indent dosage for visual clarity
-            dosage_info = f"\n  Sig: {d_text}"
-
-        # 4. Status On-Hold (If active we don't write it, it's the section default)
-        status_warning = ""
-        if self.status == MedicationRequestStatus.ON_HOLD:
-            status_warning = " [STATUS: ON-HOLD/SUSPENDED]"
+    def to_record(self) -> MedicationRequestRecord:
+        """
+        Extracts the fields used by the clinical context (the record does not keep the FHIR model alive).
+        """
+        return MedicationRequestRecord(self.id, self.status, self.intent, self.authored_on,
+                                       self.medication_reference_id, self.medication_concept_text,
+                                       code_pairs(self.medication_concept_details), self.dosage_text)
 
-        # Output Example: 
-        # "- Simvastatin 10 MG [RxNorm: 314231] (Start: 2008-03-03)
-        #    Sig: 1, Once a day"
-        return f"- {med_name_str}{date_str}{status_warning}{dosage_info}"
\ No newline at end of file
+    def to_prompt_string(self, medication_map: Dict[str, 'AppMedication']) -> str:
+        return self.to_record().to_prompt_string(medication_map)
@@ -0,0 +1,879 @@
+'''
+Script: clinical_fetch.py
+Digital Health Systems and Applications - Project work 2025-2026
+Description:
+Fetch engine for the clinical resources of a single patient. Every resource type
+(plus the Medication resolution map) is searched concurrently on a bounded thread
+pool, so the time needed to open a patient follows the slowest resource type
+instead of the sum of all of them.
+Optionally the whole record can be retrieved in (almost) one round-trip, through
+Patient/$everything or a single FHIR batch Bundle, falling back to the per-type
+searches when the server does not support it.
+Search results are streamed one page at a time (raw JSON) to a page handler, which
+wraps or stores each page before the next one is requested, so the raw data of a
+patient is never held in memory all at once.
+Downloaded resources are kept in the on-disk snapshot store, so reopening a patient
+only asks the server for what changed since the last download, and the wrapped
+resources are kept per type in the in-memory context cache, so invalidating one
+resource type only downloads that type again. The high-volume types are kept there
+as compact records holding only the rendered fields.
+Only the resource types read by the clinical context are downloaded; the types that
+only appear as a count in the sidebar (e.g. DocumentReference, with its large CDA
+attachments) are counted with _summary=count.
+Observations (by far the largest resource type) are retrieved with Observation/$lastn,
+i.e. only the latest ones per code among the valid statuses, which is all the clinical
+context uses, plus the newest one of any status (it sets the simulated current date);
+the total number of Observations is obtained with a _summary=count search.
+
+Group: Carmine Vardaro, Marco Savastano, Francesco Ferrara.
+'''
+
+import multiprocessing
+import os
+import threading
+from datetime import datetime, timezone
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import repeat
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from resources.administration.patient import AppPatient
+from resources.administration.device import AppDevice
+from resources.clinical.allergyIntolerance import AppAllergyIntolerance
+from resources.clinical.carePlan import AppCarePlan
+from resources.clinical.condition import AppCondition
+from resources.clinical.procedure import AppProcedure
+from resources.diagnostics.diagnosticReport import AppDiagnosticReport
+from resources.diagnostics.documentReference import AppDocumentReference
+from resources.diagnostics.observation import AppObservation
+from resources.medications.immunization import AppImmunization
+from resources.medications.medication import AppMedication
+from resources.medications.medicationRequests import AppMedicationRequest
+from services.context_cache import get_context_cache
+from services.fhir_transport import iter_bundle_pages, iter_search_pages
+from services.medication_cache import get_medication_cache
+from services.metrics import resource_scope, submit_traced, timed
+from services.snapshot_store import PatientSnapshotStore, get_snapshot_store
+
+# Maximum number of searches running at the same time against the FHIR server
+MAX_FETCH_WORKERS = 6
+
+# Retrieval strategy: "per-type" (concurrent searches), "everything" (Patient/$everything)
+# or "batch" (one batch Bundle holding all the searches)
+RETRIEVAL_MODE = os.getenv("FHIR_RETRIEVAL_MODE", "per-type")
+
+# Page size requested for $everything and batch searches
+BUNDLE_PAGE_SIZE = 200
+
+# Ask the server only for the elements the wrappers read (_elements projection)
+USE_ELEMENTS_PROJECTION = os.getenv("FHIR_USE_ELEMENTS", "1") == "1"
+
+# Observation retrieval: "lastn" (only the latest Observations per code)
+# or "all" (the whole history of the patient)
+OBSERVATION_MODE = os.getenv("FHIR_OBSERVATION_MODE", "lastn")
+
+# Observations kept per code in "lastn" mode
+OBSERVATION_LASTN_MAX = int(os.getenv("FHIR_OBSERVATION_LASTN_MAX", "1"))
+
+# Keep the high-volume resource types in memory as compact records (see to_record)
+# instead of full wrappers
+USE_COMPACT_RECORDS = os.getenv("FHIR_COMPACT_RECORDS", "1") == "1"
+
+# Worker processes parsing large pages of resources (0: parse on the fetching thread)
+PARSE_PROCESSES = int(os.getenv("FHIR_PARSE_PROCESSES", "0"))
+
+# Resources per task sent to a parse worker
+PARSE_CHUNK_SIZE = 100
+
+# Smaller pages are parsed on the fetching thread (the transfer would cost more)
+PARSE_POOL_MIN_RESOURCES = 200
+
+# Download only the resource types read by the clinical context (AppPatient.CONTEXT_SECTIONS):
+# the others are counted with _summary=count if shown in the sidebar, skipped otherwise
+SKIP_UNRENDERED_TYPES = os.getenv("FHIR_SKIP_UNRENDERED", "1") == "1"
+
+# Resource types whose total is shown in the sidebar
+COUNTED_TYPES = ('Device', 'AllergyIntolerance', 'CarePlan', 'Condition', 'Procedure',
+                 'DiagnosticReport', 'DocumentReference', 'Observation', 'Immunization')
+
+# Observation statuses used by the clinical context
+VALID_OBSERVATION_STATUSES = ('final', 'amended', 'corrected')
+
+# Receives each downloaded page: (resource type, raw JSON resources of the page)
+PageHandler = Callable[[str, List[dict]], None]
+
+# Resource type -> (Wrapper class, AppPatient aggregator method name)
+# The order is the order in which resources are added to the patient.
+RESOURCE_CONFIGS = {
+    'Device':             (AppDevice,             'add_devices'),
+    'AllergyIntolerance': (AppAllergyIntolerance, 'add_allergies'),
+    'CarePlan':           (AppCarePlan,           'add_care_plans'),
+    'Condition':          (AppCondition,          'add_conditions'),
+    'Procedure':          (AppProcedure,          'add_procedures'),
+    'DiagnosticReport':   (AppDiagnosticReport,   'add_diagnostic_reports'),
+    'DocumentReference':  (AppDocumentReference,  'add_document_references'),
+    'Observation':        (AppObservation,        'add_observations'),
+    'Immunization':       (AppImmunization,       'add_immunizations'),
+    'MedicationRequest':  (AppMedicationRequest,  'add_medication_requests'),
+}
+
+def get_resource_usage(resource_type: str) -> str:
+    """
+    Tells how a resource type is retrieved: "render" (downloaded and wrapped, it feeds
+    the clinical context), "count" (only its total, for the sidebar) or "skip".
+    """
+    if not SKIP_UNRENDERED_TYPES or resource_type in AppPatient.context_resource_types():
+        return 'render'
+    return 'count' if resource_type in COUNTED_TYPES else 'skip'
+
+def get_downloaded_types() -> List[str]:
+    """
+    Returns the resource types downloaded in full, in RESOURCE_CONFIGS order.
+    """
+    return [t for t in RESOURCE_CONFIGS if get_resource_usage(t) == 'render']
+
+def get_projection(resource_type: str) -> Optional[List[str]]:
+    """
+    Returns the elements to request for a resource type (the FHIR_ELEMENTS declared
+    by its wrapper plus 'meta', needed for the snapshot watermarks), or None when
+    the projection is disabled.
+    """
+    # MedicationRequests are searched with their _include Medications,
+    # which would be projected too
+    if not USE_ELEMENTS_PROJECTION or resource_type == 'MedicationRequest':
+        return None
+    return sorted(set(RESOURCE_CONFIGS[resource_type][0].FHIR_ELEMENTS) | {'meta'})
+
+def get_snapshot_profile(resource_type: str) -> Optional[List[str]]:
+    """
+    Describes how a resource type is downloaded (projection and, for Observations,
+    the $lastn reduction), so that snapshots taken differently are not reused.
+    """
+    profile = get_projection(resource_type) or []
+    if resource_type == 'Observation' and OBSERVATION_MODE == 'lastn':
+        profile = profile + [f'$lastn={OBSERVATION_LASTN_MAX}']
+    return profile or None
+
+def _parse_resources(resource_type: str, raw_resources: List[dict], compact: bool) -> Tuple[list, List[Tuple[str, str]]]:
+    """
+    Parses raw resources into wrappers (or their compact records), in order.
+    Also runs in the worker processes of the parse pool.
+    Returns:
+        (parsed objects, (resource id, error) of the resources that could not be parsed)
+    """
+    AppClass = RESOURCE_CONFIGS[resource_type][0]
+    app_objects = []
+    failures = []
+    for raw in raw_resources:
+        try:
+            app_object = AppClass(raw)
+            app_objects.append(app_object.to_record() if compact else app_object)
+        except Exception as e:
+            failures.append((raw.get('id', 'Unknown'), str(e)))
+    return app_objects, failures
+
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+
+def get_parse_pool() -> Optional[ProcessPoolExecutor]:
+    """
+    Returns the process-wide parse pool, or None when PARSE_PROCESSES is 0.
+    Workers are spawned (not forked), since the app process runs several threads.
+    """
+    global _parse_pool
+    if PARSE_PROCESSES <= 0:
+        return None
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            _parse_pool = ProcessPoolExecutor(max_workers=PARSE_PROCESSES, mp_context=multiprocessing.get_context('spawn'))
+    return _parse_pool
+
+def _discard_parse_pool(pool: ProcessPoolExecutor):
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is pool:
+            _parse_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def wrap_resources(resource_type: str, raw_resources: List[dict]) -> list:
+    """
+    Converts raw FHIR JSON resources into the matching App* wrapper objects, or into
+    their compact records for the wrappers that provide one (USE_COMPACT_RECORDS),
+    so the wrapper and the raw JSON are released right away.
+    Large pages of compact types are parsed in chunks on the parse pool, when enabled
+    (wrappers are not sent back from the workers: they would cost more to transfer
+    than to parse); the order of the resources is kept.
+    Resources that cannot be parsed are skipped with a warning.
+    """
+    compact = USE_COMPACT_RECORDS and hasattr(RESOURCE_CONFIGS[resource_type][0], 'to_record')
+    with timed('parse', resource_type, count=len(raw_resources)):
+        pool = get_parse_pool() if compact and len(raw_resources) >= PARSE_POOL_MIN_RESOURCES else None
+        results = None
+        if pool:
+            chunks = [raw_resources[i:i + PARSE_CHUNK_SIZE] for i in range(0, len(raw_resources), PARSE_CHUNK_SIZE)]
+            try:
+                results = list(pool.map(_parse_resources, repeat(resource_type), chunks, repeat(compact)))
+            except Exception as e:
+                print(f"[WARNING] Parse pool failed, parsing {resource_type} in this process: {e}")
+                _discard_parse_pool(pool)
+        if results is None:
+            results = [_parse_resources(resource_type, raw_resources, compact)]
+
+    app_objects = []
+    for parsed, failures in results:
+        app_objects.extend(parsed)
+        for resource_id, error in failures:
+            print(f"[WARNING] Could not parse {resource_type} {resource_id}: {error}")
+    return app_objects
+
+def build_medication_map(raw_medications: List[dict]) -> Dict[str, AppMedication]:
+    """
+    Builds the resolution map {Medication id -> AppMedication} used by MedicationRequests,
+    reusing the Medications already parsed for other patients.
+    """
+    with timed('parse', 'Medication', count=len(raw_medications)):
+        return get_medication_cache().build_map(raw_medications)
+
+def _observation_key(raw: dict) -> str:
+    """
+    Grouping key of a raw Observation, the same name used by the clinical context
+    (code.text, else the display of the first coding that has one).
+    """
+    code = raw.get('code', None) or {}
+    if code.get('text'):
+        return code['text']
+    for coding in code.get('coding', None) or []:
+        if coding.get('display'):
+            return coding['display']
+    return "Unknown"
+
+def _observation_time(value: Optional[str]) -> float:
+    """
+    POSIX timestamp of a FHIR dateTime/instant string (partial dates are taken as
+    their first day, values without offset as UTC), -inf if missing or invalid.
+    """
+    if not value:
+        return float('-inf')
+    if len(value) in (4, 7):
+        value += '-01-01'[:10 - len(value)]
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return float('-inf')
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+def _observation_order(raw: dict) -> Tuple[float, float]:
+    """
+    Recency of a raw Observation: effectiveDateTime first (the date the clinical context
+    orders and shows), then effectiveInstant, effectivePeriod or issued for the Observations
+    without it.
+    """
+    period = raw.get('effectivePeriod', None) or {}
+    fallback = raw.get('effectiveInstant') or period.get('end') or period.get('start') or raw.get('issued')
+    return _observation_time(raw.get('effectiveDateTime')), _observation_time(fallback)
+
+class _LatestObservations:
+    """
+    Reduces raw Observations to the latest max_per_code ones per name among the
+    statuses used by the clinical context. The newest Observation of any status
+    (by effectiveDateTime) is kept as well: it moves the patient's simulated
+    current date exactly as the whole history would (see AppPatient.last_interaction_date).
+    """
+    def __init__(self, max_per_code: int):
+        self.max_per_code = max_per_code
+        # name -> [(order, raw)], newest first
+        self._by_code: Dict[str, List[Tuple[Tuple[float, float], dict]]] = {}
+        self._newest: Optional[Tuple[float, dict]] = None
+        self._seen_ids = set()
+
+    def add(self, raw: dict) -> bool:
+        """
+        Adds a raw Observation; returns True if it is the first one kept for its name.
+        """
+        if raw.get('id') is not None:
+            if raw['id'] in self._seen_ids:
+                return False
+            self._seen_ids.add(raw['id'])
+        order = _observation_order(raw)
+        if order[0] != float('-inf') and (self._newest is None or order[0] > self._newest[0]):
+            self._newest = (order[0], raw)
+        if raw.get('status') not in VALID_OBSERVATION_STATUSES:
+            return False
+        key = _observation_key(raw)
+        is_new = key not in self._by_code
+        kept = self._by_code.setdefault(key, [])
+        if len(kept) < self.max_per_code or order > kept[-1][0]:
+            # Equal dates keep the Observation seen first
+            position = next((i for i, (o, _) in enumerate(kept) if order > o), len(kept))
+            kept.insert(position, (order, raw))
+            del kept[self.max_per_code:]
+        return is_new
+
+    def is_complete(self) -> bool:
+        """
+        Tells whether every name seen so far has max_per_code Observations.
+        """
+        return all(len(kept) >= self.max_per_code for kept in self._by_code.values())
+
+    def __bool__(self) -> bool:
+        return self._newest is not None or bool(self._by_code)
+
+    def flatten(self) -> List[dict]:
+        """
+        Returns the kept Observations as a single list.
+        """
+        result = [raw for kept in self._by_code.values() for _, raw in kept]
+        if self._newest is not None and not any(raw is self._newest[1] for raw in result):
+            result.append(self._newest[1])
+        return result
+
+def count_resources(client, resource_type: str, patient_id: str) -> int:
+    """
+    Returns the number of resources of the given type for the patient (_summary=count).
+    """
+    with resource_scope(resource_type):
+        bundle = client.execute(resource_type, method='get', params={'patient': patient_id, '_summary': 'count'})
+    return int(bundle['total'])
+
+def _lastn_params(patient_id: str) -> dict:
+    """
+    Observation/$lastn parameters: the latest Observations per code among the valid statuses.
+    """
+    return {'patient': patient_id, 'status': ",".join(VALID_OBSERVATION_STATUSES),
+            'max': OBSERVATION_LASTN_MAX, '_count': BUNDLE_PAGE_SIZE}
+
+def _newest_observation_params(patient_id: str) -> dict:
+    """
+    Search of the newest Observation of the patient, whatever its status (see _LatestObservations).
+    """
+    params = {'patient': patient_id, '_sort': '-date', '_count': 1}
+    projection = get_projection('Observation')
+    if projection:
+        params['_elements'] = ",".join(projection)
+    return params
+
+def _has_invalid_observations(raw_observations: List[dict]) -> bool:
+    """
+    Tells whether a $lastn result holds Observations the status filter should have
+    excluded, i.e. the server ignored it (the latest valid ones may then be missing).
+    """
+    return any(raw.get('status') not in VALID_OBSERVATION_STATUSES for raw in raw_observations)
+
+def fetch_latest_observations(client, patient_id: str) -> List[dict]:
+    """
+    Fetches only the latest Observations per code among the valid statuses with
+    Observation/$lastn, plus the newest Observation of any status (see _LatestObservations).
+    If the server does not support the operation (or ignores the status filter), the
+    Observations are paged through newest first (_sort=-date) and reduced while
+    downloading; paging stops once every name seen has its latest Observations and
+    a page brings no new name.
+    """
+    try:
+        bundle = client.execute('Observation/$lastn', method='get', params=_lastn_params(patient_id))
+        if not bundle or bundle.get('resourceType') != 'Bundle':
+            raise ValueError("Observation/$lastn did not return a Bundle")
+        raw_observations = []
+        for page in iter_bundle_pages(client, bundle):
+            raw_observations.extend(entry['resource'] for entry in page.get('entry', None) or [] if entry.get('resource'))
+        if _has_invalid_observations(raw_observations):
+            raise ValueError("the status filter was ignored")
+        ids = {raw.get('id') for raw in raw_observations}
+        newest = next(iter_search_pages(client, 'Observation', _newest_observation_params(patient_id)), [])
+        return raw_observations + [raw for raw in newest if raw.get('id') not in ids]
+    except Exception as e:
+        print(f"[INFO] Observation/$lastn not available ({e}). Reducing Observations client-side.")
+
+    params = {'patient': patient_id, '_sort': '-date', '_count': BUNDLE_PAGE_SIZE}
+    projection = get_projection('Observation')
+    if projection:
+        params['_elements'] = ",".join(projection)
+    latest = _LatestObservations(OBSERVATION_LASTN_MAX)
+    for page in iter_search_pages(client, 'Observation', params):
+        new_names = [latest.add(raw) for raw in page]
+        if page and not any(new_names) and latest.is_complete():
+            break
+    return latest.flatten()
+
+def iter_resource_pages(client, resource_type: str, patient_id: str, since: Optional[str] = None,
+                        included: Optional[Callable[[dict], None]] = None) -> Iterator[List[dict]]:
+    """
+    Yields the resources of the given type for the patient one page at a time
+    (raw JSON dictionaries), sorted by last update so recent data comes first.
+    In "lastn" mode a full Observation download keeps only the latest ones per code.
+    MedicationRequests are searched with _include=MedicationRequest:medication,
+    so the Medications they reference come in the same pass.
+    Args:
+        since: If given, only resources updated after this instant (_lastUpdated=gt...).
+        included: Receives every Medication included with the MedicationRequests.
+    """
+    if resource_type == 'Observation' and OBSERVATION_MODE == 'lastn' and not since:
+        yield fetch_latest_observations(client, patient_id)
+        return
+
+    params = {'patient': patient_id, '_sort': '-_lastUpdated', '_count': BUNDLE_PAGE_SIZE}
+    projection = get_projection(resource_type)
+    if projection:
+        params['_elements'] = ",".join(projection)
+    if since:
+        params['_lastUpdated'] = f'gt{since}'
+    if resource_type == 'MedicationRequest':
+        params['_include'] = 'MedicationRequest:medication'
+    yield from iter_search_pages(client, resource_type, params, included)
+
+def fetch_resource_type(client, resource_type: str, patient_id: str, since: Optional[str] = None,
+                        included: Optional[Callable[[dict], None]] = None) -> List[dict]:
+    """
+    Fetches every resource of the given type for the patient (all pages)
+    as raw JSON dictionaries. See iter_resource_pages.
+    """
+    return [raw for page in iter_resource_pages(client, resource_type, patient_id, since, included) for raw in page]
+
+def _stream_resource_type(client, resource_type: str, patient_id: str, since: Optional[str],
+                          page_handler: PageHandler, included: Optional[Callable[[dict], None]] = None) -> int:
+    """
+    Hands every page of one resource type to page_handler and returns the number of resources.
+    """
+    total = 0
+    with resource_scope(resource_type):
+        for page in iter_resource_pages(client, resource_type, patient_id, since, included):
+            page_handler(resource_type, page)
+            total += len(page)
+    return total
+
+def _hand_over(raw_by_type: Dict[str, List[dict]], page_handler: PageHandler) -> Dict[str, int]:
+    """
+    Hands resources that are already in memory to page_handler, one page per type,
+    and returns the number of resources per type.
+    """
+    counts = {}
+    for resource_type, raw_resources in raw_by_type.items():
+        page_handler(resource_type, raw_resources)
+        counts[resource_type] = len(raw_resources)
+    return counts
+
+def fetch_clinical_resources(client, patient_id: str, page_handler: PageHandler, max_workers: int = MAX_FETCH_WORKERS,
+                             since_by_type: Optional[Dict[str, Optional[str]]] = None,
+                             resource_types: Optional[List[str]] = None) -> Tuple[Dict[str, int], List[dict], Dict[str, str]]:
+    """
+    Runs all the per-type searches in parallel, streaming every page to
+    page_handler as soon as it is downloaded. The Medications referenced by the
+    MedicationRequests are collected from the same (paginated) search.
+    Args:
+        client: The FHIR client (must be safe to use from several threads).
+        patient_id: The FHIR id of the patient.
+        page_handler: Called from the worker threads with (resource type, raw page);
+            the pages of one resource type always come from the same thread.
+        max_workers: Upper bound on the number of concurrent searches.
+        since_by_type: Optional {resource type -> instant} to download only the changes.
+        resource_types: Optional subset of RESOURCE_CONFIGS to fetch (default: get_downloaded_types()).
+            Medications are collected only if MedicationRequest is requested.
+    Returns:
+        A tuple (resource counts per type, raw Medications, errors per type).
+        Resource types that failed are missing from the first dictionary (their
+        pages handed over so far are incomplete) and have their error message
+        in the third one ('Medication' too when the MedicationRequest search fails).
+    """
+    since_by_type = since_by_type or {}
+    resource_types = resource_types or get_downloaded_types()
+    counts = {}
+    raw_medications = []
+    errors = {}
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fhir-fetch") as executor:
+        futures = {
+            resource_type: submit_traced(executor, _stream_resource_type, client, resource_type, patient_id,
+                                         since_by_type.get(resource_type), page_handler,
+                                         raw_medications.append if resource_type == 'MedicationRequest' else None)
+            for resource_type in resource_types
+        }
+
+        for resource_type, future in futures.items():
+            try:
+                counts[resource_type] = future.result()
+            except Exception as e:
+                print(f"[ERROR] Error fetching {resource_type} for patient {patient_id}: {e}")
+                errors[resource_type] = str(e)
+
+    if 'MedicationRequest' in errors:
+        errors['Medication'] = errors['MedicationRequest']
+
+    return counts, raw_medications, errors
+
+def _route_bundle_entries(client, bundle, raw_by_type: Dict[str, List[dict]], raw_medications: List[dict]):
+    """
+    Pages through a searchset Bundle and routes every entry by resourceType:
+    clinical types to raw_by_type, Medications to raw_medications.
+    Resource types without a wrapper (Encounter, Claim, ...) are ignored.
+    """
+    for page in iter_bundle_pages(client, bundle):
+        for entry in page.get('entry', None) or []:
+            res = entry.get('resource', None)
+            if not res:
+                continue
+            resource_type = res.get('resourceType')
+            if resource_type in raw_by_type:
+                raw_by_type[resource_type].append(res)
+            elif resource_type == 'Medication':
+                raw_medications.append(res)
+
+def fetch_patient_everything(client, patient_id: str):
+    """
+    Retrieves the whole patient compartment with Patient/{id}/$everything,
+    paging through the result and routing each entry to its resource type.
+    Raises if the server does not support the operation.
+    """
+    raw_by_type = {resource_type: [] for resource_type in get_downloaded_types()}
+    raw_medications = []
+
+    bundle = client.execute(f'Patient/{patient_id}/$everything', method='get', params={'_count': BUNDLE_PAGE_SIZE})
+    if not bundle or bundle.get('resourceType') != 'Bundle':
+        raise ValueError("Patient/$everything did not return a Bundle")
+    _route_bundle_entries(client, bundle, raw_by_type, raw_medications)
+
+    return raw_by_type, raw_medications, {}
+
+def fetch_patient_batch(client, patient_id: str):
+    """
+    Sends a single FHIR batch Bundle holding one search per resource type
+    (MedicationRequest includes its Medications) and pages through every result.
+    Searches that fail inside the batch are retried one by one with the per-type path.
+    Raises if the server does not accept batch Bundles.
+    """
+    search_urls = {}
+    for resource_type in get_downloaded_types():
+        url = f"{resource_type}?patient={patient_id}&_sort=-_lastUpdated&_count={BUNDLE_PAGE_SIZE}"
+        projection = get_projection(resource_type)
+        if projection:
+            url += "&_elements=" + ",".join(projection)
+        if resource_type == 'MedicationRequest':
+            url += "&_include=MedicationRequest:medication"
+        if resource_type == 'Observation' and OBSERVATION_MODE == 'lastn':
+            url = "Observation/$lastn?" + "&".join(f"{k}={v}" for k, v in _lastn_params(patient_id).items())
+        search_urls[resource_type] = url
+    # In "lastn" mode the newest Observation of any status is searched last (see _LatestObservations)
+    newest_url = None
+    if 'Observation' in search_urls and OBSERVATION_MODE == 'lastn':
+        newest_url = "Observation?" + "&".join(f"{k}={v}" for k, v in _newest_observation_params(patient_id).items())
+
+    batch_bundle = {
+        'resourceType': 'Bundle',
+        'type': 'batch',
+        'entry': [{'request': {'method': 'GET', 'url': url}}
+                  for url in list(search_urls.values()) + ([newest_url] if newest_url else [])]
+    }
+    response = client.execute('', method='post', data=batch_bundle)
+    if not response or response.get('type') != 'batch-response':
+        raise ValueError("Server did not return a batch-response Bundle")
+
+    raw_by_type = {resource_type: [] for resource_type in search_urls}
+    raw_medications = []
+    response_entries = response.get('entry', None) or []
+    newest_entries = response_entries[len(search_urls):]
+    response_entries = response_entries[:len(search_urls)]
+    # Searches without an answer (short response) are treated as failed
+    failed_types = list(search_urls)[len(response_entries):]
+
+    # Batch responses keep the same order as the request entries
+    for resource_type, entry in zip(search_urls, response_entries):
+        status = str((entry.get('response', None) or {}).get('status', ''))
+        bundle = entry.get('resource', None)
+        if not status.startswith('2') or not bundle or bundle.get('resourceType') != 'Bundle':
+            failed_types.append(resource_type)
+            continue
+        _route_bundle_entries(client, bundle, raw_by_type, raw_medications)
+
+    if newest_url and 'Observation' not in failed_types:
+        newest_bundle = newest_entries[0].get('resource', None) if newest_entries else None
+        if (_has_invalid_observations(raw_by_type['Observation'])
+                or not newest_bundle or newest_bundle.get('resourceType') != 'Bundle'):
+            # The status filter was ignored or the newest Observation is missing
+            failed_types.append('Observation')
+        else:
+            ids = {raw.get('id') for raw in raw_by_type['Observation']}
+            raw_by_type['Observation'].extend(
+                entry['resource'] for entry in newest_bundle.get('entry', None) or []
+                if entry.get('resource') and entry['resource'].get('id') not in ids
+            )
+
+    # Fallback for the single searches the batch could not serve
+    errors = {}
+    for resource_type in failed_types:
+        try:
+            raw_by_type[resource_type] = fetch_resource_type(client, resource_type, patient_id, included=raw_medications.append)
+        except Exception as e:
+            print(f"[ERROR] Error fetching {resource_type} for patient {patient_id}: {e}")
+            raw_by_type.pop(resource_type, None)
+            errors[resource_type] = str(e)
+    if 'MedicationRequest' in errors:
+        errors['Medication'] = errors['MedicationRequest']
+
+    return raw_by_type, raw_medications, errors
+
+def fetch_patient_record(client, patient_id: str, page_handler: PageHandler, mode: str = None,
+                         resource_types: Optional[List[str]] = None, max_workers: int = MAX_FETCH_WORKERS):
+    """
+    Retrieves the clinical resources of a patient with the configured strategy,
+    handing them to page_handler.
+    Args:
+        mode: "everything", "batch" or "per-type" (default: RETRIEVAL_MODE).
+        resource_types: Optional subset of get_downloaded_types(). Partial refreshes
+            always use the per-type searches.
+        max_workers: Upper bound on the number of concurrent per-type searches.
+    Returns:
+        The same tuple as fetch_clinical_resources. The single round-trip modes
+        fall back to the concurrent per-type searches if the server rejects them.
+    """
+    if resource_types and set(resource_types) != set(get_downloaded_types()):
+        return fetch_clinical_resources(client, patient_id, page_handler, max_workers, resource_types=resource_types)
+
+    mode = mode or RETRIEVAL_MODE
+    single_round_trip = {
+        'everything': fetch_patient_everything,
+        'batch': fetch_patient_batch,
+    }
+    if mode in single_round_trip:
+        try:
+            with resource_scope(f'({mode})'):
+                raw_by_type, raw_medications, errors = single_round_trip[mode](client, patient_id)
+        except Exception as e:
+            print(f"[INFO] Retrieval mode '{mode}' not available ({e}). Falling back to per-type searches.")
+        else:
+            return _hand_over(raw_by_type, page_handler), raw_medications, errors
+    return fetch_clinical_resources(client, patient_id, page_handler, max_workers)
+
+def sync_patient_record(client, patient_id: str, store: PatientSnapshotStore, page_handler: PageHandler,
+                        resource_types: Optional[List[str]] = None, max_workers: int = MAX_FETCH_WORKERS):
+    """
+    Brings the on-disk snapshot of the patient up to date and hands it to page_handler.
+    - Cold patient (no snapshot): full download with the configured strategy.
+    - Warm patient: one small _lastUpdated=gt... search per resource type.
+    - Resource types whose last full download is older than SNAPSHOT_MAX_AGE_HOURS
+      are downloaded in full again, and the stored resources the server did not
+      return (deleted or moved to another patient) are removed.
+    Downloaded pages are written to the store as they arrive; the watermark of a
+    type moves forward only once all its pages have been stored.
+    If a search fails, the stored (possibly stale) resources are served instead.
+    Args:
+        resource_types: Optional subset of RESOURCE_CONFIGS to synchronize (default: get_downloaded_types()).
+        max_workers: Upper bound on the number of concurrent searches.
+    Returns:
+        The same tuple as fetch_clinical_resources, counting the complete record
+        of the requested resource types.
+    """
+    resource_types = resource_types or get_downloaded_types()
+    # Before reading the watermarks: a snapshot in use must not be evicted halfway
+    store.touch_patient(patient_id)
+    # Snapshots downloaded with a different projection are discarded
+    for resource_type in resource_types:
+        store.ensure_projection(resource_type, get_snapshot_profile(resource_type))
+    watermarks = store.get_watermarks(patient_id)
+    expired = store.get_expired_types(patient_id)
+    since_by_type = {t: since for t, since in watermarks.items() if t not in expired}
+    # Types downloaded in full this time: their stored resources are replaced
+    full_types = {t for t in resource_types if not since_by_type.get(t)}
+
+    newest = {}
+    new_requests = []
+    seen_ids = {}
+    def store_page(resource_type: str, raw_page: List[dict]):
+        if resource_type in full_types:
+            seen_ids.setdefault(resource_type, set()).update(raw['id'] for raw in raw_page if raw.get('id'))
+        if resource_type == 'MedicationRequest':
+            # Stored only once their Medications are downloaded too (see below)
+            new_requests.extend(raw_page)
+            return
+        last_updated = store.put_resources(patient_id, resource_type, raw_page)
+        if last_updated and last_updated > (newest.get(resource_type) or ''):
+            newest[resource_type] = last_updated
+
+    if since_by_type:
+        counts, raw_medications, errors = fetch_clinical_resources(client, patient_id, store_page, max_workers,
+                                                                   since_by_type=since_by_type, resource_types=resource_types)
+    else:
+        counts, raw_medications, errors = fetch_patient_record(client, patient_id, store_page, resource_types=resource_types,
+                                                               max_workers=max_workers)
+
+    # New MedicationRequests must not move the watermark forward
+    # if their Medications could not be downloaded with them.
+    if 'Medication' in errors:
+        if counts.pop('MedicationRequest', None) is not None:
+            errors['MedicationRequest'] = errors['Medication']
+    elif 'MedicationRequest' in resource_types:
+        store.save_resources(patient_id, 'Medication', raw_medications)
+        newest['MedicationRequest'] = store.put_resources(patient_id, 'MedicationRequest', new_requests)
+        if 'MedicationRequest' in full_types and 'MedicationRequest' in counts:
+            store.prune_resources(patient_id, 'Medication', (raw['id'] for raw in raw_medications if raw.get('id')))
+
+    for resource_type in counts:
+        full = resource_type in full_types
+        if full:
+            removed = store.prune_resources(patient_id, resource_type, seen_ids.get(resource_type, ()))
+            if removed:
+                print(f"[INFO] Removed {removed} {resource_type}(s) of patient {patient_id} no longer on the server.")
+        store.advance_watermark(patient_id, resource_type, newest.get(resource_type), full=full)
+
+    full_counts = {}
+    for resource_type in resource_types:
+        if resource_type in errors:
+            if resource_type not in watermarks:
+                continue
+            print(f"[WARNING] Using stored snapshot for {resource_type} of patient {patient_id}.")
+            errors.pop(resource_type)
+        full_counts[resource_type] = 0
+        for page in store.iter_resources(patient_id, resource_type, BUNDLE_PAGE_SIZE):
+            page_handler(resource_type, page)
+            full_counts[resource_type] += len(page)
+
+    if 'Medication' in errors and 'Medication' in watermarks:
+        errors.pop('Medication')
+    raw_medications = []
+    if 'MedicationRequest' in resource_types:
+        raw_medications = store.load_resources(patient_id, 'Medication')
+    return full_counts, raw_medications, errors
+
+def load_patient_resources(client, patient_id: str, page_handler: PageHandler,
+                           resource_types: Optional[List[str]] = None, max_workers: int = MAX_FETCH_WORKERS):
+    """
+    Hands the raw resources of the requested types to page_handler, page by page,
+    through the on-disk snapshot store when it is enabled, directly from the server otherwise.
+    """
+    store = get_snapshot_store()
+    if store:
+        return sync_patient_record(client, patient_id, store, page_handler, resource_types, max_workers)
+    return fetch_patient_record(client, patient_id, page_handler, resource_types=resource_types, max_workers=max_workers)
+
+def load_patient_slices(client, patient_id: str, max_workers: int = MAX_FETCH_WORKERS) -> Tuple[Dict[str, Any], Dict[str, str]]:
+    """
+    Returns (slices, errors per resource type), see _load_patient_slices.
+    """
+    slices, _, errors = _load_patient_slices(client, patient_id, max_workers)
+    return slices, errors
+
+def _load_patient_slices(client, patient_id: str, max_workers: int = MAX_FETCH_WORKERS) -> Tuple[Dict[str, Any], Dict[str, int], Dict[str, str]]:
+    """
+    Returns the slices {resource type -> (count, wrapped resources)} of the patient
+    ('Medication' holds the medication map), taking the resource types already in
+    the context cache from memory and fetching only the missing ones (see
+    load_patient_resources), wrapping each page as soon as it arrives.
+    Resource types that are only counted (see get_resource_usage) get a slice with
+    their total and no resources; skipped types get no slice.
+    In "lastn" mode the Observations are reduced to the latest ones per code,
+    while their total is counted on the server at the same time.
+    Fetched slices are stored in the context cache.
+    Returns:
+        (slices, their revisions in the context cache, errors per resource type)
+    """
+    cache = get_context_cache()
+    slices, revisions = cache.get_revisioned_slices(patient_id)
+    missing_types = [t for t in RESOURCE_CONFIGS if t not in slices and get_resource_usage(t) != 'skip']
+    if 'Medication' not in slices and 'MedicationRequest' not in missing_types:
+        missing_types.append('MedicationRequest')
+    if not missing_types:
+        return slices, revisions, {}
+    count_only_types = [t for t in missing_types if get_resource_usage(t) == 'count']
+    fetch_types = [t for t in missing_types if t not in count_only_types]
+
+    wrapped = {}
+    latest_observations = _LatestObservations(OBSERVATION_LASTN_MAX)
+    def wrap_page(resource_type: str, raw_page: List[dict]):
+        if resource_type == 'Observation' and OBSERVATION_MODE == 'lastn':
+            # Snapshots and single round-trip modes may hold the whole history
+            for raw in raw_page:
+                latest_observations.add(raw)
+            return
+        wrapped.setdefault(resource_type, []).extend(wrap_resources(resource_type, raw_page))
+
+    count_types = list(count_only_types)
+    if 'Observation' in fetch_types and OBSERVATION_MODE == 'lastn':
+        count_types.append('Observation')
+    totals = {}
+    fetched_counts, raw_medications, errors = {}, [], {}
+    with ThreadPoolExecutor(max_workers=max(1, len(count_types)), thread_name_prefix="fhir-count") as executor:
+        count_futures = {t: submit_traced(executor, count_resources, client, t, patient_id) for t in count_types}
+        if fetch_types:
+            fetched_counts, raw_medications, errors = load_patient_resources(client, patient_id, wrap_page, fetch_types, max_workers)
+        for resource_type, future in count_futures.items():
+            try:
+                totals[resource_type] = future.result()
+            except Exception as e:
+                if resource_type in count_only_types:
+                    print(f"[ERROR] Error counting {resource_type} for patient {patient_id}: {e}")
+                    errors[resource_type] = str(e)
+                else:
+                    print(f"[WARNING] Could not count {resource_type}s for patient {patient_id}: {e}")
+    if latest_observations:
+        wrapped['Observation'] = wrap_resources('Observation', latest_observations.flatten())
+
+    # Only the resource types downloaded (or counted) completely are cached
+    for resource_type, count in fetched_counts.items():
+        slices[resource_type] = (totals.get(resource_type, count), wrapped.get(resource_type, []))
+        revisions[resource_type] = cache.put_slice(patient_id, resource_type, slices[resource_type])
+    for resource_type in count_only_types:
+        if resource_type in totals:
+            slices[resource_type] = (totals[resource_type], [])
+            revisions[resource_type] = cache.put_slice(patient_id, resource_type, slices[resource_type])
+    if 'MedicationRequest' in fetch_types and 'Medication' not in errors:
+        slices['Medication'] = build_medication_map(raw_medications)
+        revisions['Medication'] = cache.put_slice(patient_id, 'Medication', slices['Medication'])
+    return slices, revisions, errors
+
+def build_clinical_context(patient_json: dict, client) -> Tuple[str, Dict[str, int], int]:
+    """
+    Orchestrates the retrieval of all clinical resources for a selected patient.
+    1. Takes the patient object (with its resource indexes) from the context cache,
+       or parses the base Patient resource.
+    2. Loads its resources from the context cache or the server (see load_patient_slices).
+    3. Adds to the patient object only the slices it does not hold yet (new revision),
+       replacing the previous resources of those types.
+    4. Generates the final text summary (prompt) for the LLM, reusing the sections
+       whose slices did not change since the last build (keyed by the slice revisions).
+    Resource types that could not be retrieved are marked as unavailable in the
+    summary and get a count of None instead of 0.
+    Returns:
+        (clinical context string, resource counts per type, patient age)
+    """
+    cache = get_context_cache()
+    patient_id = patient_json.get('id')
+    # Builds of the same patient take turns on its cached patient object
+    with cache.patient_lock(patient_id):
+        selected_patient = cache.get_patient(patient_id, patient_json)
+        if selected_patient is None:
+            try:
+                selected_patient = AppPatient(patient_json)
+            except Exception as e:
+                return f"Error parsing patient data: {e}", {}, "N/A"
+
+        slices, revisions, errors = _load_patient_slices(client, selected_patient.id)
+
+        counts = {}
+        for resource_type in RESOURCE_CONFIGS:
+            if get_resource_usage(resource_type) == 'skip':
+                continue
+            if resource_type not in slices:
+                counts[resource_type] = None if resource_type in errors else 0
+                if selected_patient.resource_revision(resource_type) is not None:
+                    selected_patient.replace_resources(resource_type, [])
+                continue
+            counts[resource_type], app_objects = slices[resource_type]
+            revision = revisions.get(resource_type)
+            if revision is None or revision != selected_patient.resource_revision(resource_type):
+                with timed('aggregate', resource_type, count=len(app_objects)):
+                    selected_patient.replace_resources(resource_type, app_objects, revision)
+        cache.put_patient(patient_id, patient_json, selected_patient)
+
+        medication_map = slices.get('Medication', {})
+        with timed('render', 'context'):
+            context = selected_patient.generate_clinical_context(
+                medication_map, unavailable_types=list(errors),
+                revisions=revisions
+            )
+        return context, counts, selected_patient.age
+
+def invalidate_patient_resources(patient_id: str, resource_types: Optional[List[str]] = None):
+    """
+    Marks the given resource types (or all of them) of one patient as stale.
+    The next build of that patient's context downloads only these types;
+    the cached data of every other patient is left untouched.
+    """
+    get_context_cache().invalidate(patient_id, resource_types)
@@ -0,0 +1,152 @@
+'''
+Script: context_cache.py
+Digital Health Systems and Applications - Project work 2025-2026
+Description:
+Process-wide in-memory cache of the wrapped clinical resources of recently opened
+patients, kept per patient and per resource type ("slices"). Each patient has a
+revision number that is part of the Streamlit cache key of the clinical context:
+invalidating a single slice (e.g. DocumentReference after a CDA upload) bumps the
+revision of that patient only, and the next build downloads only that slice.
+Every slice gets a revision number when stored. The AppPatient built from the slices
+(with its indexes and rendered context sections, keyed by the slice revisions) is kept
+next to them and updated under a per-patient lock, so the next build adds again only
+the replaced slices and renders again only the sections that read them.
+
+Group: Carmine Vardaro, Marco Savastano, Francesco Ferrara.
+'''
+
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+# Maximum number of patients whose resources are kept in memory (least recently used are dropped)
+MAX_CACHED_PATIENTS = 20
+
+class PatientContextCache:
+    def __init__(self, max_patients: int = MAX_CACHED_PATIENTS):
+        self.max_patients = max_patients
+        self._lock = threading.Lock()
+        self._slices: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._revisions: Dict[str, int] = {}
+        # Revision of every cached slice, unique in the process (a new value per put_slice)
+        self._slice_revisions: Dict[str, Dict[str, int]] = {}
+        self._next_slice_revision = 0
+        # patient id -> (Patient JSON, AppPatient holding the cached slices, see build_clinical_context)
+        self._patients: Dict[str, Tuple[dict, Any]] = {}
+        # Serialize the updates of each cached AppPatient (kept after eviction, a build may hold one)
+        self._patient_locks: Dict[str, threading.Lock] = {}
+
+    def revision(self, patient_id: str) -> int:
+        """
+        Returns the current revision of the patient's cached data.
+        """
+        with self._lock:
+            return self._revisions.get(patient_id, 0)
+
+    def contains(self, patient_id: str) -> bool:
+        """
+        Tells whether some data of the patient is cached (without refreshing its LRU position).
+        """
+        with self._lock:
+            return patient_id in self._slices
+
+    def patient_count(self) -> int:
+        """
+        Returns the number of patients currently cached.
+        """
+        with self._lock:
+            return len(self._slices)
+
+    def get_slices(self, patient_id: str) -> Dict[str, Any]:
+        """
+        Returns a copy of the cached slices {resource type -> value} of the patient.
+        """
+        with self._lock:
+            return self._get_slices_locked(patient_id)
+
+    def _get_slices_locked(self, patient_id: str) -> Dict[str, Any]:
+        # Called with the lock held
+        slices = self._slices.get(patient_id)
+        if slices is None:
+            return {}
+        self._slices.move_to_end(patient_id)
+        return dict(slices)
+
+    def get_revisioned_slices(self, patient_id: str) -> Tuple[Dict[str, Any], Dict[str, int]]:
+        """
+        Same as get_slices, also returning the revisions {resource type -> revision} of the slices.
+        """
+        with self._lock:
+            slices = self._get_slices_locked(patient_id)
+            return slices, dict(self._slice_revisions.get(patient_id, {})) if slices else {}
+
+    def put_slice(self, patient_id: str, resource_type: str, value: Any) -> int:
+        """
+        Stores a slice of the patient's data, evicting the least recently used patients.
+        Returns the new revision of the slice.
+        """
+        with self._lock:
+            slices = self._slices.setdefault(patient_id, {})
+            slices[resource_type] = value
+            self._next_slice_revision += 1
+            self._slice_revisions.setdefault(patient_id, {})[resource_type] = self._next_slice_revision
+            self._slices.move_to_end(patient_id)
+            while len(self._slices) > self.max_patients:
+                self._drop_patient(next(iter(self._slices)))
+            return self._next_slice_revision
+
+    def _drop_patient(self, patient_id: str):
+        # Called with the lock held
+        self._slices.pop(patient_id, None)
+        self._slice_revisions.pop(patient_id, None)
+        self._patients.pop(patient_id, None)
+
+    def patient_lock(self, patient_id: str) -> threading.Lock:
+        """
+        Returns the lock to hold while updating or reading the cached AppPatient of the patient.
+        """
+        with self._lock:
+            return self._patient_locks.setdefault(patient_id, threading.Lock())
+
+    def get_patient(self, patient_id: str, patient_json: dict) -> Optional[Any]:
+        """
+        Returns the cached AppPatient of the patient, or None if there is none or it
+        was built from another version of the Patient resource.
+        """
+        with self._lock:
+            cached = self._patients.get(patient_id)
+        if cached is None or cached[0] != patient_json:
+            return None
+        return cached[1]
+
+    def put_patient(self, patient_id: str, patient_json: dict, patient: Any):
+        """
+        Keeps the AppPatient of a patient whose slices are cached (it is evicted with them).
+        """
+        with self._lock:
+            if patient_id in self._slices:
+                self._patients[patient_id] = (patient_json, patient)
+
+    def invalidate(self, patient_id: str, resource_types: Optional[List[str]] = None):
+        """
+        Drops the given slices (or all of them) of one patient and bumps its revision.
+        Other patients are not affected.
+        """
+        with self._lock:
+            slices = self._slices.get(patient_id)
+            if slices is not None:
+                if resource_types is None:
+                    self._drop_patient(patient_id)
+                else:
+                    for resource_type in resource_types:
+                        slices.pop(resource_type, None)
+                        self._slice_revisions.get(patient_id, {}).pop(resource_type, None)
+            self._revisions[patient_id] = self._revisions.get(patient_id, 0) + 1
+
+_default_cache = PatientContextCache()
+
+def get_context_cache() -> PatientContextCache:
+    """
+    Returns the process-wide patient context cache.
+    """
+    return _default_cache
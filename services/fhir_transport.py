@@ -0,0 +1,342 @@
+'''
+Script: fhir_transport.py
+Digital Health Systems and Applications - Project work 2025-2026
+Description:
+Shared HTTP transport layer for all the traffic towards the FHIR Server.
+A single requests.Session (connection pooling + keep-alive, gzip/deflate
+negotiation, FHIR JSON headers) is shared by the Streamlit app and every utility
+script, so TCP/TLS connections are reused across pages, searches and bundle uploads.
+PooledSyncFHIRClient is a fhirpy SyncFHIRClient that sends its requests through
+this session with configurable timeouts. Search results can be streamed one page
+at a time as raw JSON, without materializing the whole result set.
+Every request has an overall deadline; idempotent (GET) requests are retried with
+exponential backoff on network errors and overload answers (429/502/503/504), and
+can be hedged (a duplicate is sent if the first one is slow). A circuit breaker per
+server fails fast while the server keeps failing, instead of piling up timeouts.
+
+Group: Carmine Vardaro, Marco Savastano, Francesco Ferrara.
+'''
+
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from fhirpy import SyncFHIRClient
+from fhirpy.base.exceptions import (
+    AuthorizationError,
+    ForbiddenError,
+    MultipleResourcesFound,
+    OperationOutcome,
+    ResourceNotFound,
+)
+from fhirpy.base.utils import AttrDict, parse_pagination_url
+
+from services.metrics import record
+
+# Timeouts in seconds (connection establishment, waiting for the response)
+HTTP_CONNECT_TIMEOUT = float(os.getenv("FHIR_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("FHIR_READ_TIMEOUT", "60"))
+HTTP_TIMEOUT = (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+
+# Number of keep-alive connections kept open per host
+HTTP_POOL_SIZE = int(os.getenv("FHIR_POOL_SIZE", "16"))
+
+# Overall time budget of one request, retries included (seconds)
+HTTP_REQUEST_DEADLINE = float(os.getenv("FHIR_REQUEST_DEADLINE", "90"))
+
+# Retries of idempotent requests, with exponential backoff (base and cap in seconds)
+HTTP_MAX_RETRIES = int(os.getenv("FHIR_MAX_RETRIES", "2"))
+HTTP_BACKOFF_BASE = 0.5
+HTTP_BACKOFF_MAX = 8.0
+RETRY_STATUSES = (429, 502, 503, 504)
+# Network errors worth a retry (a broken or badly encoded body included)
+RETRY_EXCEPTIONS = (requests.ConnectionError, requests.Timeout,
+                    requests.exceptions.ChunkedEncodingError, requests.exceptions.ContentDecodingError)
+
+# Send a duplicate GET if no answer arrived after this many seconds (0 disables hedging)
+HTTP_HEDGE_AFTER = float(os.getenv("FHIR_HEDGE_AFTER", "0"))
+
+# Circuit breaker: consecutive failures that open it, seconds before a new attempt
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("FHIR_CIRCUIT_THRESHOLD", "5"))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("FHIR_CIRCUIT_RESET", "30"))
+
+DEFAULT_HEADERS = {
+    'Accept': 'application/fhir+json',
+    'Accept-Encoding': 'gzip, deflate',
+    'Connection': 'keep-alive',
+}
+
+def create_http_session(pool_size: int = HTTP_POOL_SIZE) -> requests.Session:
+    """
+    Creates a requests.Session with a connection pool large enough for the
+    concurrent fetch engine and the default FHIR headers.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update(DEFAULT_HEADERS)
+    return session
+
+_shared_session = None
+_shared_session_lock = threading.Lock()
+
+class ServerUnavailableError(requests.ConnectionError):
+    """
+    Raised without contacting the server while its circuit breaker is open.
+    """
+
+class DeadlineExceededError(requests.Timeout):
+    """
+    Raised when a request (retries included) did not complete within its deadline.
+    """
+
+class CircuitBreaker:
+    """
+    Per-server circuit breaker: after `threshold` consecutive failures the circuit
+    opens and requests fail immediately; after `reset_timeout` seconds a single
+    trial request is let through (half-open), and its outcome closes or reopens it.
+    """
+    def __init__(self, server: str, threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+                 reset_timeout: float = CIRCUIT_RESET_TIMEOUT):
+        self.server = server
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_running = False
+
+    def before_request(self):
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if time.monotonic() - self._opened_at < self.reset_timeout or self._trial_running:
+                raise ServerUnavailableError(f"{self.server} is unavailable (too many consecutive failures)")
+            self._trial_running = True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_running = False
+            if self._opened_at is not None or self._failures >= self.threshold:
+                self._opened_at = time.monotonic()
+
+_circuit_breakers: Dict[str, CircuitBreaker] = {}
+_circuit_breakers_lock = threading.Lock()
+
+def get_circuit_breaker(url: str) -> CircuitBreaker:
+    """
+    Returns the circuit breaker of the server (scheme + host) of the given URL.
+    """
+    parts = urlsplit(url)
+    server = f"{parts.scheme}://{parts.netloc}"
+    with _circuit_breakers_lock:
+        if server not in _circuit_breakers:
+            _circuit_breakers[server] = CircuitBreaker(server)
+        return _circuit_breakers[server]
+
+def _backoff_delay(attempt: int, response: Optional[requests.Response]) -> float:
+    """
+    Exponential backoff with full jitter, or the server's Retry-After (in seconds) if given.
+    """
+    retry_after = response.headers.get('Retry-After') if response is not None else None
+    if retry_after and retry_after.isdigit():
+        return float(retry_after)
+    return random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * (2 ** attempt)))
+
+# Threads sending the hedged duplicates of slow requests
+_hedge_executor = ThreadPoolExecutor(max_workers=HTTP_POOL_SIZE, thread_name_prefix="fhir-hedge")
+
+def get_http_session() -> requests.Session:
+    """
+    Returns the process-wide pooled HTTP session.
+    """
+    global _shared_session
+    with _shared_session_lock:
+        if _shared_session is None:
+            _shared_session = create_http_session()
+    return _shared_session
+
+class PooledSyncFHIRClient(SyncFHIRClient):
+    """
+    fhirpy client sending every request through a shared pooled session.
+    """
+    def __init__(self, url: str, session: Optional[requests.Session] = None,
+                 timeout: Union[float, Tuple[float, float]] = HTTP_TIMEOUT,
+                 deadline: float = HTTP_REQUEST_DEADLINE, max_retries: int = HTTP_MAX_RETRIES,
+                 hedge_after: float = HTTP_HEDGE_AFTER, **kwargs):
+        super().__init__(url, **kwargs)
+        self.session = session or get_http_session()
+        self.timeout = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.hedge_after = hedge_after
+
+    def _attempt(self, method: str, url: str, data: Optional[dict], headers: dict, timeout: Tuple[float, float]) -> requests.Response:
+        """
+        Sends the request once. A GET still unanswered after hedge_after seconds is
+        sent a second time and the first answer wins (the other one is discarded).
+        """
+        def send():
+            return self.session.request(method, url, json=data, headers=headers, timeout=timeout, **self.requests_config)
+
+        if method.upper() != 'GET' or self.hedge_after <= 0:
+            return send()
+        first = _hedge_executor.submit(send)
+        done, _ = wait([first], timeout=self.hedge_after)
+        if done:
+            return first.result()
+        pending = {first, _hedge_executor.submit(send)}
+        while True:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None or not pending:
+                    return future.result()
+
+    def _send(self, method: str, url: str, data: Optional[dict], headers: dict) -> requests.Response:
+        """
+        Sends a request within the deadline, retrying idempotent requests with
+        exponential backoff, and keeps the circuit breaker of the server updated:
+        every attempt ends with record_success or record_failure, whatever it raised,
+        so a half-open trial is always settled.
+        Raises DeadlineExceededError when the deadline leaves no time for another attempt.
+        """
+        breaker = get_circuit_breaker(url)
+        breaker.before_request()
+        retryable = method.upper() == 'GET'
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                breaker.record_failure()
+                raise DeadlineExceededError(f"{method.upper()} {url} exceeded its {self.deadline}s deadline")
+            timeout = (min(self.timeout[0], remaining), min(self.timeout[1], remaining))
+
+            response, error = None, None
+            try:
+                response = self._attempt(method, url, data, headers, timeout)
+            except requests.RequestException as e:
+                error = e
+            except BaseException:
+                breaker.record_failure()
+                raise
+            if response is not None and response.status_code not in RETRY_STATUSES:
+                breaker.record_success()
+                return response
+            breaker.record_failure()
+
+            delay = _backoff_delay(attempt, response)
+            if error is not None and not isinstance(error, RETRY_EXCEPTIONS):
+                raise error
+            if not retryable or attempt >= self.max_retries:
+                if response is not None:
+                    return response
+                raise error
+            if time.monotonic() + delay >= deadline:
+                if response is not None:
+                    return response
+                raise DeadlineExceededError(f"{method.upper()} {url} exceeded its {self.deadline}s deadline ({error})") from error
+            print(f"[WARNING] {method.upper()} {url} failed ({error or response.status_code}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+            attempt += 1
+            breaker.before_request()
+
+    def _do_request(self, method: str, path: str, data: Optional[dict] = None, params: Optional[dict] = None,
+                    extra_headers: Optional[dict] = None, *, returning_status: bool = False) -> Any:
+        # Same contract as fhirpy's SyncClient._do_request, on the pooled session
+        headers = self._build_request_headers()
+        if extra_headers:
+            headers = {**headers, **extra_headers}
+
+        url = self._build_request_url(path, params)
+        start = time.perf_counter()
+        r = self._send(method, url, data, headers)
+        # Network time and payload size, attributed to the enclosing resource_scope
+        record('fetch', None, time.perf_counter() - start, nbytes=len(r.content))
+
+        if 200 <= r.status_code < 300:
+            r_data = json.loads(r.content.decode(), object_hook=AttrDict) if r.content else None
+            return (r_data, r.status_code) if returning_status else r_data
+
+        if r.status_code == 401:
+            raise AuthorizationError(r.content.decode())
+        if r.status_code == 403:
+            raise ForbiddenError(r.content.decode())
+        if r.status_code == 304:
+            return (None, r.status_code) if returning_status else None
+        if r.status_code in (404, 410):
+            raise ResourceNotFound(r.content.decode())
+        if r.status_code == 412:
+            raise MultipleResourcesFound(r.content.decode())
+
+        raw_data = r.content.decode()
+        try:
+            parsed_data = json.loads(raw_data)
+            if parsed_data["resourceType"] == "OperationOutcome":
+                raise OperationOutcome(resource=parsed_data)
+            raise OperationOutcome(reason=raw_data)
+        except (KeyError, json.JSONDecodeError) as exc:
+            raise OperationOutcome(reason=raw_data) from exc
+
+def get_next_link(bundle) -> Optional[str]:
+    """
+    Returns the 'next' pagination link of a searchset Bundle (or None).
+    """
+    for link in bundle.get('link', None) or []:
+        if link.get('relation') == 'next':
+            return link.get('url')
+    return None
+
+def iter_bundle_pages(client, bundle) -> Iterator[dict]:
+    """
+    Yields the given searchset Bundle and then every following page,
+    requesting each page only when the previous one has been consumed.
+    """
+    while bundle:
+        yield bundle
+        next_link = get_next_link(bundle)
+        if not next_link:
+            break
+        path, params = parse_pagination_url(next_link)
+        bundle = client.execute(path, method='get', params=params)
+
+def iter_search_pages(client, resource_type: str, params: dict,
+                      included: Optional[Callable[[dict], None]] = None) -> Iterator[List[dict]]:
+    """
+    Runs a search and yields the matching resources page by page, as raw JSON
+    dictionaries. Resources of other types on the same pages (added by _include)
+    are passed to included, if given; anything else (e.g. OperationOutcome) is skipped.
+    """
+    bundle = client.execute(resource_type, method='get', params=params)
+    for page in iter_bundle_pages(client, bundle):
+        matches = []
+        for entry in page.get('entry', None) or []:
+            resource = entry.get('resource', None)
+            if not resource:
+                continue
+            if resource.get('resourceType') == resource_type:
+                matches.append(resource)
+            elif included and (entry.get('search', None) or {}).get('mode', 'include') == 'include':
+                included(resource)
+        yield matches
+
+def create_fhir_client(url: str, **kwargs) -> PooledSyncFHIRClient:
+    """
+    Creates a fhirpy client for the given server that uses the shared pooled session.
+    """
+    return PooledSyncFHIRClient(url, **kwargs)
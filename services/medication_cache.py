@@ -0,0 +1,75 @@
+'''
+Script: medication_cache.py
+Digital Health Systems and Applications - Project work 2025-2026
+Description:
+Process-wide cache of the wrapped Medication resources, shared by all patients.
+The server holds only a small catalogue of distinct Medications referenced by a very
+large number of MedicationRequests, so the same Medications are included again and
+again: each one is parsed (validated) only once per version and reused afterwards.
+
+Group: Carmine Vardaro, Marco Savastano, Francesco Ferrara.
+'''
+
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from resources.medications.medication import AppMedication
+
+# Maximum number of Medications kept in memory (least recently used are dropped)
+MAX_CACHED_MEDICATIONS = 5000
+
+def _version_of(raw_medication: dict) -> Optional[str]:
+    """
+    Returns the version of a raw Medication (meta.versionId, else meta.lastUpdated).
+    """
+    meta = raw_medication.get('meta', None) or {}
+    return meta.get('versionId', None) or meta.get('lastUpdated', None)
+
+class MedicationCache:
+    def __init__(self, max_medications: int = MAX_CACHED_MEDICATIONS):
+        self.max_medications = max_medications
+        self._lock = threading.Lock()
+        self._medications: "OrderedDict[str, Tuple[Optional[str], AppMedication]]" = OrderedDict()
+
+    def wrap(self, raw_medication: dict) -> AppMedication:
+        """
+        Returns the AppMedication of a raw Medication, parsing it only if the
+        same version is not cached yet. Raises if the resource cannot be parsed.
+        """
+        medication_id = raw_medication['id']
+        version = _version_of(raw_medication)
+        with self._lock:
+            cached = self._medications.get(medication_id)
+            if cached is not None and cached[0] == version:
+                self._medications.move_to_end(medication_id)
+                return cached[1]
+
+        app_medication = AppMedication(raw_medication)
+        with self._lock:
+            self._medications[medication_id] = (version, app_medication)
+            self._medications.move_to_end(medication_id)
+            while len(self._medications) > self.max_medications:
+                self._medications.popitem(last=False)
+        return app_medication
+
+    def build_map(self, raw_medications: List[dict]) -> Dict[str, AppMedication]:
+        """
+        Builds the resolution map {Medication id -> AppMedication} used by MedicationRequests.
+        Medications that cannot be parsed are skipped with a warning.
+        """
+        medication_map = {}
+        for raw in raw_medications:
+            try:
+                medication_map[raw['id']] = self.wrap(raw)
+            except Exception as e:
+                print(f"[WARNING] Could not parse Medication {raw.get('id', 'Unknown')}: {e}")
+        return medication_map
+
+_default_cache = MedicationCache()
+
+def get_medication_cache() -> MedicationCache:
+    """
+    Returns the process-wide Medication cache.
+    """
+    return _default_cache
@@ -0,0 +1,161 @@
+'''
+Script: metrics.py
+Digital Health Systems and Applications - Project work 2025-2026
+Description:
+Per-stage latency instrumentation of a patient open. While a trace is active, the
+fetch layer records the wall time and size of every HTTP response, the wrappers
+record the time spent parsing (validating) each page, and the clinical context
+records aggregation, rendering and tokenization, each per resource type.
+The active trace follows the request into the fetch worker threads (see
+submit_traced), so concurrent downloads are attributed to the right patient, while
+background work (e.g. the prefetch) is not traced. Completed traces are shown in the
+sidebar and appended to a JSON Lines file for offline analysis.
+
+Group: Carmine Vardaro, Marco Savastano, Francesco Ferrara.
+'''
+
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional
+
+# JSON Lines file receiving one record per patient open (empty string disables it)
+METRICS_LOG_PATH = os.getenv("FHIR_METRICS_LOG", "patient_open_metrics.jsonl")
+
+# Stages of a patient open, in display order
+STAGES = ('fetch', 'parse', 'aggregate', 'render', 'tokenize')
+
+class StageTrace:
+    """
+    Wall time, bytes, resource count and number of calls per (stage, resource type)
+    of one patient open. Safe to update from several threads.
+    Stage times of concurrent work are summed, so they can exceed the total time.
+    """
+    def __init__(self, patient_id: str):
+        self.patient_id = patient_id
+        self.started_at = datetime.now(timezone.utc)
+        self._start = time.perf_counter()
+        self.total_seconds: Optional[float] = None
+        self._lock = threading.Lock()
+        self._stats: Dict[tuple, List[float]] = {}
+
+    def add(self, stage: str, resource_type: str, seconds: float, nbytes: int = 0, count: int = 0):
+        with self._lock:
+            stats = self._stats.setdefault((stage, resource_type), [0.0, 0, 0, 0])
+            stats[0] += seconds
+            stats[1] += nbytes
+            stats[2] += count
+            stats[3] += 1
+
+    def finish(self):
+        self.total_seconds = time.perf_counter() - self._start
+
+    def rows(self) -> List[dict]:
+        """
+        Returns one row per (stage, resource type), in stage order then by time spent.
+        """
+        with self._lock:
+            items = list(self._stats.items())
+        rows = [
+            {'stage': stage, 'resource_type': resource_type, 'seconds': round(seconds, 4),
+             'bytes': nbytes, 'count': count, 'calls': calls}
+            for (stage, resource_type), (seconds, nbytes, count, calls) in items
+        ]
+        order = {stage: i for i, stage in enumerate(STAGES)}
+        rows.sort(key=lambda r: (order.get(r['stage'], len(STAGES)), -r['seconds']))
+        return rows
+
+    def stage_totals(self) -> Dict[str, float]:
+        """
+        Returns the time spent per stage (all resource types together).
+        """
+        totals = {}
+        for row in self.rows():
+            totals[row['stage']] = totals.get(row['stage'], 0.0) + row['seconds']
+        return totals
+
+    def to_record(self) -> dict:
+        return {
+            'timestamp': self.started_at.isoformat(),
+            'patient_id': self.patient_id,
+            'total_seconds': round(self.total_seconds, 4) if self.total_seconds is not None else None,
+            'stages': self.rows(),
+        }
+
+_current_trace: contextvars.ContextVar = contextvars.ContextVar('fhir_stage_trace', default=None)
+_current_resource_type: contextvars.ContextVar = contextvars.ContextVar('fhir_resource_type', default=None)
+_log_lock = threading.Lock()
+
+def current_trace() -> Optional[StageTrace]:
+    return _current_trace.get()
+
+def record(stage: str, resource_type: Optional[str], seconds: float, nbytes: int = 0, count: int = 0):
+    """
+    Adds a measurement to the active trace (no-op when nothing is traced).
+    A resource type of None is taken from the enclosing resource_scope.
+    """
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(stage, resource_type or _current_resource_type.get() or 'other', seconds, nbytes, count)
+
+@contextmanager
+def timed(stage: str, resource_type: Optional[str] = None, count: int = 0) -> Iterator[None]:
+    """
+    Records the wall time of the enclosed block in the active trace.
+    """
+    if _current_trace.get() is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, resource_type, time.perf_counter() - start, count=count)
+
+@contextmanager
+def resource_scope(resource_type: str) -> Iterator[None]:
+    """
+    Attributes the measurements of the enclosed block without an explicit
+    resource type (e.g. HTTP responses) to resource_type.
+    """
+    token = _current_resource_type.set(resource_type)
+    try:
+        yield
+    finally:
+        _current_resource_type.reset(token)
+
+def submit_traced(executor, fn, *args, **kwargs):
+    """
+    executor.submit that runs fn in a copy of the caller's context, so the work
+    done in the worker thread is recorded in the caller's trace.
+    """
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+def append_metrics_log(trace: StageTrace, path: str = METRICS_LOG_PATH):
+    """
+    Appends the trace to the JSON Lines metrics file.
+    """
+    if not path:
+        return
+    line = json.dumps(trace.to_record())
+    try:
+        with _log_lock, open(path, 'a', encoding='utf-8') as f:
+            f.write(line + '\n')
+    except OSError as e:
+        print(f"[WARNING] Could not write metrics to {path}: {e}")
+
+@contextmanager
+def activate(trace: StageTrace) -> Iterator[StageTrace]:
+    """
+    Makes trace the active trace of the enclosed block (a trace can be activated
+    several times, e.g. around loading and then around tokenization).
+    """
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
@@ -0,0 +1,270 @@
+'''
+Script: patient_directory.py
+Digital Health Systems and Applications - Project work 2025-2026
+Description:
+Compact local directory of the whole patient population, used by the patient picker
+as an alternative to a server search on every keystroke. Each patient is reduced to
+a small record (id, cleaned name, gender, birth date, deceased flag) built from
+AppPatient once per version; the directory is refreshed incrementally with
+_lastUpdated=gt... searches, and patients deleted on the server (detected with a
+_summary=count search) are removed by a sweep of the patient ids. A failed refresh
+keeps the last good directory. Lookups use an in-memory index: character trigrams
+for fuzzy name matching, plus sorted name tokens and birth dates for prefix matching.
+
+Group: Carmine Vardaro, Marco Savastano, Francesco Ferrara.
+'''
+
+import heapq
+import os
+import threading
+import time
+import unicodedata
+from bisect import bisect_left
+from typing import Dict, List, NamedTuple, Optional, Set
+
+from resources.administration.patient import AppPatient
+from services.fhir_transport import iter_search_pages
+
+# Seconds between two incremental refreshes of the directory
+DIRECTORY_REFRESH_INTERVAL = int(os.getenv("PATIENT_DIRECTORY_REFRESH", "60"))
+
+# Patients per page when (re)loading the directory
+DIRECTORY_PAGE_SIZE = 500
+
+# Minimum share of the query trigrams a name must contain to match
+MIN_TRIGRAM_SIMILARITY = 0.5
+
+class PatientEntry(NamedTuple):
+    id: str
+    name: str
+    gender: Optional[str]
+    birth_date: Optional[str]
+    is_deceased: bool
+    last_updated: Optional[str]
+
+def clean_patient_name(full_name: str) -> str:
+    """
+    Keeps the first name of AppPatient.full_name without its ordinal prefix (e.g. "1st: John").
+    """
+    raw_name = full_name.split('\n')[0]
+    return raw_name.split(':', 1)[1].strip() if ":" in raw_name else raw_name
+
+def normalize_text(text: str) -> str:
+    """
+    Lower-cases the text and removes accents, for accent-insensitive matching.
+    """
+    decomposed = unicodedata.normalize('NFKD', text or '')
+    return ''.join(ch for ch in decomposed if not unicodedata.combining(ch)).lower().strip()
+
+def _trigrams(text: str) -> Set[str]:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def entry_from_raw(raw_patient: dict) -> PatientEntry:
+    """
+    Builds the directory record of a raw Patient. Raises if it cannot be parsed.
+    """
+    patient = AppPatient(raw_patient)
+    gender = patient.gender.value if patient.gender else None
+    birth_date = patient.birth_date.strftime('%Y-%m-%d') if patient.birth_date else None
+    meta = raw_patient.get('meta', None) or {}
+    return PatientEntry(patient.id, clean_patient_name(patient.full_name), gender, birth_date,
+                        patient.is_deceased, meta.get('lastUpdated', None))
+
+class PatientDirectory:
+    def __init__(self, refresh_interval: int = DIRECTORY_REFRESH_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._entries: Dict[str, PatientEntry] = {}
+        self._trigram_index: Dict[str, Set[str]] = {}
+        self._tokens: List[tuple] = []  # sorted (name token, patient id)
+        self._birth_dates: List[tuple] = []  # sorted (birth date, patient id)
+        self._sorted_dirty = False
+        # Ids of the patients on the server that could not be parsed (not in _entries)
+        self._unparsed_ids: Set[str] = set()
+        self._watermark: Optional[str] = None
+        self._refreshed_at = 0.0
+        # Error of the last refresh (None if it succeeded)
+        self.last_error: Optional[str] = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _unindex(self, entry: PatientEntry):
+        for trigram in _trigrams(normalize_text(entry.name)):
+            ids = self._trigram_index.get(trigram)
+            if ids:
+                ids.discard(entry.id)
+                if not ids:
+                    del self._trigram_index[trigram]
+
+    def _index(self, entry: PatientEntry):
+        for trigram in _trigrams(normalize_text(entry.name)):
+            self._trigram_index.setdefault(trigram, set()).add(entry.id)
+
+    def upsert(self, entries: List[PatientEntry]):
+        """
+        Adds or replaces the given records and updates the index.
+        """
+        with self._lock:
+            for entry in entries:
+                previous = self._entries.get(entry.id)
+                if previous is not None:
+                    self._unindex(previous)
+                self._entries[entry.id] = entry
+                self._unparsed_ids.discard(entry.id)
+                self._index(entry)
+                if entry.last_updated and (self._watermark is None or entry.last_updated > self._watermark):
+                    self._watermark = entry.last_updated
+            self._sorted_dirty = True
+
+    def remove(self, patient_ids: Set[str]):
+        """
+        Removes the records of the given patients and updates the index.
+        """
+        with self._lock:
+            for patient_id in patient_ids:
+                entry = self._entries.pop(patient_id, None)
+                if entry is not None:
+                    self._unindex(entry)
+                self._unparsed_ids.discard(patient_id)
+            self._sorted_dirty = True
+
+    def refresh(self, client, force: bool = False) -> int:
+        """
+        Downloads the patients created or updated since the last refresh (all of them
+        the first time), at most once every refresh_interval seconds unless forced,
+        then removes the patients deleted on the server.
+        Only the elements needed by the directory are requested. If the server cannot
+        be reached, the current records are kept and the error is stored in last_error.
+        Returns the number of records added or updated.
+        """
+        if not force and time.monotonic() - self._refreshed_at < self.refresh_interval:
+            return 0
+        # A single refresh at a time; concurrent callers keep using the current data
+        if not self._refresh_lock.acquire(blocking=False):
+            return 0
+        updated = 0
+        try:
+            params = {
+                '_count': DIRECTORY_PAGE_SIZE,
+                '_sort': '_lastUpdated',
+                '_elements': 'name,gender,birthDate,deceased,meta',
+            }
+            if self._watermark:
+                params['_lastUpdated'] = f'gt{self._watermark}'
+            for page in iter_search_pages(client, 'Patient', params):
+                entries = []
+                for raw in page:
+                    try:
+                        entries.append(entry_from_raw(raw))
+                    except Exception as e:
+                        print(f"[WARNING] Could not parse Patient {raw.get('id', 'Unknown')}: {e}")
+                        if raw.get('id'):
+                            with self._lock:
+                                self._unparsed_ids.add(raw['id'])
+                # Pages come in _lastUpdated order: the watermark only covers stored records
+                self.upsert(entries)
+                updated += len(entries)
+            self._remove_deleted(client)
+            self.last_error = None
+        except Exception as e:
+            print(f"[WARNING] Patient directory refresh failed, keeping the last {len(self)} patients: {e}")
+            self.last_error = str(e)
+        finally:
+            self._refreshed_at = time.monotonic()
+            self._refresh_lock.release()
+        return updated
+
+    def _remove_deleted(self, client):
+        """
+        Compares the number of patients on the server with the known ones and, if
+        some were deleted, downloads the list of ids to drop the missing records.
+        """
+        bundle = client.execute('Patient', method='get', params={'_summary': 'count'})
+        total = bundle.get('total', None)
+        with self._lock:
+            known = len(self._entries) + len(self._unparsed_ids)
+        if total is None or total >= known:
+            return
+        server_ids = set()
+        for page in iter_search_pages(client, 'Patient', {'_count': DIRECTORY_PAGE_SIZE, '_elements': 'id'}):
+            server_ids.update(raw['id'] for raw in page if raw.get('id'))
+        with self._lock:
+            deleted = (set(self._entries) | self._unparsed_ids) - server_ids
+        if deleted:
+            print(f"[INFO] Removing {len(deleted)} patients deleted on the server from the directory.")
+            self.remove(deleted)
+
+    def _ensure_sorted(self):
+        # The sorted lists are rebuilt lazily, once after a batch of updates
+        if not self._sorted_dirty:
+            return
+        self._tokens = sorted(
+            (token, entry.id) for entry in self._entries.values()
+            for token in normalize_text(entry.name).split()
+        )
+        self._birth_dates = sorted((e.birth_date, e.id) for e in self._entries.values() if e.birth_date)
+        self._sorted_dirty = False
+
+    @staticmethod
+    def _prefix_matches(sorted_keys: List[tuple], prefix: str) -> List[str]:
+        """
+        Returns the ids whose key starts with prefix, from a sorted (key, patient id) list.
+        """
+        matches = []
+        for key, patient_id in sorted_keys[bisect_left(sorted_keys, (prefix,)):]:
+            if not key.startswith(prefix):
+                break
+            matches.append(patient_id)
+        return matches
+
+    def search(self, query: str, limit: int = 50) -> List[PatientEntry]:
+        """
+        Returns up to limit records matching the query, best matches first:
+        - exact FHIR id, or birth date prefix (YYYY, YYYY-MM, YYYY-MM-DD)
+        - names: prefix of a name token for queries shorter than 3 characters,
+          trigram similarity (typo tolerant) otherwise.
+        An empty query returns the most recently updated patients.
+        """
+        text = normalize_text(query)
+        with self._lock:
+            if not text:
+                return heapq.nlargest(limit, self._entries.values(), key=lambda e: e.last_updated or '')
+            if query.strip() in self._entries:
+                return [self._entries[query.strip()]]
+
+            self._ensure_sorted()
+            if text[:4].isdigit():
+                ids = self._prefix_matches(self._birth_dates, text)
+            elif len(text) < 3:
+                ids = self._prefix_matches(self._tokens, text)
+            else:
+                query_trigrams = _trigrams(text)
+                scores: Dict[str, int] = {}
+                for trigram in query_trigrams:
+                    for patient_id in self._trigram_index.get(trigram, ()):
+                        scores[patient_id] = scores.get(patient_id, 0) + 1
+                threshold = MIN_TRIGRAM_SIMILARITY * len(query_trigrams)
+                best = heapq.nsmallest(
+                    limit, (patient_id for patient_id, score in scores.items() if score >= threshold),
+                    key=lambda patient_id: (-scores[patient_id], self._entries[patient_id].name)
+                )
+                return [self._entries[patient_id] for patient_id in best]
+
+            entries = (self._entries[patient_id] for patient_id in dict.fromkeys(ids))
+            return sorted(entries, key=lambda e: e.name)[:limit]
+
+_default_directory = None
+_default_directory_lock = threading.Lock()
+
+def get_patient_directory() -> PatientDirectory:
+    """
+    Returns the process-wide patient directory (empty until the first refresh).
+    """
+    global _default_directory
+    with _default_directory_lock:
+        if _default_directory is None:
+            _default_directory = PatientDirectory()
+    return _default_directory
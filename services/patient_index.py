@@ -0,0 +1,104 @@
+'''
+Script: patient_index.py
+Digital Health Systems and Applications - Project work 2025-2026
+Description:
+Server-side search of the patient population for the patient picker. A free-text
+query is turned into a FHIR Patient search (birth date, FHIR id or name:contains)
+and results are read one page (_count) at a time, following the Bundle links, so
+every patient on the server can be reached without downloading them all.
+Dropdown labels are cached per patient version, so a rerun does not parse
+(validate) the same patients again.
+
+Group: Carmine Vardaro, Marco Savastano, Francesco Ferrara.
+'''
+
+import re
+import threading
+from collections import OrderedDict
+from typing import Callable, List, Optional, Tuple
+
+from fhirpy.base.utils import parse_pagination_url
+
+from services.fhir_transport import get_next_link
+
+# Patients per result page of the picker
+PATIENT_PAGE_SIZE = 50
+
+# Maximum number of labels kept in memory (least recently used are dropped)
+MAX_CACHED_LABELS = 5000
+
+_DATE_QUERY = re.compile(r'^\d{4}(-\d{2}(-\d{2})?)?$')
+
+def build_patient_search_params(query: str) -> dict:
+    """
+    Translates the text typed in the picker into Patient search parameters:
+    - empty: the most recently updated patients
+    - YYYY, YYYY-MM or YYYY-MM-DD: birth date
+    - a single token with digits (e.g. a FHIR id): _id
+    - anything else: name:contains
+    """
+    params = {'_count': PATIENT_PAGE_SIZE, '_sort': '-_lastUpdated'}
+    query = (query or '').strip()
+    if not query:
+        return params
+    if _DATE_QUERY.match(query):
+        params['birthdate'] = query
+    elif ' ' not in query and any(ch.isdigit() for ch in query):
+        params['_id'] = query
+    else:
+        params['name:contains'] = query
+    return params
+
+def fetch_patient_page(client, query: str, page_url: Optional[str] = None) -> Tuple[List[dict], Optional[str]]:
+    """
+    Returns one page of patients matching the query (raw JSON) and the link
+    to the next page (None on the last page).
+    Args:
+        page_url: The link returned for the previous page (None for the first page).
+    """
+    if page_url:
+        path, params = parse_pagination_url(page_url)
+        bundle = client.execute(path, method='get', params=params)
+    else:
+        bundle = client.execute('Patient', method='get', params=build_patient_search_params(query))
+
+    patients = [
+        entry['resource'] for entry in bundle.get('entry', None) or []
+        if entry.get('resource') and entry['resource'].get('resourceType') == 'Patient'
+    ]
+    return patients, get_next_link(bundle)
+
+class PatientLabelCache:
+    def __init__(self, max_labels: int = MAX_CACHED_LABELS):
+        self.max_labels = max_labels
+        self._lock = threading.Lock()
+        self._labels: "OrderedDict[Tuple[str, Optional[str]], str]" = OrderedDict()
+
+    def get_label(self, raw_patient: dict, format_label: Callable[[dict], str]) -> str:
+        """
+        Returns the dropdown label of a raw Patient, calling format_label only
+        the first time a given version (meta.versionId / lastUpdated) is seen.
+        Raises if format_label does.
+        """
+        meta = raw_patient.get('meta', None) or {}
+        key = (raw_patient.get('id'), meta.get('versionId', None) or meta.get('lastUpdated', None))
+        with self._lock:
+            label = self._labels.get(key)
+            if label is not None:
+                self._labels.move_to_end(key)
+                return label
+
+        label = format_label(raw_patient)
+        with self._lock:
+            self._labels[key] = label
+            while len(self._labels) > self.max_labels:
+                self._labels.popitem(last=False)
+        return label
+
+_default_label_cache = PatientLabelCache()
+
+def get_patient_label_cache() -> PatientLabelCache:
+    """
+    Returns the process-wide patient label cache.
+    """
+    return _default_label_cache
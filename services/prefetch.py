@@ -0,0 +1,149 @@
+'''
+Script: prefetch.py
+Digital Health Systems and Applications - Project work 2025-2026
+Description:
+Background pre-warming of the context cache for the patients a clinician is most
+likely to open next (recently opened first, then the most recently updated ones of
+the dropdown list). A single background thread downloads one patient at a time with
+few concurrent searches, pauses while an interactive request is running and stops
+when its budget (number of patients and of wrapped resources kept in memory on
+speculation) is used up, so it never competes with what the clinician is doing.
+
+Group: Carmine Vardaro, Marco Savastano, Francesco Ferrara.
+'''
+
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from services.clinical_fetch import load_patient_slices
+from services.context_cache import get_context_cache
+
+# Number of patients warmed in advance (0 disables the prefetch)
+PREFETCH_MAX_PATIENTS = int(os.getenv("FHIR_PREFETCH_PATIENTS", "5"))
+
+# Memory budget: wrapped resources kept in memory for patients not opened yet
+PREFETCH_MAX_RESOURCES = int(os.getenv("FHIR_PREFETCH_MAX_RESOURCES", "20000"))
+
+# Concurrent searches used by the prefetch (interactive requests use MAX_FETCH_WORKERS)
+PREFETCH_FETCH_WORKERS = 2
+
+def rank_prefetch_candidates(patients: List[dict], recent_ids: List[str]) -> List[str]:
+    """
+    Orders the patient ids by likelihood of being opened: the recently opened ones
+    (in the given order), then the others by meta.lastUpdated (newest first),
+    keeping the list order for ties.
+    """
+    listed_ids = [p['id'] for p in patients if p.get('id')]
+    ranked = [pid for pid in recent_ids if pid in listed_ids]
+    others = [p for p in patients if p.get('id') and p['id'] not in ranked]
+    others.sort(key=lambda p: (p.get('meta', None) or {}).get('lastUpdated', None) or '', reverse=True)
+    ranked.extend(p['id'] for p in others)
+    return list(OrderedDict.fromkeys(ranked))
+
+class PrefetchScheduler:
+    def __init__(self, client, max_patients: int = PREFETCH_MAX_PATIENTS,
+                 max_resources: int = PREFETCH_MAX_RESOURCES, fetch_workers: int = PREFETCH_FETCH_WORKERS):
+        self.client = client
+        self.max_patients = max_patients
+        self.max_resources = max_resources
+        self.fetch_workers = fetch_workers
+        self._cond = threading.Condition()
+        self._pending: "OrderedDict[str, None]" = OrderedDict()
+        self._warmed: Dict[str, int] = {}  # patient id -> wrapped resources held
+        self._running: Optional[str] = None
+        self._interactive = 0
+        self._thread = None
+
+    def schedule(self, patient_ids: List[str]):
+        """
+        Replaces the queue with the given patients (most likely first).
+        Patients already warmed or cached are skipped.
+        """
+        if self.max_patients <= 0:
+            return
+        cache = get_context_cache()
+        with self._cond:
+            self._pending = OrderedDict(
+                (pid, None) for pid in patient_ids[:self.max_patients]
+                if pid not in self._warmed and pid != self._running and not cache.contains(pid)
+            )
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="fhir-prefetch", daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+
+    @contextmanager
+    def interactive(self, patient_id: str):
+        """
+        Wraps an interactive request for a patient: the prefetch pauses until it
+        ends, and if the same patient is being prefetched right now the request
+        waits for it instead of downloading the patient a second time.
+        """
+        with self._cond:
+            self._interactive += 1
+            self._pending.pop(patient_id, None)
+            # An opened patient is no longer speculative
+            self._warmed.pop(patient_id, None)
+            while self._running == patient_id:
+                self._cond.wait()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._interactive -= 1
+                self._cond.notify_all()
+
+    def wait_idle(self, timeout: Optional[float] = None) -> bool:
+        """
+        Waits until no prefetch is running and none can start (empty queue, paused
+        by an interactive request or budget used up). Returns False on timeout.
+        """
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: self._running is None and (not self._pending or self._interactive or not self._has_budget()),
+                timeout)
+
+    def _has_budget(self) -> bool:
+        cache = get_context_cache()
+        # Patients evicted from the context cache no longer use memory
+        self._warmed = {pid: n for pid, n in self._warmed.items() if cache.contains(pid)}
+        return (len(self._warmed) < self.max_patients
+                and sum(self._warmed.values()) < self.max_resources
+                and cache.patient_count() < cache.max_patients)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending or self._interactive or not self._has_budget():
+                    self._cond.wait()
+                patient_id, _ = self._pending.popitem(last=False)
+                self._running = patient_id
+
+            held = 0
+            try:
+                slices, _ = load_patient_slices(self.client, patient_id, max_workers=self.fetch_workers)
+                held = sum(len(value[1]) for key, value in slices.items() if key != 'Medication')
+            except Exception as e:
+                print(f"[WARNING] Prefetch of patient {patient_id} failed: {e}")
+            finally:
+                with self._cond:
+                    self._running = None
+                    if held:
+                        self._warmed[patient_id] = held
+                    self._cond.notify_all()
+
+_default_scheduler = None
+_default_scheduler_lock = threading.Lock()
+
+def get_prefetch_scheduler(client) -> PrefetchScheduler:
+    """
+    Returns the process-wide prefetch scheduler (created with the first client given).
+    """
+    global _default_scheduler
+    with _default_scheduler_lock:
+        if _default_scheduler is None:
+            _default_scheduler = PrefetchScheduler(client)
+    return _default_scheduler
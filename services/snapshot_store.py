@@ -0,0 +1,314 @@
+'''
+Script: snapshot_store.py
+Digital Health Systems and Applications - Project work 2025-2026
+Description:
+Persistent on-disk snapshot of the raw FHIR resources downloaded for each patient.
+Resources are kept in a local SQLite database (zlib-compressed JSON), grouped by
+patient and resource type, together with the newest meta.lastUpdated seen for each
+group. This watermark lets the fetch layer download only the changes
+(_lastUpdated=gt...) when a patient is opened again, even after a restart.
+Deletions on the server (and resources moved to another patient) are not visible
+through _lastUpdated searches: each group also records its last full download, and
+after SNAPSHOT_MAX_AGE_HOURS it is downloaded in full again, dropping the stored
+resources the server did not return.
+The snapshots of patients not opened for SNAPSHOT_EVICT_AFTER_HOURS are evicted
+(checked at most once per hour), so the database does not grow with every patient
+ever opened.
+
+Group: Carmine Vardaro, Marco Savastano, Francesco Ferrara.
+'''
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Iterator, List, Optional, Set
+
+# Location of the snapshot database (empty string disables the snapshot cache)
+SNAPSHOT_DB_PATH = os.getenv("SNAPSHOT_DB_PATH", "patient_snapshots.db")
+
+# Hours after which a stored resource type is downloaded in full again (0: never)
+SNAPSHOT_MAX_AGE_HOURS = float(os.getenv("SNAPSHOT_MAX_AGE_HOURS", "24"))
+
+# Hours without opening a patient after which its snapshot is evicted (0: never).
+# By default the full re-sync age: an older snapshot would be downloaded in full anyway.
+SNAPSHOT_EVICT_AFTER_HOURS = float(os.getenv("SNAPSHOT_EVICT_AFTER_HOURS", str(SNAPSHOT_MAX_AGE_HOURS)))
+
+# Minimum seconds between two eviction sweeps of the store
+_EVICTION_INTERVAL_SECONDS = 3600
+
+def get_last_updated(raw_resource: dict) -> Optional[str]:
+    """
+    Returns the meta.lastUpdated instant of a raw FHIR resource (or None).
+    """
+    meta = raw_resource.get('meta', None) or {}
+    return meta.get('lastUpdated', None)
+
+class PatientSnapshotStore:
+    def __init__(self, db_path: str = SNAPSHOT_DB_PATH):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._checked_projections: Dict[str, Optional[str]] = {}
+        self._evicted_at: Optional[float] = None
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS resources (
+                    patient_id TEXT NOT NULL,
+                    resource_type TEXT NOT NULL,
+                    resource_id TEXT NOT NULL,
+                    last_updated TEXT,
+                    body BLOB NOT NULL,
+                    PRIMARY KEY (patient_id, resource_type, resource_id)
+                )""")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS projections (
+                    resource_type TEXT PRIMARY KEY,
+                    elements TEXT
+                )""")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS sync_state (
+                    patient_id TEXT NOT NULL,
+                    resource_type TEXT NOT NULL,
+                    last_updated TEXT,
+                    synced_at TEXT NOT NULL,
+                    full_synced_at TEXT,
+                    PRIMARY KEY (patient_id, resource_type)
+                )""")
+            columns = [row[1] for row in self._conn.execute("PRAGMA table_info(sync_state)")]
+            if 'full_synced_at' not in columns:
+                # Snapshots written before the column existed are downloaded in full once
+                self._conn.execute("ALTER TABLE sync_state ADD COLUMN full_synced_at TEXT")
+
+    def ensure_projection(self, resource_type: str, elements: Optional[List[str]]):
+        """
+        Records how the stored resources of a type were downloaded (the _elements
+        projection, plus any server-side reduction such as $lastn). If it changed
+        (e.g. a wrapper now reads a new element), every stored resource of that
+        type is dropped so that it gets downloaded again in full.
+        """
+        signature = ",".join(elements) if elements else None
+        if self._checked_projections.get(resource_type, "") == signature:
+            return
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT elements FROM projections WHERE resource_type = ?", (resource_type,)
+            ).fetchone()
+            if row is None or row[0] != signature:
+                self._conn.execute("DELETE FROM resources WHERE resource_type = ?", (resource_type,))
+                self._conn.execute("DELETE FROM sync_state WHERE resource_type = ?", (resource_type,))
+                self._conn.execute("INSERT OR REPLACE INTO projections VALUES (?, ?)", (resource_type, signature))
+        self._checked_projections[resource_type] = signature
+
+    def get_watermarks(self, patient_id: str) -> Dict[str, Optional[str]]:
+        """
+        Returns {resource type -> newest meta.lastUpdated stored} for every
+        resource type already synchronized for the patient.
+        A type synchronized without any resource has a None watermark.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT resource_type, last_updated FROM sync_state WHERE patient_id = ?",
+                (patient_id,)
+            ).fetchall()
+        return {resource_type: last_updated for resource_type, last_updated in rows}
+
+    def get_expired_types(self, patient_id: str, max_age_hours: Optional[float] = None) -> Set[str]:
+        """
+        Returns the resource types synchronized for the patient whose last full
+        download is older than max_age_hours (default SNAPSHOT_MAX_AGE_HOURS, 0: never).
+        """
+        if max_age_hours is None:
+            max_age_hours = SNAPSHOT_MAX_AGE_HOURS
+        if max_age_hours <= 0:
+            return set()
+        oldest = (datetime.now() - timedelta(hours=max_age_hours)).isoformat()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT resource_type FROM sync_state "
+                "WHERE patient_id = ? AND (full_synced_at IS NULL OR full_synced_at < ?)",
+                (patient_id, oldest)
+            ).fetchall()
+        return {resource_type for (resource_type,) in rows}
+
+    def save_resources(self, patient_id: str, resource_type: str, raw_resources: List[dict]):
+        """
+        Inserts or replaces the given resources and moves the watermark of
+        (patient, resource type) forward to the newest meta.lastUpdated seen.
+        """
+        newest = self.put_resources(patient_id, resource_type, raw_resources)
+        self.advance_watermark(patient_id, resource_type, newest)
+
+    def put_resources(self, patient_id: str, resource_type: str, raw_resources: List[dict]) -> Optional[str]:
+        """
+        Inserts or replaces the given resources without touching the watermark
+        (used while a download is still in progress, one page at a time).
+        Returns the newest meta.lastUpdated among them (or None).
+        """
+        rows = []
+        newest = None
+        for raw in raw_resources:
+            if not raw.get('id'):
+                continue
+            last_updated = get_last_updated(raw)
+            if last_updated and (newest is None or last_updated > newest):
+                newest = last_updated
+            body = zlib.compress(json.dumps(raw, separators=(',', ':')).encode('utf-8'))
+            rows.append((patient_id, resource_type, raw['id'], last_updated, body))
+
+        if rows:
+            with self._lock, self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO resources VALUES (?, ?, ?, ?, ?)", rows
+                )
+        return newest
+
+    def advance_watermark(self, patient_id: str, resource_type: str, newest: Optional[str], full: bool = False):
+        """
+        Marks (patient, resource type) as synchronized, moving its watermark
+        forward to newest (it never moves backwards).
+        Args:
+            full: The resources were downloaded in full (see get_expired_types).
+        """
+        now = datetime.now().isoformat()
+        with self._lock, self._conn:
+            previous = self._conn.execute(
+                "SELECT last_updated, full_synced_at FROM sync_state WHERE patient_id = ? AND resource_type = ?",
+                (patient_id, resource_type)
+            ).fetchone()
+            if previous and previous[0] and (newest is None or previous[0] > newest):
+                newest = previous[0]
+            full_synced_at = now if full else (previous[1] if previous else None)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sync_state (patient_id, resource_type, last_updated, synced_at, full_synced_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (patient_id, resource_type, newest, now, full_synced_at)
+            )
+
+    def prune_resources(self, patient_id: str, resource_type: str, kept_ids: Iterable[str]) -> int:
+        """
+        Removes the stored resources of (patient, resource type) whose id is not in
+        kept_ids (the ids returned by a full download). Returns the number removed.
+        """
+        kept_ids = set(kept_ids)
+        with self._lock, self._conn:
+            stored = self._conn.execute(
+                "SELECT resource_id FROM resources WHERE patient_id = ? AND resource_type = ?",
+                (patient_id, resource_type)
+            ).fetchall()
+            removed = [(patient_id, resource_type, resource_id) for (resource_id,) in stored if resource_id not in kept_ids]
+            self._conn.executemany(
+                "DELETE FROM resources WHERE patient_id = ? AND resource_type = ? AND resource_id = ?", removed
+            )
+        return len(removed)
+
+    def load_resources(self, patient_id: str, resource_type: str) -> List[dict]:
+        """
+        Returns every stored resource of the given type for the patient,
+        most recently updated first.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT body FROM resources WHERE patient_id = ? AND resource_type = ? "
+                "ORDER BY last_updated DESC",
+                (patient_id, resource_type)
+            ).fetchall()
+        return [json.loads(zlib.decompress(body)) for (body,) in rows]
+
+    def iter_resources(self, patient_id: str, resource_type: str, page_size: int) -> Iterator[List[dict]]:
+        """
+        Same as load_resources, but yields the resources page by page
+        so that the whole snapshot is never decompressed at once.
+        """
+        offset = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT body FROM resources WHERE patient_id = ? AND resource_type = ? "
+                    "ORDER BY last_updated DESC, resource_id LIMIT ? OFFSET ?",
+                    (patient_id, resource_type, page_size, offset)
+                ).fetchall()
+            if not rows:
+                return
+            yield [json.loads(zlib.decompress(body)) for (body,) in rows]
+            offset += len(rows)
+
+    def touch_patient(self, patient_id: str):
+        """
+        Marks the snapshot of the patient as used now, so that it is not evicted
+        while it is being synchronized (see evict_stale).
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE sync_state SET synced_at = ? WHERE patient_id = ?", (datetime.now().isoformat(), patient_id)
+            )
+
+    def evict_stale(self, max_age_hours: Optional[float] = None) -> int:
+        """
+        Removes the snapshots of the patients not synchronized or touched for
+        max_age_hours (default SNAPSHOT_EVICT_AFTER_HOURS, 0: never); they are
+        downloaded in full when opened again. Returns the number of patients evicted.
+        """
+        if max_age_hours is None:
+            max_age_hours = SNAPSHOT_EVICT_AFTER_HOURS
+        if max_age_hours <= 0:
+            return 0
+        oldest = (datetime.now() - timedelta(hours=max_age_hours)).isoformat()
+        with self._lock, self._conn:
+            stale = self._conn.execute(
+                "SELECT patient_id FROM sync_state GROUP BY patient_id HAVING MAX(synced_at) < ?", (oldest,)
+            ).fetchall()
+            self._conn.executemany("DELETE FROM resources WHERE patient_id = ?", stale)
+            self._conn.executemany("DELETE FROM sync_state WHERE patient_id = ?", stale)
+        return len(stale)
+
+    def evict_if_due(self) -> int:
+        """
+        Runs evict_stale if the last sweep is older than _EVICTION_INTERVAL_SECONDS.
+        Returns the number of patients evicted.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self._evicted_at is not None and now - self._evicted_at < _EVICTION_INTERVAL_SECONDS:
+                return 0
+            self._evicted_at = now
+        evicted = self.evict_stale()
+        if evicted:
+            print(f"[INFO] Evicted the snapshots of {evicted} patient(s) not opened in the last {SNAPSHOT_EVICT_AFTER_HOURS:g} hours.")
+        return evicted
+
+    def delete_patient(self, patient_id: str, resource_types: Optional[List[str]] = None):
+        """
+        Removes the snapshot of a patient (or only of the given resource types),
+        forcing a full download on the next open.
+        """
+        with self._lock, self._conn:
+            if resource_types is None:
+                self._conn.execute("DELETE FROM resources WHERE patient_id = ?", (patient_id,))
+                self._conn.execute("DELETE FROM sync_state WHERE patient_id = ?", (patient_id,))
+                return
+            for resource_type in resource_types:
+                params = (patient_id, resource_type)
+                self._conn.execute("DELETE FROM resources WHERE patient_id = ? AND resource_type = ?", params)
+                self._conn.execute("DELETE FROM sync_state WHERE patient_id = ? AND resource_type = ?", params)
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+def get_snapshot_store() -> Optional[PatientSnapshotStore]:
+    """
+    Returns the process-wide snapshot store, or None if disabled (SNAPSHOT_DB_PATH="").
+    Stale patient snapshots are evicted when due (see PatientSnapshotStore.evict_if_due).
+    """
+    global _default_store
+    if not SNAPSHOT_DB_PATH:
+        return None
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = PatientSnapshotStore(SNAPSHOT_DB_PATH)
+        store = _default_store
+    store.evict_if_due()
+    return store
@@ -0,0 +1,69 @@
+'''
+Script: conftest.py
+Digital Health Systems and Applications - Project work 2025-2026
+Description:
+Shared fixtures of the regression tests: an in-process stand-in FHIR server
+(utilities/fhir_stub_server.py) and a helper that builds the clinical context of a
+patient with given fetch settings, starting from empty in-memory caches.
+
+Group: Carmine Vardaro, Marco Savastano, Francesco Ferrara.
+'''
+
+import pytest
+
+import services.clinical_fetch as clinical_fetch
+import services.context_cache as context_cache
+import services.snapshot_store as snapshot_store
+from services.fhir_transport import create_fhir_client
+from utilities.fhir_stub_server import FhirStubStore, start_stub_server
+
+@pytest.fixture(autouse=True)
+def isolated_caches(monkeypatch):
+    """
+    Every test starts with an empty context cache and without the on-disk snapshots.
+    """
+    monkeypatch.setattr(context_cache, '_default_cache', context_cache.PatientContextCache())
+    monkeypatch.setattr(snapshot_store, 'SNAPSHOT_DB_PATH', '')
+    monkeypatch.setattr(snapshot_store, '_default_store', None)
+
+@pytest.fixture
+def fhir_store():
+    return FhirStubStore()
+
+@pytest.fixture
+def fhir_server(fhir_store):
+    """
+    The stand-in server (without simulated latency) and its base URL.
+    """
+    server, url = start_stub_server(fhir_store, latency_ms=0, jitter_ms=0)
+    yield server, url
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def fhir_client(fhir_server):
+    return create_fhir_client(fhir_server[1])
+
+@pytest.fixture
+def build_context(monkeypatch, fhir_client):
+    """
+    Returns build(patient_json, client=None, **settings) -> (context, counts, age), where
+    settings are clinical_fetch module settings (e.g. RETRIEVAL_MODE='batch').
+    Each call starts from an empty context cache.
+    """
+    def build(patient_json: dict, client=None, **settings):
+        with monkeypatch.context() as patch:
+            for name, value in settings.items():
+                patch.setattr(clinical_fetch, name, value)
+            patch.setattr(context_cache, '_default_cache', context_cache.PatientContextCache())
+            return clinical_fetch.build_clinical_context(patient_json, client or fhir_client)
+    return build
+
+@pytest.fixture
+def render_context(build_context):
+    """
+    Same as build_context, returning only the clinical context string.
+    """
+    def render(patient_json: dict, **settings) -> str:
+        return build_context(patient_json, **settings)[0]
+    return render
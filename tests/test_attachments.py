@@ -0,0 +1,87 @@
+'''
+Script: test_attachments.py
+Digital Health Systems and Applications - Project work 2025-2026
+Description:
+Tests of the chunked decoding of base64 text attachments: byte cap and truncation
+marker, inputs spanning several chunks, whitespace anywhere in the payload and
+invalid data.
+
+Group: Carmine Vardaro, Marco Savastano, Francesco Ferrara.
+'''
+
+import base64
+
+import pytest
+
+import resources.core.attachments as attachments
+from resources.core.attachments import TRUNCATION_MARKER, decode_text_attachment
+
+NOTE = "".join(f"Line {i}: esame obiettivo nella norma, però da ricontrollare\n" for i in range(200))
+
+def _encode(text: str) -> bytes:
+    return base64.b64encode(text.encode('utf-8'))
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    """
+    Decodes in chunks of 16 base64 characters, so short notes span many chunks.
+    """
+    monkeypatch.setattr(attachments, '_DECODE_CHUNK_CHARS', 16)
+
+def _lines(text: str) -> str:
+    return "\n".join(line.strip() for line in text.splitlines() if line.strip())
+
+def test_decode_cleans_lines():
+    assert decode_text_attachment(_encode("  first \n\n\r\nsecond\n")) == "first\nsecond"
+    assert decode_text_attachment(_encode("uno").decode('ascii')) == "uno"
+    assert decode_text_attachment(b"") == ""
+
+def test_multi_chunk_input(small_chunks):
+    assert decode_text_attachment(_encode(NOTE), max_bytes=0) == _lines(NOTE)
+
+def test_multi_chunk_input_default_chunks():
+    note = NOTE * 20   # several 64 KiB chunks
+    assert len(_encode(note)) > 3 * 64 * 1024
+    assert decode_text_attachment(_encode(note), max_bytes=0) == _lines(note)
+
+@pytest.mark.parametrize('wrap', [76, 64 * 1024 + 4])
+def test_whitespace_anywhere(wrap):
+    encoded = _encode(NOTE * 20)
+    wrapped = b"\r\n".join(encoded[i:i + wrap] for i in range(0, len(encoded), wrap))
+    assert decode_text_attachment(wrapped, max_bytes=0) == _lines(NOTE * 20)
+
+def test_whitespace_after_first_chunk(small_chunks):
+    encoded = _encode(NOTE)
+    wrapped = encoded[:40] + b"\n " + encoded[40:]
+    assert decode_text_attachment(wrapped, max_bytes=0) == _lines(NOTE)
+
+@pytest.mark.parametrize('chunked', [False, True])
+def test_cap_truncates_at_line(chunked, monkeypatch):
+    if chunked:
+        monkeypatch.setattr(attachments, '_DECODE_CHUNK_CHARS', 16)
+    line_size = len(NOTE.splitlines(keepends=True)[0].encode('utf-8'))
+    text = decode_text_attachment(_encode(NOTE), max_bytes=3 * line_size + 10)
+    lines = text.splitlines()
+    # The line cut at the cap is dropped and replaced by the marker
+    assert lines == _lines(NOTE).splitlines()[:3] + [TRUNCATION_MARKER]
+
+def test_cap_not_reached():
+    size = len(NOTE.encode('utf-8'))
+    assert decode_text_attachment(_encode(NOTE), max_bytes=size) == _lines(NOTE)
+    assert decode_text_attachment(_encode(NOTE), max_bytes=size - 1).endswith(TRUNCATION_MARKER)
+
+def test_default_cap(monkeypatch):
+    monkeypatch.setattr(attachments, 'NOTE_MAX_BYTES', 100)
+    assert decode_text_attachment(_encode(NOTE)).endswith(TRUNCATION_MARKER)
+    assert decode_text_attachment(_encode(NOTE), max_bytes=0) == _lines(NOTE)
+
+def test_cap_inside_multibyte_character(small_chunks):
+    # 'è' is 2 bytes in UTF-8: a cap falling in the middle drops the whole character
+    text = decode_text_attachment(_encode("caffè\n" * 10), max_bytes=12)
+    assert text.splitlines() == ["caffè", TRUNCATION_MARKER]
+    assert decode_text_attachment(_encode("caffè"), max_bytes=5) == "caff\n" + TRUNCATION_MARKER
+
+@pytest.mark.parametrize('data', [b"not base64!", b"QUJD\nRA", base64.b64encode(b"\xff\xfe invalid utf-8")])
+def test_invalid_data(data):
+    with pytest.raises(ValueError):
+        decode_text_attachment(data, max_bytes=0)
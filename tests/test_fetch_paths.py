@@ -0,0 +1,124 @@
+'''
+Script: test_fetch_paths.py
+Digital Health Systems and Applications - Project work 2025-2026
+Description:
+Regression tests of the fetch paths against the stand-in FHIR server: every
+retrieval mode, Observation mode, projection, parsing and transport option, and the
+snapshot store (cold and warm), must render the same clinical context and the same
+resource counts as the plain baseline (per-type searches of the whole history).
+
+Group: Carmine Vardaro, Marco Savastano, Francesco Ferrara.
+'''
+
+import random
+
+import pytest
+
+import resources.core.model_view as model_view
+import services.fhir_transport as fhir_transport
+import services.snapshot_store as snapshot_store
+from services.fhir_transport import create_fhir_client
+from utilities.fhir_stub_server import generate_synthetic_population
+
+# Whole history, one search per type, full resources, everything downloaded
+BASELINE = {'RETRIEVAL_MODE': 'per-type', 'OBSERVATION_MODE': 'all', 'USE_ELEMENTS_PROJECTION': False,
+            'SKIP_UNRENDERED_TYPES': False, 'USE_COMPACT_RECORDS': False}
+
+FETCH_SETTINGS = {
+    'default': {},
+    'per-type-all': {'OBSERVATION_MODE': 'all'},
+    'everything-lastn': {'RETRIEVAL_MODE': 'everything'},
+    'everything-all': {'RETRIEVAL_MODE': 'everything', 'OBSERVATION_MODE': 'all'},
+    'batch-lastn': {'RETRIEVAL_MODE': 'batch'},
+    'batch-all': {'RETRIEVAL_MODE': 'batch', 'OBSERVATION_MODE': 'all'},
+    'lastn-max-3': {'OBSERVATION_LASTN_MAX': 3},
+    'no-elements': {'USE_ELEMENTS_PROJECTION': False},
+    'download-unrendered': {'SKIP_UNRENDERED_TYPES': False},
+    'wrappers': {'USE_COMPACT_RECORDS': False},
+    'small-pages': {'BUNDLE_PAGE_SIZE': 7},
+    'process-pool': {'PARSE_PROCESSES': 2, 'PARSE_POOL_MIN_RESOURCES': 1},
+}
+
+@pytest.fixture
+def patients(fhir_store):
+    generate_synthetic_population(fhir_store, patients=3, seed=7, observations_per_patient=80)
+    # A newer preliminary result and an undated one must not change the rendered Observations
+    subject = {'reference': 'Patient/pat-00000'}
+    fhir_store.put({'resourceType': 'Observation', 'status': 'preliminary', 'subject': subject,
+                    'effectiveDateTime': '2024-05-01T10:00:00+02:00',
+                    'code': {'coding': [{'system': 'http://loinc.org', 'code': '2339-0', 'display': 'Glucose'}], 'text': 'Glucose'},
+                    'valueQuantity': {'value': 300, 'unit': 'mg/dL'}})
+    fhir_store.put({'resourceType': 'Observation', 'status': 'final', 'subject': subject,
+                    'code': {'coding': [{'system': 'http://loinc.org', 'code': '8302-2', 'display': 'Body Height'}], 'text': 'Body Height'},
+                    'valueQuantity': {'value': 170, 'unit': 'cm'}})
+    return fhir_store.find('Patient')
+
+def _build_all(build_context, patients, **settings):
+    return [build_context(p, **settings) for p in patients]
+
+@pytest.mark.parametrize('settings', FETCH_SETTINGS.values(), ids=FETCH_SETTINGS.keys())
+def test_fetch_settings_match_baseline(build_context, patients, settings):
+    assert _build_all(build_context, patients, **settings) == _build_all(build_context, patients, **BASELINE)
+
+def test_strict_validation_matches_baseline(build_context, patients, monkeypatch):
+    baseline = _build_all(build_context, patients, **BASELINE)
+    monkeypatch.setattr(model_view, 'STRICT_VALIDATION', True)
+    assert _build_all(build_context, patients) == baseline
+
+def test_missing_pydantic_internals_fall_back_to_strict_parse(build_context, patients, monkeypatch):
+    baseline = _build_all(build_context, patients, **BASELINE)
+    monkeypatch.setattr(model_view, 'VIEWS_SUPPORTED', False)
+    assert _build_all(build_context, patients) == baseline
+
+def test_counted_types_match_downloaded_counts(build_context, patients):
+    for (_, counted, _), (_, downloaded, _) in zip(_build_all(build_context, patients),
+                                                   _build_all(build_context, patients, **BASELINE)):
+        assert counted == {t: n for t, n in downloaded.items() if t in counted}
+
+def test_snapshot_cold_and_warm(build_context, patients, fhir_store, monkeypatch, tmp_path):
+    baseline = _build_all(build_context, patients, **BASELINE)
+    monkeypatch.setattr(snapshot_store, 'SNAPSHOT_DB_PATH', str(tmp_path / 'snapshots.db'))
+
+    assert _build_all(build_context, patients) == baseline   # cold: full download into the snapshots
+    assert _build_all(build_context, patients) == baseline   # warm: only the changes since the last sync
+
+    # A change on the server reaches the warm snapshot
+    fhir_store.put({'resourceType': 'Condition', 'subject': {'reference': 'Patient/pat-00001'},
+                    'onsetDateTime': '2023-03-01T00:00:00Z',
+                    'clinicalStatus': {'coding': [{'code': 'active'}]},
+                    'code': {'coding': [{'system': 'http://snomed.info/sct', 'code': '195662009', 'display': 'Acute viral pharyngitis'}],
+                             'text': 'Acute viral pharyngitis'}})
+    warm = _build_all(build_context, patients)
+    monkeypatch.setattr(snapshot_store, '_default_store', None)
+    monkeypatch.setattr(snapshot_store, 'SNAPSHOT_DB_PATH', '')
+    assert warm == _build_all(build_context, patients, **BASELINE)
+    assert "Acute viral pharyngitis" in warm[1][0]
+
+def test_retries_and_hedging_match_baseline(build_context, patients, fhir_server, monkeypatch):
+    baseline = _build_all(build_context, patients, **BASELINE)
+    server, url = fhir_server
+    monkeypatch.setattr(fhir_transport, '_backoff_delay', lambda attempt, response: 0.01)
+    random.seed(3)
+    server.latency_ms, server.error_rate = 5, 0.2
+    client = create_fhir_client(url, max_retries=20, hedge_after=0.002)
+
+    assert _build_all(build_context, patients, client=client) == baseline
+
+def test_expired_snapshot_drops_deleted_and_moved_resources(build_context, patients, fhir_store, monkeypatch, tmp_path):
+    monkeypatch.setattr(snapshot_store, 'SNAPSHOT_DB_PATH', str(tmp_path / 'snapshots.db'))
+    deleted, moved = [fhir_store.put({'resourceType': 'Condition', 'subject': {'reference': 'Patient/pat-00000'},
+                                      'onsetDateTime': '2023-03-01T00:00:00Z', 'clinicalStatus': {'coding': [{'code': 'active'}]},
+                                      'code': {'text': text}}) for text in ('Deleted condition', 'Moved condition')]
+    assert "Moved condition" in build_context(patients[0])[0]
+
+    fhir_store.delete('Condition', deleted['id'])
+    fhir_store.put(dict(moved, subject={'reference': 'Patient/pat-00001'}))
+
+    # Within the age limit the warm snapshot still holds the deleted Condition
+    assert "Deleted condition" in build_context(patients[0])[0]
+    monkeypatch.setattr(snapshot_store, 'SNAPSHOT_MAX_AGE_HOURS', 1e-9)
+    expired = build_context(patients[0])
+    monkeypatch.setattr(snapshot_store, '_default_store', None)
+    monkeypatch.setattr(snapshot_store, 'SNAPSHOT_DB_PATH', '')
+    assert expired == build_context(patients[0], **BASELINE)
+    assert "Deleted condition" not in expired[0] and "Moved condition" not in expired[0]
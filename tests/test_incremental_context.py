@@ -0,0 +1,88 @@
+'''
+Script: test_incremental_context.py
+Digital Health Systems and Applications - Project work 2025-2026
+Description:
+Regression tests of the incremental context builds: after an invalidation only the
+replaced slices are added again to the cached patient object, and the context is the
+same as the one built from scratch.
+
+Group: Carmine Vardaro, Marco Savastano, Francesco Ferrara.
+'''
+
+import pytest
+
+import services.clinical_fetch as clinical_fetch
+from resources.administration.patient import AppPatient
+from services.context_cache import get_context_cache
+from utilities.fhir_stub_server import generate_synthetic_population
+
+@pytest.fixture
+def patient(fhir_store):
+    generate_synthetic_population(fhir_store, patients=1, seed=5, observations_per_patient=40)
+    return fhir_store.get('Patient', 'pat-00000')
+
+@pytest.fixture
+def replaced_types(monkeypatch):
+    replaced = []
+    replace_resources = AppPatient.replace_resources
+    def spy(self, resource_type, items, revision=None):
+        replaced.append(resource_type)
+        return replace_resources(self, resource_type, items, revision)
+    monkeypatch.setattr(AppPatient, 'replace_resources', spy)
+    return replaced
+
+@pytest.fixture
+def rendered_sections(monkeypatch):
+    rendered = []
+    for section, renderer_name in AppPatient._SECTION_RENDERERS:
+        def spy(self, unavailable, medication_map, renderer=getattr(AppPatient, renderer_name), section=section):
+            rendered.append(section)
+            return renderer(self, unavailable, medication_map)
+        monkeypatch.setattr(AppPatient, renderer_name, spy)
+    return rendered
+
+def _add_condition(fhir_store, text: str, onset: str):
+    fhir_store.put({'resourceType': 'Condition', 'subject': {'reference': 'Patient/pat-00000'}, 'onsetDateTime': onset,
+                    'clinicalStatus': {'coding': [{'code': 'active'}]},
+                    'code': {'coding': [{'system': 'http://snomed.info/sct', 'code': '1234'}], 'text': text}})
+
+def test_rebuild_adds_only_replaced_slices(fhir_store, fhir_client, render_context, patient, replaced_types):
+    first = clinical_fetch.build_clinical_context(patient, fhir_client)[0]
+    cached_patient = get_context_cache().get_patient('pat-00000', patient)
+    assert cached_patient is not None
+
+    replaced_types.clear()
+    assert clinical_fetch.build_clinical_context(patient, fhir_client)[0] == first
+    assert replaced_types == []
+
+    _add_condition(fhir_store, 'Sprain of ankle', '2031-02-03T00:00:00Z')
+    clinical_fetch.invalidate_patient_resources('pat-00000', ['Condition'])
+    rebuilt = clinical_fetch.build_clinical_context(patient, fhir_client)
+    assert replaced_types == ['Condition']
+    assert get_context_cache().get_patient('pat-00000', patient) is cached_patient
+    assert "Sprain of ankle" in rebuilt[0]
+    assert "(Current Date: 2031-02-03)" in rebuilt[0]
+    assert rebuilt[0] == render_context(patient)
+
+def test_changed_patient_resource_is_parsed_again(fhir_client, patient):
+    clinical_fetch.build_clinical_context(patient, fhir_client)
+    changed = dict(patient, gender='other')
+
+    context = clinical_fetch.build_clinical_context(changed, fhir_client)[0]
+
+    assert "- Demographics: other," in context
+    assert get_context_cache().get_patient('pat-00000', patient) is None
+
+def test_only_sections_of_replaced_slices_are_rendered(fhir_store, fhir_client, render_context, patient, rendered_sections):
+    clinical_fetch.build_clinical_context(patient, fhir_client)
+    assert len(rendered_sections) == len(AppPatient._SECTION_RENDERERS)
+
+    rendered_sections.clear()
+    clinical_fetch.build_clinical_context(patient, fhir_client)
+    assert rendered_sections == []
+
+    _add_condition(fhir_store, 'Sprain of ankle', '2021-02-03T00:00:00Z')
+    clinical_fetch.invalidate_patient_resources('pat-00000', ['Condition', 'DocumentReference'])
+    context = clinical_fetch.build_clinical_context(patient, fhir_client)[0]
+    assert rendered_sections == ['ACTIVE CONDITIONS (PROBLEM LIST)']
+    assert context == render_context(patient)
@@ -0,0 +1,83 @@
+'''
+Script: test_observation_retrieval.py
+Digital Health Systems and Applications - Project work 2025-2026
+Description:
+Regression tests of the "lastn" Observation retrieval: whatever the retrieval path,
+the clinical context must match the one built from the whole Observation history.
+
+Group: Carmine Vardaro, Marco Savastano, Francesco Ferrara.
+'''
+
+import pytest
+
+from utilities.fhir_stub_server import FhirStubHandler
+
+LOINC = 'http://loinc.org'
+
+def _observation(subject: dict, status: str, code: str, value: float, when: str, text: str = 'Glucose') -> dict:
+    return {'resourceType': 'Observation', 'status': status, 'subject': subject, 'effectiveDateTime': when,
+            'category': [{'coding': [{'system': 'http://terminology.hl7.org/CodeSystem/observation-category', 'code': 'laboratory'}]}],
+            'code': {'coding': [{'system': LOINC, 'code': code, 'display': text}], 'text': text},
+            'valueQuantity': {'value': value, 'unit': 'mg/dL'}}
+
+@pytest.fixture
+def patient(fhir_store):
+    """
+    A patient whose newest Glucose is preliminary, with an older Glucose under another code.
+    """
+    patient = fhir_store.put({'resourceType': 'Patient', 'id': 'pat-glucose', 'gender': 'female', 'birthDate': '1967-06-01'})
+    subject = {'reference': 'Patient/pat-glucose'}
+    fhir_store.put(_observation(subject, 'final', '2339-0', 117.9, '2022-12-07T08:30:00+01:00'))
+    fhir_store.put(_observation(subject, 'final', '15074-8', 5, '2016-01-01T10:00:00Z'))
+    fhir_store.put(_observation(subject, 'preliminary', '2339-0', 250.0, '2030-01-01T09:00:00Z'))
+    # Same instant as the final Glucose above, written with another offset
+    fhir_store.put(_observation(subject, 'final', '8867-4', 72, '2022-12-07T07:30:00Z', text='Heart rate'))
+    fhir_store.put(_observation(subject, 'final', '8867-4', 80, '2022-12-07T08:00:00+02:00', text='Heart rate'))
+    return patient
+
+LASTN_SETTINGS = [
+    {'RETRIEVAL_MODE': 'per-type'},
+    {'RETRIEVAL_MODE': 'batch'},
+    {'RETRIEVAL_MODE': 'everything'},
+    {'RETRIEVAL_MODE': 'per-type', 'OBSERVATION_LASTN_MAX': 2},
+    {'RETRIEVAL_MODE': 'per-type', 'USE_COMPACT_RECORDS': False},
+]
+
+@pytest.mark.parametrize('settings', LASTN_SETTINGS)
+def test_lastn_skips_newer_preliminary_observation(render_context, patient, settings):
+    baseline = render_context(patient, OBSERVATION_MODE='all')
+    assert "Glucose: 117.9 mg/dL (2022-12-07)" in baseline
+    assert "(Current Date: 2030-01-01)" in baseline
+
+    assert render_context(patient, OBSERVATION_MODE='lastn', **settings) == baseline
+
+@pytest.mark.parametrize('retrieval_mode', ['per-type', 'batch'])
+def test_lastn_server_ignoring_status_filter(render_context, patient, monkeypatch, retrieval_mode):
+    baseline = render_context(patient, OBSERVATION_MODE='all')
+    lastn = FhirStubHandler._lastn
+    monkeypatch.setattr(FhirStubHandler, '_lastn',
+                        lambda self, params: lastn(self, {k: v for k, v in params.items() if k != 'status'}))
+
+    assert render_context(patient, OBSERVATION_MODE='lastn', RETRIEVAL_MODE=retrieval_mode) == baseline
+
+def test_client_side_reduction_stops_paging(fhir_store, fhir_client, monkeypatch):
+    import services.clinical_fetch as clinical_fetch
+
+    subject = {'reference': 'Patient/pat-history'}
+    fhir_store.put({'resourceType': 'Patient', 'id': 'pat-history'})
+    for day in range(1, 29):
+        fhir_store.put(_observation(subject, 'final', '2339-0', 100 + day, f'2020-02-{day:02d}'))
+    monkeypatch.setattr(FhirStubHandler, '_lastn', lambda self, params: {'resourceType': 'OperationOutcome'})
+    monkeypatch.setattr(clinical_fetch, 'BUNDLE_PAGE_SIZE', 5)
+    pages = []
+    search_pages = clinical_fetch.iter_search_pages
+    def counted_pages(*args, **kwargs):
+        for page in search_pages(*args, **kwargs):
+            pages.append(page)
+            yield page
+    monkeypatch.setattr(clinical_fetch, 'iter_search_pages', counted_pages)
+
+    latest = clinical_fetch.fetch_latest_observations(fhir_client, 'pat-history')
+
+    assert [raw['valueQuantity']['value'] for raw in latest] == [128]
+    assert len(pages) == 2
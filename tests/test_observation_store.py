@@ -0,0 +1,95 @@
+'''
+Script: test_observation_store.py
+Digital Health Systems and Applications - Project work 2025-2026
+Description:
+Tests of the columnar Observation store: status and time-window selection, latest
+Observation per name (ties and undated values) and bucketing by category, with
+wrappers and compact records.
+
+Group: Carmine Vardaro, Marco Savastano, Francesco Ferrara.
+'''
+
+from datetime import date, datetime, timezone
+
+import pytest
+
+from resources.diagnostics.observation import AppObservation, ObservationCategory, ObservationStatus
+from resources.diagnostics.observation_store import ObservationStore
+
+VALID = (ObservationStatus.FINAL, ObservationStatus.AMENDED, ObservationStatus.CORRECTED)
+
+def _observation(name: str, value: float, when, status: str = 'final', category: str = 'laboratory', compact: bool = False):
+    raw = {'resourceType': 'Observation', 'status': status, 'code': {'text': name},
+           'category': [{'coding': [{'system': 'http://terminology.hl7.org/CodeSystem/observation-category', 'code': category}]}],
+           'valueQuantity': {'value': value, 'unit': 'mg/dL'}}
+    if when is not None:
+        raw['effectiveDateTime'] = when
+    observation = AppObservation(raw)
+    return observation.to_record() if compact else observation
+
+def _values(store: ObservationStore, rows) -> list:
+    return sorted((o.code_text, o.numeric_value) for o in store.observations(rows))
+
+@pytest.fixture(params=[False, True], ids=['wrappers', 'records'])
+def compact(request):
+    return request.param
+
+def test_select_by_status(compact):
+    store = ObservationStore([
+        _observation('Glucose', 100, '2022-01-01T08:00:00Z', compact=compact),
+        _observation('Glucose', 250, '2023-01-01T08:00:00Z', status='preliminary', compact=compact),
+        _observation('Glucose', 110, '2022-06-01T08:00:00Z', status='amended', compact=compact),
+        _observation('Glucose', 999, '2022-07-01T08:00:00Z', status='entered-in-error', compact=compact),
+    ])
+    assert list(store.select(statuses=VALID)) == [0, 2]
+    assert list(store.select(statuses=[ObservationStatus.PRELIMINARY])) == [1]
+    assert list(store.select()) == [0, 1, 2, 3]
+
+def test_select_time_window_and_name(compact):
+    store = ObservationStore([
+        _observation('Glucose', 100, '2022-01-01T08:00:00Z', compact=compact),
+        _observation('Glucose', 110, '2022-06-01T08:00:00+02:00', compact=compact),
+        _observation('Glucose', 120, None, compact=compact),
+        _observation('Heart rate', 70, '2022-06-15', compact=compact),
+    ])
+    start = datetime(2022, 6, 1, 6, tzinfo=timezone.utc)
+    assert list(store.select(start=start)) == [1, 3]
+    # The bounds are inclusive, naive dates are taken as UTC, undated values are excluded
+    assert list(store.select(start=start, end=date(2022, 6, 15))) == [1, 3]
+    assert list(store.select(end=datetime(2022, 6, 1, 5, 59, tzinfo=timezone.utc))) == [0]
+    assert list(store.select(name='Glucose')) == [0, 1, 2]
+    assert list(store.select(name='Unknown test')) == []
+
+def test_latest_per_name(compact):
+    store = ObservationStore([
+        _observation('Glucose', 100, '2022-01-01T08:00:00Z', compact=compact),
+        _observation('Glucose', 117, '2022-12-07T08:30:00+01:00', compact=compact),
+        _observation('Glucose', 90, None, compact=compact),
+        _observation('Heart rate', 72, '2022-12-07T07:30:00Z', compact=compact),
+        # Same instant, another offset: the one added last wins
+        _observation('Heart rate', 80, '2022-12-07T09:30:00+02:00', compact=compact),
+        _observation('Body Height', 170, None, compact=compact),
+        _observation('Glucose', 300, '2030-01-01T08:00:00Z', status='preliminary', compact=compact),
+    ])
+    latest = store.latest_per_name(store.select(statuses=VALID))
+    assert _values(store, latest) == [('Body Height', 170), ('Glucose', 117), ('Heart rate', 80)]
+    assert _values(store, store.latest_per_name(store.select())) == [('Body Height', 170), ('Glucose', 300), ('Heart rate', 80)]
+    assert len(store.latest_per_name(store.select(name='Unknown test'))) == 0
+
+def test_added_later_extends_columns(compact):
+    store = ObservationStore([_observation('Glucose', 100, '2022-01-01T08:00:00Z', compact=compact)])
+    assert _values(store, store.latest_per_name(store.select(statuses=VALID))) == [('Glucose', 100)]
+    store.add([_observation('Glucose', 105, '2022-02-01T08:00:00Z', compact=compact),
+               _observation('Heart rate', 70, '2021-02-01T08:00:00Z', category='vital-signs', compact=compact)])
+    assert _values(store, store.latest_per_name(store.select(statuses=VALID))) == [('Glucose', 105), ('Heart rate', 70)]
+
+def test_split_by_category(compact):
+    store = ObservationStore([
+        _observation('Glucose', 100, '2022-01-01T08:00:00Z', compact=compact),
+        _observation('Heart rate', 70, '2022-01-01T08:00:00Z', category='vital-signs', compact=compact),
+        _observation('PHQ-9', 4, '2022-01-01T08:00:00Z', category='survey', compact=compact),
+    ])
+    buckets = store.split_by_category(store.select(), [ObservationCategory.VITAL_SIGNS, ObservationCategory.LABORATORY])
+    assert list(buckets[ObservationCategory.VITAL_SIGNS]) == [1]
+    assert list(buckets[ObservationCategory.LABORATORY]) == [0]
+    assert list(buckets[None]) == [2]
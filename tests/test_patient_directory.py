@@ -0,0 +1,101 @@
+'''
+Script: test_patient_directory.py
+Digital Health Systems and Applications - Project work 2025-2026
+Description:
+Tests of the local patient directory against the stand-in FHIR server: trigram and
+prefix lookup, incremental refresh, removal of the patients deleted on the server,
+and a failed refresh keeping the last directory.
+
+Group: Carmine Vardaro, Marco Savastano, Francesco Ferrara.
+'''
+
+import pytest
+
+from services.fhir_transport import create_fhir_client
+from services.patient_directory import PatientDirectory
+
+PATIENTS = [
+    ('pat-1', 'Mario', 'Rossi', 'male', '1980-05-01'),
+    ('pat-2', 'Maria', 'Rossini', 'female', '1980-11-23'),
+    ('pat-3', 'Giulia', 'Bianchi', 'female', '1975-02-14'),
+    ('pat-4', 'José', 'Álvarez', 'male', '1990-07-30'),
+    ('pat-5', 'Luca', 'Verdi', 'male', '1980-05-19'),
+]
+
+def _patient(patient_id: str, given: str, family: str, gender: str, birth_date: str) -> dict:
+    return {'resourceType': 'Patient', 'id': patient_id, 'gender': gender, 'birthDate': birth_date,
+            'name': [{'use': 'official', 'given': [given], 'family': family}]}
+
+@pytest.fixture
+def patients(fhir_store):
+    return [fhir_store.put(_patient(*p)) for p in PATIENTS]
+
+@pytest.fixture
+def directory(fhir_client, patients):
+    directory = PatientDirectory(refresh_interval=0)
+    assert directory.refresh(fhir_client) == len(PATIENTS)
+    return directory
+
+def _ids(entries) -> list:
+    return [e.id for e in entries]
+
+def test_directory_lookup(directory):
+    entry = directory.search('pat-4')[0]
+    assert (entry.name, entry.gender, entry.birth_date) == ('José Álvarez', 'male', '1990-07-30')
+    # Trigram similarity: typo and accent tolerant
+    assert _ids(directory.search('rosi')) == ['pat-1']
+    assert _ids(directory.search('rossi')) == ['pat-1', 'pat-2']
+    assert _ids(directory.search('alvarez')) == ['pat-4']
+    # Prefix of a name token for short queries, birth date prefix
+    assert _ids(directory.search('ma')) == ['pat-2', 'pat-1']
+    # Matches by prefix are ordered by name
+    assert _ids(directory.search('1980-05')) == ['pat-5', 'pat-1']
+    assert _ids(directory.search('1980', limit=2)) == ['pat-5', 'pat-2']
+    assert _ids(directory.search('')) == ['pat-5', 'pat-4', 'pat-3', 'pat-2', 'pat-1']
+
+def test_directory_incremental_refresh(fhir_server, fhir_store, fhir_client, directory, patients):
+    server, _ = fhir_server
+    fhir_store.put(dict(patients[2], name=[{'given': ['Giulia'], 'family': 'Neri'}]))
+    fhir_store.put(_patient('pat-6', 'Paolo', 'Gialli', 'male', '2001-01-01'))
+
+    requests_sent = server.request_count
+    assert directory.refresh(fhir_client) == 2
+    # One page of changes and the count of the patients
+    assert server.request_count - requests_sent == 2
+    assert _ids(directory.search('neri')) == ['pat-3']
+    assert directory.search('bianchi') == []
+    assert _ids(directory.search('gialli')) == ['pat-6']
+    assert directory.refresh(fhir_client) == 0
+
+def test_directory_refresh_interval(fhir_client, patients):
+    directory = PatientDirectory(refresh_interval=3600)
+    assert directory.refresh(fhir_client) == len(PATIENTS)
+    assert directory.refresh(fhir_client) == 0
+    assert directory.refresh(fhir_client, force=True) == 0
+
+def test_directory_removes_deleted_patients(fhir_store, fhir_client, directory):
+    fhir_store.delete('Patient', 'pat-1')
+    fhir_store.delete('Patient', 'pat-4')
+    fhir_store.put(_patient('pat-6', 'Paolo', 'Gialli', 'male', '2001-01-01'))
+
+    assert directory.refresh(fhir_client) == 1
+    assert len(directory) == 4
+    assert _ids(directory.search('rossi')) == ['pat-2']
+    assert directory.search('pat-4') == [] and directory.search('alvarez') == []
+    assert _ids(directory.search('1980-05')) == ['pat-5']
+
+def test_directory_keeps_last_index_when_refresh_fails(fhir_server, fhir_store, directory):
+    server, url = fhir_server
+    fhir_store.put(_patient('pat-6', 'Paolo', 'Gialli', 'male', '2001-01-01'))
+    server.error_rate = 1.0
+    client = create_fhir_client(url, max_retries=0)
+
+    assert directory.refresh(client) == 0
+    assert directory.last_error
+    assert len(directory) == len(PATIENTS)
+    assert _ids(directory.search('rossi'))[:1] == ['pat-1']
+
+    server.error_rate = 0
+    assert directory.refresh(client) == 1
+    assert directory.last_error is None
+    assert _ids(directory.search('gialli')) == ['pat-6']
@@ -0,0 +1,85 @@
+'''
+Script: test_patient_index.py
+Digital Health Systems and Applications - Project work 2025-2026
+Description:
+Tests of the server-side patient search of the picker against the stand-in FHIR
+server: choice of the search parameter, paging, and dropdown labels cached per
+patient version.
+
+Group: Carmine Vardaro, Marco Savastano, Francesco Ferrara.
+'''
+
+import pytest
+
+import services.patient_index as patient_index
+from services.patient_index import PatientLabelCache, build_patient_search_params, fetch_patient_page
+
+PATIENTS = [
+    ('pat-1', 'Mario', 'Rossi', 'male', '1980-05-01'),
+    ('pat-2', 'Maria', 'Rossini', 'female', '1980-11-23'),
+    ('pat-3', 'Giulia', 'Bianchi', 'female', '1975-02-14'),
+    ('pat-4', 'José', 'Álvarez', 'male', '1990-07-30'),
+    ('pat-5', 'Luca', 'Verdi', 'male', '1980-05-19'),
+]
+
+def _patient(patient_id: str, given: str, family: str, gender: str, birth_date: str) -> dict:
+    return {'resourceType': 'Patient', 'id': patient_id, 'gender': gender, 'birthDate': birth_date,
+            'name': [{'use': 'official', 'given': [given], 'family': family}]}
+
+@pytest.fixture
+def patients(fhir_store):
+    return [fhir_store.put(_patient(*p)) for p in PATIENTS]
+
+@pytest.mark.parametrize('query, expected', [
+    ('', {}),
+    ('  ', {}),
+    ('1980', {'birthdate': '1980'}),
+    ('1980-05', {'birthdate': '1980-05'}),
+    ('1980-05-01', {'birthdate': '1980-05-01'}),
+    ('pat-1', {'_id': 'pat-1'}),
+    ('Rossi', {'name:contains': 'Rossi'}),
+    ('Mario Rossi', {'name:contains': 'Mario Rossi'}),
+])
+def test_search_parameter_choice(query, expected):
+    params = build_patient_search_params(query)
+    assert params == {'_count': patient_index.PATIENT_PAGE_SIZE, '_sort': '-_lastUpdated', **expected}
+
+def test_search_pages(fhir_client, patients, monkeypatch):
+    monkeypatch.setattr(patient_index, 'PATIENT_PAGE_SIZE', 2)
+    pages, next_url = [], None
+    while True:
+        page, next_url = fetch_patient_page(fhir_client, '', next_url)
+        pages.append([p['id'] for p in page])
+        if not next_url:
+            break
+    # Most recently updated first, every patient reached once
+    assert pages == [['pat-5', 'pat-4'], ['pat-3', 'pat-2'], ['pat-1']]
+
+    assert [p['id'] for p in fetch_patient_page(fhir_client, 'ross')[0]] == ['pat-2', 'pat-1']
+    assert [p['id'] for p in fetch_patient_page(fhir_client, '1980-05')[0]] == ['pat-5', 'pat-1']
+    assert [p['id'] for p in fetch_patient_page(fhir_client, 'pat-3')[0]] == ['pat-3']
+
+def test_labels_cached_per_version(fhir_store, patients):
+    cache = PatientLabelCache()
+    calls = []
+    def format_label(raw):
+        calls.append(raw['id'])
+        return f"{raw['name'][0]['family']} v{raw['meta']['versionId']}"
+
+    assert cache.get_label(patients[0], format_label) == "Rossi v1"
+    assert cache.get_label(dict(patients[0]), format_label) == "Rossi v1"
+    assert calls == ['pat-1']
+
+    updated = fhir_store.put(dict(patients[0], name=[{'given': ['Mario'], 'family': 'Rossetti'}]))
+    assert cache.get_label(updated, format_label) == "Rossetti v2"
+    assert calls == ['pat-1', 'pat-1']
+
+def test_label_cache_capacity(patients):
+    cache = PatientLabelCache(max_labels=2)
+    calls = []
+    def format_label(raw):
+        calls.append(raw['id'])
+        return raw['id']
+    for patient in patients[:3] + patients[:1]:
+        cache.get_label(patient, format_label)
+    assert calls == ['pat-1', 'pat-2', 'pat-3', 'pat-1']
@@ -0,0 +1,86 @@
+'''
+Script: test_prefetch.py
+Digital Health Systems and Applications - Project work 2025-2026
+Description:
+Tests of the background prefetch against the stand-in FHIR server: the budget
+(patients, wrapped resources, context cache capacity), the pause while an
+interactive request runs, and an interactive request waiting for the prefetch of
+the same patient instead of downloading it twice.
+
+Group: Carmine Vardaro, Marco Savastano, Francesco Ferrara.
+'''
+
+import time
+
+import pytest
+
+import services.clinical_fetch as clinical_fetch
+import services.context_cache as context_cache
+from services.context_cache import get_context_cache
+from services.prefetch import PrefetchScheduler, rank_prefetch_candidates
+from utilities.fhir_stub_server import generate_synthetic_population
+
+@pytest.fixture
+def patient_ids(fhir_store):
+    generate_synthetic_population(fhir_store, patients=4, seed=11, observations_per_patient=20)
+    return [p['id'] for p in fhir_store.find('Patient')]
+
+def _cached(patient_ids):
+    return [pid for pid in patient_ids if get_context_cache().contains(pid)]
+
+def test_rank_prefetch_candidates():
+    patients = [{'id': 'a', 'meta': {'lastUpdated': '2024-01-01T00:00:00Z'}},
+                {'id': 'b', 'meta': {'lastUpdated': '2025-01-01T00:00:00Z'}},
+                {'id': 'c'},
+                {'id': 'd', 'meta': {'lastUpdated': '2025-01-01T00:00:00Z'}}]
+    assert rank_prefetch_candidates(patients, ['c', 'x', 'a']) == ['c', 'a', 'b', 'd']
+
+def test_patient_budget(fhir_client, patient_ids):
+    scheduler = PrefetchScheduler(fhir_client, max_patients=2)
+    scheduler.schedule(patient_ids)
+    assert scheduler.wait_idle(10)
+    assert _cached(patient_ids) == patient_ids[:2]
+
+def test_resource_budget(fhir_client, patient_ids):
+    scheduler = PrefetchScheduler(fhir_client, max_patients=4, max_resources=1)
+    scheduler.schedule(patient_ids)
+    assert scheduler.wait_idle(10)
+    # The first patient uses up the budget: nothing else is kept on speculation
+    assert _cached(patient_ids) == patient_ids[:1]
+
+def test_cache_capacity_budget(fhir_client, patient_ids, monkeypatch):
+    monkeypatch.setattr(context_cache, '_default_cache', context_cache.PatientContextCache(max_patients=2))
+    scheduler = PrefetchScheduler(fhir_client, max_patients=4)
+    scheduler.schedule(patient_ids)
+    assert scheduler.wait_idle(10)
+    # The prefetch never evicts patients from the context cache
+    assert _cached(patient_ids) == patient_ids[:2]
+
+def test_paused_while_interactive(fhir_server, fhir_client, patient_ids):
+    server, _ = fhir_server
+    scheduler = PrefetchScheduler(fhir_client, max_patients=4)
+    with scheduler.interactive('other-patient'):
+        scheduler.schedule(patient_ids)
+        time.sleep(0.3)
+        assert server.request_count == 0
+        assert scheduler.wait_idle(10)
+        assert _cached(patient_ids) == []
+    assert scheduler.wait_idle(10)
+    assert _cached(patient_ids) == patient_ids
+
+def test_interactive_waits_for_running_prefetch(fhir_server, fhir_client, fhir_store, patient_ids):
+    server, _ = fhir_server
+    server.latency_ms = 50
+    scheduler = PrefetchScheduler(fhir_client, max_patients=1)
+    patient_id = patient_ids[0]
+    scheduler.schedule([patient_id])
+    deadline = time.monotonic() + 10
+    while server.request_count == 0 and time.monotonic() < deadline:
+        time.sleep(0.005)
+
+    with scheduler.interactive(patient_id):
+        # The prefetch of the same patient has completed before the request goes on
+        assert get_context_cache().contains(patient_id)
+        requests_sent = server.request_count
+        clinical_fetch.build_clinical_context(fhir_store.get('Patient', patient_id), fhir_client)
+        assert server.request_count == requests_sent
@@ -0,0 +1,100 @@
+'''
+Script: test_snapshot_store.py
+Digital Health Systems and Applications - Project work 2025-2026
+Description:
+Tests of the eviction of the on-disk snapshot store: patients not opened recently
+are dropped, recently used ones are kept, sweeps are throttled, and an evicted
+patient is downloaded in full again when reopened.
+
+Group: Carmine Vardaro, Marco Savastano, Francesco Ferrara.
+'''
+
+from datetime import datetime, timedelta
+
+import pytest
+
+import services.snapshot_store as snapshot_store
+from services.snapshot_store import PatientSnapshotStore
+
+def _condition(resource_id: str, patient_id: str) -> dict:
+    return {'resourceType': 'Condition', 'id': resource_id, 'subject': {'reference': f'Patient/{patient_id}'},
+            'meta': {'versionId': '1', 'lastUpdated': '2024-01-01T00:00:00Z'}}
+
+@pytest.fixture
+def store(tmp_path):
+    store = PatientSnapshotStore(str(tmp_path / 'snapshots.db'))
+    for patient_id in ('pat-1', 'pat-2'):
+        store.save_resources(patient_id, 'Condition', [_condition(f'{patient_id}-c', patient_id)])
+        store.save_resources(patient_id, 'Observation', [])
+    return store
+
+def _age(store: PatientSnapshotStore, patient_id: str, hours: float, resource_type: str = None):
+    """
+    Moves the last synchronization of the patient (or of one of its types) back in time.
+    """
+    synced_at = (datetime.now() - timedelta(hours=hours)).isoformat()
+    query, params = "UPDATE sync_state SET synced_at = ? WHERE patient_id = ?", [synced_at, patient_id]
+    if resource_type:
+        query, params = query + " AND resource_type = ?", params + [resource_type]
+    with store._conn:
+        store._conn.execute(query, params)
+
+def test_evict_stale_patients(store):
+    _age(store, 'pat-1', 48)
+    assert store.evict_stale(24) == 1
+    assert store.get_watermarks('pat-1') == {} and store.load_resources('pat-1', 'Condition') == []
+    assert set(store.get_watermarks('pat-2')) == {'Condition', 'Observation'}
+    assert len(store.load_resources('pat-2', 'Condition')) == 1
+    assert store.evict_stale(24) == 0
+
+def test_patient_kept_while_any_type_is_recent(store):
+    _age(store, 'pat-1', 48, 'Condition')
+    assert store.evict_stale(24) == 0
+    assert len(store.load_resources('pat-1', 'Condition')) == 1
+
+def test_touch_keeps_patient(store):
+    _age(store, 'pat-1', 48)
+    store.touch_patient('pat-1')
+    assert store.evict_stale(24) == 0
+
+def test_eviction_disabled(store, monkeypatch):
+    _age(store, 'pat-1', 48)
+    assert store.evict_stale(0) == 0
+    monkeypatch.setattr(snapshot_store, 'SNAPSHOT_EVICT_AFTER_HOURS', 0)
+    assert store.evict_stale() == 0
+    assert len(store.load_resources('pat-1', 'Condition')) == 1
+
+def test_sweeps_are_throttled(store, monkeypatch):
+    monkeypatch.setattr(snapshot_store, 'SNAPSHOT_EVICT_AFTER_HOURS', 24)
+    _age(store, 'pat-1', 48)
+    assert store.evict_if_due() == 1
+    _age(store, 'pat-2', 48)
+    assert store.evict_if_due() == 0          # swept less than an hour ago
+    monkeypatch.setattr(snapshot_store, '_EVICTION_INTERVAL_SECONDS', 0)
+    assert store.evict_if_due() == 1
+
+def test_default_store_evicts_on_open(store, monkeypatch):
+    monkeypatch.setattr(snapshot_store, 'SNAPSHOT_EVICT_AFTER_HOURS', 24)
+    monkeypatch.setattr(snapshot_store, 'SNAPSHOT_DB_PATH', store.db_path)
+    _age(store, 'pat-1', 48)
+    default_store = snapshot_store.get_snapshot_store()
+    assert default_store.get_watermarks('pat-1') == {}
+    assert set(default_store.get_watermarks('pat-2')) == {'Condition', 'Observation'}
+
+def test_evicted_patient_downloaded_again(build_context, fhir_store, fhir_server, monkeypatch, tmp_path):
+    patient = fhir_store.put({'resourceType': 'Patient', 'id': 'pat-1', 'name': [{'given': ['Mario'], 'family': 'Rossi'}]})
+    fhir_store.put({'resourceType': 'Condition', 'subject': {'reference': 'Patient/pat-1'},
+                    'clinicalStatus': {'coding': [{'code': 'active'}]}, 'code': {'text': 'Hypertension'}})
+    monkeypatch.setattr(snapshot_store, 'SNAPSHOT_DB_PATH', str(tmp_path / 'snapshots.db'))
+    cold = build_context(patient)[:2]
+    assert "Hypertension" in cold[0]
+    store = snapshot_store.get_snapshot_store()
+    assert store.get_watermarks('pat-1')
+
+    _age(store, 'pat-1', 48)
+    assert store.evict_stale(24) == 1
+    server, _ = fhir_server
+    requests_sent = server.request_count
+    assert build_context(patient)[:2] == cold
+    assert server.request_count > requests_sent
+    assert store.get_watermarks('pat-1')
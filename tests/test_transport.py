@@ -0,0 +1,114 @@
+'''
+Script: test_transport.py
+Digital Health Systems and Applications - Project work 2025-2026
+Description:
+Tests of the fault handling of the shared FHIR transport against the fault injection
+of the stand-in server: circuit breaker (opening, half-open trial closing or reopening
+it, trials ending with a broken body) and the overall request deadline.
+
+Group: Carmine Vardaro, Marco Savastano, Francesco Ferrara.
+'''
+
+import time
+
+import pytest
+import requests
+
+import services.fhir_transport as fhir_transport
+from services.fhir_transport import CircuitBreaker, DeadlineExceededError, ServerUnavailableError, create_fhir_client
+
+RESET_TIMEOUT = 0.2
+
+@pytest.fixture
+def breaker(fhir_server, monkeypatch):
+    """
+    A fresh circuit breaker of the stand-in server (3 failures, RESET_TIMEOUT seconds).
+    """
+    server = fhir_server[1].rsplit('/fhir', 1)[0]
+    breaker = CircuitBreaker(server, threshold=3, reset_timeout=RESET_TIMEOUT)
+    monkeypatch.setattr(fhir_transport, '_circuit_breakers', {server: breaker})
+    monkeypatch.setattr(fhir_transport, '_backoff_delay', lambda attempt, response: 0.01)
+    return breaker
+
+@pytest.fixture
+def client(fhir_server):
+    return create_fhir_client(fhir_server[1], max_retries=0)
+
+def _read(client):
+    return client.execute('Patient', method='get', params={'_count': 1})
+
+def _open_circuit(server, client, breaker):
+    server.error_rate = 1.0
+    for _ in range(breaker.threshold):
+        with pytest.raises(Exception):
+            _read(client)
+
+def test_breaker_opens_after_threshold(fhir_server, client, breaker):
+    server, _ = fhir_server
+    _open_circuit(server, client, breaker)
+    assert server.request_count == 3
+
+    server.error_rate = 0
+    with pytest.raises(ServerUnavailableError):
+        _read(client)
+    assert server.request_count == 3   # failed fast, the server was not contacted
+
+def test_half_open_trial_closes_breaker(fhir_server, client, breaker):
+    server, _ = fhir_server
+    _open_circuit(server, client, breaker)
+
+    server.error_rate = 0
+    time.sleep(RESET_TIMEOUT)
+    assert _read(client)['resourceType'] == 'Bundle'
+    # Closed again: the failure count starts over
+    server.error_rate = 1.0
+    for _ in range(breaker.threshold - 1):
+        with pytest.raises(Exception):
+            _read(client)
+    server.error_rate = 0
+    assert _read(client)['resourceType'] == 'Bundle'
+
+def test_half_open_trial_reopens_breaker(fhir_server, client, breaker):
+    server, _ = fhir_server
+    _open_circuit(server, client, breaker)
+
+    time.sleep(RESET_TIMEOUT)
+    with pytest.raises(Exception):
+        _read(client)                  # the trial fails
+    requests_sent = server.request_count
+    server.error_rate = 0
+    with pytest.raises(ServerUnavailableError):
+        _read(client)
+    assert server.request_count == requests_sent
+
+def test_broken_body_on_trial_does_not_block_breaker(fhir_server, client, breaker):
+    server, _ = fhir_server
+    _open_circuit(server, client, breaker)
+
+    server.error_rate, server.truncate_rate = 0, 1.0
+    time.sleep(RESET_TIMEOUT)
+    with pytest.raises(requests.exceptions.ChunkedEncodingError):
+        _read(client)
+
+    server.truncate_rate = 0
+    time.sleep(RESET_TIMEOUT)
+    assert _read(client)['resourceType'] == 'Bundle'
+    assert _read(client)['resourceType'] == 'Bundle'
+
+def test_broken_body_is_retried(fhir_server, breaker):
+    server, url = fhir_server
+    server.truncate_rate = 1.0
+    client = create_fhir_client(url, max_retries=2)
+    with pytest.raises(requests.exceptions.ChunkedEncodingError):
+        _read(client)
+    assert server.request_count == 3
+
+def test_deadline_exceeded(fhir_server, breaker):
+    server, url = fhir_server
+    server.latency_ms = 1000
+    client = create_fhir_client(url, deadline=0.3, max_retries=5)
+
+    start = time.monotonic()
+    with pytest.raises(DeadlineExceededError):
+        _read(client)
+    assert time.monotonic() - start < 0.8
@@ -2,11 +2,18 @@ import os
 import sys
 from tqdm import tqdm
 from dotenv import load_dotenv
-from fhirpy import SyncFHIRClient
 
 load_dotenv()
+
+# Make the project packages (services/) importable when run as a script
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from services.fhir_transport import create_fhir_client, iter_search_pages
+
 SERVER_URL = os.getenv("SERVER_URL")
 
+# Resources requested per page (pages are analyzed one at a time)
+PAGE_SIZE = 200
+
 # List of standard Procedure fields to check for
 # Based on FHIR R4 Specification
 EXPECTED_FIELDS = [
@@ -26,52 +33,53 @@ def main():
     
     # 1. CLIENT INITIALIZATION
     try:
-        client = SyncFHIRClient(SERVER_URL)
+        client = create_fhir_client(SERVER_URL)
     except Exception as e:
         print(f"Error: Could not create client. {e}")
         sys.exit(1)
 
-    # 2. FETCH DATA (Procedure)
-    print("Fetching Procedures from server...")
+    # 2. FETCH AND ANALYZE FIELDS (Procedure)
+    # Pages are downloaded and analyzed one at a time, so only one page is in memory
+    print("Fetching Procedures from server and analyzing field coverage...")
+
+    # Initialize set with expected fields so they always appear in report
+    all_fields_found = set(EXPECTED_FIELDS)
+    field_counts = {field: 0 for field in EXPECTED_FIELDS}
+    total_records = 0
+
     try:
-        # Fetch all records
         # Note: We query 'Procedure' 
-        procedures = client.resources('Procedure').sort('_lastUpdated').fetch_all()
+        pages = iter_search_pages(client, 'Procedure', {'_sort': '_lastUpdated', '_count': PAGE_SIZE})
+
+        # Iterate with loading bar
+        with tqdm(desc="Scanning Attributes", unit=" res") as progress:
+            for page in pages:
+                # Each resource is already a raw JSON dictionary
+                for data in page:
+                    for key, value in data.items():
+                        # Check if value exists (not None)
+                        if value is not None:
+                            # Add to set (catches any custom/unexpected fields)
+                            all_fields_found.add(key)
+                            
+                            # Increment counter
+                            if key in field_counts:
+                                field_counts[key] += 1
+                            else:
+                                field_counts[key] = 1
+                total_records += len(page)
+                progress.update(len(page))
     except Exception as e:
         print(f"Connection Error: {e}")
         sys.exit(1)
 
-    if not procedures:
+    if total_records == 0:
         print("No Procedure records found on the server.")
         sys.exit(1)
 
-    total_records = len(procedures)
-    print(f"{total_records} Procedures found. Analyzing field coverage...")
-
-    # 3. ANALYZE FIELDS
-    # Initialize set with expected fields so they always appear in report
-    all_fields_found = set(EXPECTED_FIELDS)
-    field_counts = {field: 0 for field in EXPECTED_FIELDS}
-
-    # Iterate with loading bar
-    for proc in tqdm(procedures, desc="Scanning Attributes"):
-        
-        # Serialize to dictionary to inspect actual JSON keys
-        data = proc.serialize() 
-        
-        for key, value in data.items():
-            # Check if value exists (not None)
-            if value is not None:
-                # Add to set (catches any custom/unexpected fields)
-                all_fields_found.add(key)
-                
-                # Increment counter
-                if key in field_counts:
-                    field_counts[key] += 1
-                else:
-                    field_counts[key] = 1
+    # 3. PRINT REPORT
+    print(f"{total_records} Procedures found.")
 
-    # 4. PRINT REPORT
     print("\n--Procedure Analysis--")
     
     # Sort fields alphabetically
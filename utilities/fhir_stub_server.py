@@ -0,0 +1,614 @@
+import os
+import sys
+import json
+import base64
+import time
+import uuid
+import random
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlsplit
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Local FHIR stand-in server for offline, reproducible performance tests.
+# It serves recorded fixtures (the Synthea transaction Bundles uploaded by load_data.py,
+# single resources or NDJSON files) or a synthetic population from memory, and implements
+# the subset of the FHIR REST API used by the app and the utilities: read, search with
+# paging (_count + next links), _summary=count, _include, _elements, _lastUpdated, _sort,
+# Patient/$everything, Observation/$lastn, batch/transaction POST, create, update, delete.
+# Latency, page size, error rate and truncated answers are configurable, so the fetch layer
+# can be benchmarked (and its fault handling tested) under repeatable network conditions.
+#
+# Usage:  python utilities/fhir_stub_server.py  then  SERVER_URL=http://localhost:8085/fhir
+
+STUB_HOST = os.getenv("STUB_HOST", "127.0.0.1")
+STUB_PORT = int(os.getenv("STUB_PORT", "8085"))
+STUB_BASE_PATH = "/fhir"
+
+# Folder (or file) with the recorded fixtures; if empty a synthetic population is generated
+STUB_FIXTURES_PATH = os.getenv("STUB_FIXTURES_PATH", "")
+STUB_SYNTHETIC_PATIENTS = int(os.getenv("STUB_SYNTHETIC_PATIENTS", "50"))
+
+# Simulated network conditions: fixed delay + random jitter per response (milliseconds)
+# and share of requests answered with 503 Service Unavailable
+STUB_LATENCY_MS = float(os.getenv("STUB_LATENCY_MS", "0"))
+STUB_JITTER_MS = float(os.getenv("STUB_JITTER_MS", "0"))
+STUB_ERROR_RATE = float(os.getenv("STUB_ERROR_RATE", "0"))
+# Share of successful answers whose body is cut off (the connection is closed mid-body)
+STUB_TRUNCATE_RATE = float(os.getenv("STUB_TRUNCATE_RATE", "0"))
+
+# Page size used when the request has no _count, and the largest one accepted
+STUB_PAGE_SIZE = int(os.getenv("STUB_PAGE_SIZE", "20"))
+STUB_MAX_PAGE_SIZE = 1000
+
+# Search results kept for paging (oldest searches are dropped)
+MAX_CACHED_SEARCHES = 500
+
+# Fields holding the patient a resource belongs to
+PATIENT_REFERENCE_FIELDS = ('patient', 'subject')
+
+# Fields holding the clinical date used by _sort=date
+DATE_FIELDS = ('effectiveDateTime', 'occurrenceDateTime', 'performedDateTime', 'authoredOn',
+               'recordedDate', 'onsetDateTime', 'issued', 'date')
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+def _outcome(severity: str, code: str, diagnostics: str) -> dict:
+    return {'resourceType': 'OperationOutcome', 'issue': [{'severity': severity, 'code': code, 'diagnostics': diagnostics}]}
+
+def _patient_of(resource: dict):
+    """
+    Returns the id of the patient a resource belongs to (or None).
+    """
+    if resource.get('resourceType') == 'Patient':
+        return resource.get('id')
+    for field in PATIENT_REFERENCE_FIELDS:
+        value = resource.get(field)
+        reference = value.get('reference', '') if isinstance(value, dict) else ''
+        if reference.startswith('Patient/'):
+            return reference.split('/', 1)[1]
+    return None
+
+def _clinical_date(resource: dict) -> str:
+    for field in DATE_FIELDS:
+        if resource.get(field):
+            return resource[field]
+    period = resource.get('effectivePeriod') or resource.get('performedPeriod') or {}
+    return period.get('start', '')
+
+def _date_order(value: str) -> float:
+    """
+    Sort key of a date/dateTime/instant: compares instants whatever their offset or
+    precision (partial dates are their first day, values without offset are UTC).
+    """
+    if not value:
+        return float('-inf')
+    if len(value) in (4, 7):
+        value += '-01-01'[:10 - len(value)]
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return float('-inf')
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+def _code_key(resource: dict) -> str:
+    code = resource.get('code') or {}
+    for coding in code.get('coding') or []:
+        if coding.get('code'):
+            return f"{coding.get('system', '')}|{coding['code']}"
+    return code.get('text', '')
+
+def _matches_prefix(value: str, expression: str) -> bool:
+    """
+    Compares a date/instant with a FHIR search value (eq/gt/ge/lt/le prefix).
+    Equality matches by prefix, e.g. birthdate=1980 matches 1980-05-01.
+    """
+    prefix, target = (expression[:2], expression[2:]) if expression[:2] in ('eq', 'gt', 'ge', 'lt', 'le') else ('eq', expression)
+    if not value:
+        return False
+    if prefix == 'eq':
+        return value.startswith(target)
+    return {'gt': value > target, 'ge': value >= target, 'lt': value < target, 'le': value <= target}[prefix]
+
+class FhirStubStore:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._resources = {}  # resource type -> {id -> resource}
+        self._last_instant = _now()
+
+    def _next_instant(self) -> str:
+        # Strictly increasing lastUpdated values, so _lastUpdated=gt... watermarks are exact
+        self._last_instant = max(_now(), self._last_instant + timedelta(microseconds=1000))
+        return self._last_instant.isoformat(timespec='milliseconds').replace('+00:00', 'Z')
+
+    def resource_types(self) -> list:
+        with self._lock:
+            return list(self._resources)
+
+    def count(self) -> int:
+        return sum(len(by_id) for by_id in self._resources.values())
+
+    def get(self, resource_type: str, resource_id: str):
+        return self._resources.get(resource_type, {}).get(resource_id)
+
+    def put(self, resource: dict) -> dict:
+        """
+        Creates or replaces a resource, assigning id, versionId and lastUpdated.
+        """
+        with self._lock:
+            resource_type = resource['resourceType']
+            resource_id = resource.get('id') or uuid.uuid4().hex
+            previous = self._resources.get(resource_type, {}).get(resource_id)
+            version = int(((previous or {}).get('meta') or {}).get('versionId', 0)) + 1
+            stored = dict(resource, id=resource_id)
+            stored['meta'] = dict(resource.get('meta') or {}, versionId=str(version), lastUpdated=self._next_instant())
+            self._resources.setdefault(resource_type, {})[resource_id] = stored
+            return stored
+
+    def delete(self, resource_type: str, resource_id: str) -> bool:
+        with self._lock:
+            return self._resources.get(resource_type, {}).pop(resource_id, None) is not None
+
+    def find(self, resource_type: str, predicate=None) -> list:
+        with self._lock:
+            resources = list(self._resources.get(resource_type, {}).values())
+        return [r for r in resources if predicate is None or predicate(r)]
+
+    def load_bundle(self, bundle: dict) -> list:
+        """
+        Stores the entries of a transaction/batch/collection Bundle, resolving the
+        urn:uuid references between them as a FHIR server does.
+        Conditional creates (ifNoneExist) are skipped when the id already exists.
+        Returns one transaction-response entry per stored entry.
+        """
+        urn_map = {}
+        for entry in bundle.get('entry') or []:
+            resource = entry.get('resource') or {}
+            full_url = entry.get('fullUrl', '')
+            if resource and full_url.startswith('urn:uuid:'):
+                resource.setdefault('id', full_url[len('urn:uuid:'):])
+                urn_map[full_url] = f"{resource['resourceType']}/{resource['id']}"
+
+        def resolve(node):
+            if isinstance(node, dict):
+                return {k: (urn_map.get(v, v) if k == 'reference' and isinstance(v, str) else resolve(v)) for k, v in node.items()}
+            if isinstance(node, list):
+                return [resolve(v) for v in node]
+            return node
+
+        responses = []
+        for entry in bundle.get('entry') or []:
+            resource = entry.get('resource')
+            if not resource:
+                continue
+            request = entry.get('request') or {}
+            existing = self.get(resource['resourceType'], resource.get('id', ''))
+            if request.get('ifNoneExist') and existing is not None:
+                stored, status = existing, '200 OK'
+            else:
+                stored = self.put(resolve(resource))
+                status = '200 OK' if existing is not None else '201 Created'
+            responses.append({'response': {
+                'status': status,
+                'location': f"{stored['resourceType']}/{stored['id']}/_history/{stored['meta']['versionId']}",
+                'lastModified': stored['meta']['lastUpdated'],
+            }})
+        return responses
+
+    def load_path(self, path: str) -> int:
+        """
+        Loads fixtures from a folder or a file: Bundles, single resources (.json)
+        or one resource per line (.ndjson). Returns the number of stored resources.
+        """
+        files = [os.path.join(path, f) for f in sorted(os.listdir(path))] if os.path.isdir(path) else [path]
+        # Same order as load_data.py: infrastructure files (lowercase names) first
+        files.sort(key=lambda f: not os.path.basename(f)[:1].islower())
+        for file_path in files:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                if file_path.endswith('.ndjson'):
+                    for line in f:
+                        if line.strip():
+                            self.put(json.loads(line))
+                elif file_path.endswith('.json'):
+                    data = json.load(f)
+                    if data.get('resourceType') == 'Bundle':
+                        self.load_bundle(data)
+                    else:
+                        self.put(data)
+        return self.count()
+
+def generate_synthetic_population(store: FhirStubStore, patients: int, seed: int = 42,
+                                  observations_per_patient: int = 60) -> int:
+    """
+    Fills the store with a deterministic synthetic population (patients with
+    conditions, observations history, medications, immunizations, procedures,
+    allergies, devices, care plans and reports) shaped like the Synthea data.
+    Returns the number of stored resources.
+    """
+    rng = random.Random(seed)
+    first_names = ['Aaron', 'Beatrice', 'Carlo', 'Diana', 'Elena', 'Franco', 'Giulia', 'Hector', 'Irene', 'Luca']
+    last_names = ['Rossi', 'Smith', 'Bianchi', 'Garcia', 'Ferrari', 'Johnson', 'Russo', 'Brown', 'Romano', 'Lee']
+    conditions = [('44054006', 'Diabetes mellitus type 2'), ('38341003', 'Hypertensive disorder'),
+                  ('195967001', 'Asthma'), ('55822004', 'Hyperlipidemia'), ('40055000', 'Chronic sinusitis')]
+    observations = [('8302-2', 'Body Height', 'cm', 150, 190, 'vital-signs'), ('29463-7', 'Body Weight', 'kg', 50, 110, 'vital-signs'),
+                    ('8867-4', 'Heart rate', '/min', 55, 100, 'vital-signs'), ('2339-0', 'Glucose', 'mg/dL', 70, 180, 'laboratory'),
+                    ('2093-3', 'Total Cholesterol', 'mg/dL', 140, 260, 'laboratory'), ('4548-4', 'Hemoglobin A1c', '%', 4.5, 9.5, 'laboratory')]
+    medications = [('860975', 'metFORMIN 500 MG Oral Tablet'), ('314076', 'lisinopril 10 MG Oral Tablet'),
+                   ('617312', 'atorvastatin 20 MG Oral Tablet'), ('895994', 'fluticasone 0.044 MG/ACTUAT Inhaler')]
+    loinc, snomed, rxnorm = 'http://loinc.org', 'http://snomed.info/sct', 'http://www.nlm.nih.gov/research/umls/rxnorm'
+
+    medication_ids = []
+    for code, display in medications:
+        stored = store.put({'resourceType': 'Medication', 'id': f'med-{code}', 'status': 'active',
+                            'code': {'coding': [{'system': rxnorm, 'code': code, 'display': display}], 'text': display}})
+        medication_ids.append(stored['id'])
+
+    start = datetime(2015, 1, 1, tzinfo=timezone.utc)
+    for n in range(patients):
+        pid = f'pat-{n:05d}'
+        subject = {'reference': f'Patient/{pid}'}
+        birth = datetime(1930, 1, 1) + timedelta(days=rng.randrange(0, 80 * 365))
+        store.put({'resourceType': 'Patient', 'id': pid, 'gender': rng.choice(['male', 'female']),
+                   'birthDate': birth.strftime('%Y-%m-%d'),
+                   'name': [{'use': 'official', 'family': rng.choice(last_names) + str(n), 'given': [rng.choice(first_names)]}]})
+
+        def when(days_max=3000):
+            return (start + timedelta(days=rng.randrange(0, days_max), minutes=rng.randrange(0, 1440))).isoformat()
+
+        for code, display in rng.sample(conditions, rng.randint(1, 3)):
+            store.put({'resourceType': 'Condition', 'subject': subject, 'onsetDateTime': when(), 'recordedDate': when(),
+                       'clinicalStatus': {'coding': [{'system': 'http://terminology.hl7.org/CodeSystem/condition-clinical', 'code': 'active'}]},
+                       'code': {'coding': [{'system': snomed, 'code': code, 'display': display}], 'text': display}})
+        for _ in range(observations_per_patient):
+            code, display, unit, low, high, category = rng.choice(observations)
+            store.put({'resourceType': 'Observation', 'status': 'final', 'subject': subject, 'effectiveDateTime': when(),
+                       'category': [{'coding': [{'system': 'http://terminology.hl7.org/CodeSystem/observation-category', 'code': category}]}],
+                       'code': {'coding': [{'system': loinc, 'code': code, 'display': display}], 'text': display},
+                       'valueQuantity': {'value': round(rng.uniform(low, high), 1), 'unit': unit, 'system': 'http://unitsofmeasure.org', 'code': unit}})
+        for medication_id in rng.sample(medication_ids, rng.randint(0, 2)):
+            store.put({'resourceType': 'MedicationRequest', 'status': rng.choice(['active', 'stopped']), 'intent': 'order',
+                       'subject': subject, 'authoredOn': when(), 'medicationReference': {'reference': f'Medication/{medication_id}'},
+                       'dosageInstruction': [{'text': 'Take 1 tablet daily'}]})
+        for _ in range(rng.randint(1, 4)):
+            store.put({'resourceType': 'Immunization', 'status': 'completed', 'patient': subject, 'occurrenceDateTime': when(),
+                       'vaccineCode': {'coding': [{'system': 'http://hl7.org/fhir/sid/cvx', 'code': '140', 'display': 'Influenza, seasonal'}],
+                                       'text': 'Influenza, seasonal'}})
+        for _ in range(rng.randint(0, 3)):
+            store.put({'resourceType': 'Procedure', 'status': 'completed', 'subject': subject, 'performedDateTime': when(),
+                       'code': {'coding': [{'system': snomed, 'code': '430193006', 'display': 'Medication reconciliation'}],
+                                'text': 'Medication reconciliation'}})
+        if rng.random() < 0.3:
+            store.put({'resourceType': 'AllergyIntolerance', 'patient': subject, 'category': ['food'], 'criticality': 'low',
+                       'clinicalStatus': {'coding': [{'system': 'http://terminology.hl7.org/CodeSystem/allergyintolerance-clinical', 'code': 'active'}]},
+                       'verificationStatus': {'coding': [{'system': 'http://terminology.hl7.org/CodeSystem/allergyintolerance-verification', 'code': 'confirmed'}]},
+                       'code': {'coding': [{'system': snomed, 'code': '91935009', 'display': 'Allergy to peanuts'}], 'text': 'Allergy to peanuts'}})
+        if rng.random() < 0.1:
+            store.put({'resourceType': 'Device', 'status': 'active', 'patient': subject,
+                       'type': {'coding': [{'system': snomed, 'code': '337414009', 'display': 'Blood glucose meter'}], 'text': 'Blood glucose meter'}})
+        if rng.random() < 0.5:
+            store.put({'resourceType': 'CarePlan', 'status': 'active', 'intent': 'order', 'subject': subject,
+                       'category': [{'coding': [{'system': snomed, 'code': '698360004', 'display': 'Diabetes self management plan'}],
+                                     'text': 'Diabetes self management plan'}],
+                       'activity': [{'detail': {'status': 'in-progress', 'code': {'text': 'Diabetic diet'}}}]})
+        note = base64.b64encode(b"Patient seen for follow-up. Vitals stable. Continue current therapy.").decode('ascii')
+        store.put({'resourceType': 'DiagnosticReport', 'status': 'final', 'subject': subject, 'effectiveDateTime': when(),
+                   'code': {'coding': [{'system': loinc, 'code': '34117-2', 'display': 'History and physical note'}], 'text': 'History and physical note'},
+                   'presentedForm': [{'contentType': 'text/plain; charset=utf-8', 'data': note}]})
+    return store.count()
+
+class FhirStubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, store: FhirStubStore, latency_ms: float = STUB_LATENCY_MS, jitter_ms: float = STUB_JITTER_MS,
+                 page_size: int = STUB_PAGE_SIZE, error_rate: float = STUB_ERROR_RATE,
+                 truncate_rate: float = STUB_TRUNCATE_RATE):
+        super().__init__(address, FhirStubHandler)
+        self.store = store
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.page_size = page_size
+        self.error_rate = error_rate
+        self.truncate_rate = truncate_rate
+        self.request_count = 0
+        self._searches = OrderedDict()  # paging token -> (resource ids, search parameters)
+        self._searches_lock = threading.Lock()
+
+    def save_search(self, results: list, params: dict) -> str:
+        token = uuid.uuid4().hex
+        with self._searches_lock:
+            self._searches[token] = (results, params)
+            while len(self._searches) > MAX_CACHED_SEARCHES:
+                self._searches.popitem(last=False)
+        return token
+
+    def load_search(self, token: str):
+        with self._searches_lock:
+            return self._searches.get(token)
+
+class FhirStubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server: FhirStubServer
+
+    def log_message(self, format, *args):
+        pass
+
+    # --- Helpers ---
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.headers.get('Host', f'{STUB_HOST}:{self.server.server_port}')}{STUB_BASE_PATH}"
+
+    def _send_json(self, status: int, body: dict, headers: dict = None):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/fhir+json; charset=utf-8')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if status < 300 and self.server.truncate_rate and random.random() < self.server.truncate_rate:
+            # Announced length, half of the body, then the connection is dropped
+            self.wfile.write(payload[:len(payload) // 2])
+            self.close_connection = True
+            return
+        self.wfile.write(payload)
+
+    def _read_body(self) -> dict:
+        length = int(self.headers.get('Content-Length', 0) or 0)
+        return json.loads(self.rfile.read(length).decode('utf-8')) if length else {}
+
+    def _route(self):
+        """
+        Returns (path segments after the base path, query parameters) or None if outside the base path.
+        """
+        parts = urlsplit(self.path)
+        if not parts.path.startswith(STUB_BASE_PATH):
+            return None
+        segments = [s for s in parts.path[len(STUB_BASE_PATH):].split('/') if s]
+        return segments, {k: v[-1] for k, v in parse_qs(parts.query).items()}
+
+    def _simulate_network(self) -> bool:
+        """
+        Applies the configured latency; returns False if a 503 was sent instead of the answer.
+        """
+        self.server.request_count += 1
+        delay = self.server.latency_ms + random.uniform(0, self.server.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000)
+        if self.server.error_rate and random.random() < self.server.error_rate:
+            self._send_json(503, _outcome('error', 'transient', 'Simulated server overload'), {'Retry-After': '1'})
+            return False
+        return True
+
+    # --- Search ---
+    def _search(self, resource_type: str, params: dict) -> list:
+        store = self.server.store
+        filters = []
+        for name, value in params.items():
+            if name in PATIENT_REFERENCE_FIELDS:
+                patient_id = value.split('/')[-1]
+                filters.append(lambda r, p=patient_id: _patient_of(r) == p)
+            elif name == '_id':
+                ids = set(value.split(','))
+                filters.append(lambda r, ids=ids: r.get('id') in ids)
+            elif name == 'name:contains' or name == 'name':
+                text = value.lower()
+                filters.append(lambda r, t=text: any(
+                    t in ' '.join([n.get('text', '')] + n.get('given', []) + [n.get('family', '')]).lower()
+                    for n in r.get('name') or []))
+            elif name == 'birthdate':
+                filters.append(lambda r, v=value: _matches_prefix(r.get('birthDate', ''), v))
+            elif name == '_lastUpdated':
+                filters.append(lambda r, v=value: _matches_prefix(r['meta']['lastUpdated'], v))
+            elif name == 'status':
+                statuses = set(value.split(','))
+                filters.append(lambda r, s=statuses: r.get('status') in s)
+        results = store.find(resource_type, lambda r: all(f(r) for f in filters))
+
+        # Stable multi-key sort, applied from the last key to the first
+        for key in reversed([k for k in params.get('_sort', '').split(',') if k]):
+            descending = key.startswith('-')
+            field = key.lstrip('-')
+            getter = (lambda r: r['meta']['lastUpdated']) if field == '_lastUpdated' else (lambda r: _date_order(_clinical_date(r)))
+            results.sort(key=getter, reverse=descending)
+        return results
+
+    @staticmethod
+    def _project(resource: dict, elements: str) -> dict:
+        """
+        Applies _elements: keeps the listed top-level elements (a choice element such as
+        'deceased' keeps deceasedBoolean/deceasedDateTime) plus resourceType, id and meta.
+        """
+        keep = {'resourceType', 'id', 'meta'} | {e.strip() for e in elements.split(',') if e.strip()}
+        return {k: v for k, v in resource.items()
+                if k in keep or any(k.startswith(e) and k[len(e):][:1].isupper() for e in keep)}
+
+    def _included(self, page: list, params: dict) -> list:
+        if params.get('_include') != 'MedicationRequest:medication':
+            return []
+        included = OrderedDict()
+        for resource in page:
+            reference = (resource.get('medicationReference') or {}).get('reference', '')
+            if reference.startswith('Medication/'):
+                medication = self.server.store.get('Medication', reference.split('/', 1)[1])
+                if medication:
+                    included[medication['id']] = medication
+        return list(included.values())
+
+    def _page_bundle(self, results: list, params: dict, offset: int = 0, token: str = None) -> dict:
+        count = min(int(params.get('_count', self.server.page_size)), STUB_MAX_PAGE_SIZE)
+        page = results[offset:offset + count]
+        elements = params.get('_elements')
+        entries = [
+            {'fullUrl': f"{self.base_url}/{r['resourceType']}/{r['id']}",
+             'resource': self._project(r, elements) if elements else r, 'search': {'mode': 'match'}}
+            for r in page
+        ]
+        entries += [
+            {'fullUrl': f"{self.base_url}/Medication/{m['id']}", 'resource': m, 'search': {'mode': 'include'}}
+            for m in self._included(page, params)
+        ]
+        bundle = {'resourceType': 'Bundle', 'id': uuid.uuid4().hex, 'type': 'searchset', 'total': len(results),
+                  'link': [{'relation': 'self', 'url': self.path}], 'entry': entries}
+        if offset + count < len(results):
+            token = token or self.server.save_search(results, params)
+            query = urlencode({'_getpages': token, '_getpagesoffset': offset + count, '_count': count})
+            bundle['link'].append({'relation': 'next', 'url': f"{self.base_url}?{query}"})
+        return bundle
+
+    def _search_bundle(self, resource_type: str, params: dict) -> dict:
+        results = self._search(resource_type, params)
+        if params.get('_summary') == 'count':
+            return {'resourceType': 'Bundle', 'type': 'searchset', 'total': len(results)}
+        return self._page_bundle(results, params)
+
+    def _lastn(self, params: dict) -> dict:
+        observations = self._search('Observation', {k: v for k, v in params.items() if k in PATIENT_REFERENCE_FIELDS + ('status',)})
+        observations.sort(key=lambda r: _date_order(_clinical_date(r)), reverse=True)
+        max_per_code = int(params.get('max', 1))
+        kept, per_code = [], {}
+        for observation in observations:
+            key = _code_key(observation)
+            if per_code.get(key, 0) < max_per_code:
+                per_code[key] = per_code.get(key, 0) + 1
+                kept.append(observation)
+        return self._page_bundle(kept, params)
+
+    def _everything(self, patient_id: str, params: dict) -> dict:
+        patient = self.server.store.get('Patient', patient_id)
+        if patient is None:
+            return None
+        compartment = [patient]
+        for resource_type in self.server.store.resource_types():
+            if resource_type != 'Patient':
+                compartment.extend(self.server.store.find(resource_type, lambda r: _patient_of(r) == patient_id))
+        medication_ids = {(r.get('medicationReference') or {}).get('reference', '') for r in compartment}
+        compartment.extend(self.server.store.find('Medication', lambda m: f"Medication/{m['id']}" in medication_ids))
+        return self._page_bundle(compartment, params)
+
+    def _get(self, segments: list, params: dict):
+        """
+        Answers a GET; returns (status, body).
+        """
+        if not segments and '_getpages' in params:
+            saved = self.server.load_search(params['_getpages'])
+            if saved is None:
+                return 410, _outcome('error', 'not-found', 'Search results expired')
+            results, search_params = saved
+            search_params = dict(search_params, _count=params.get('_count', search_params.get('_count', self.server.page_size)))
+            return 200, self._page_bundle(results, search_params, int(params.get('_getpagesoffset', 0)), params['_getpages'])
+        if segments == ['metadata']:
+            return 200, {'resourceType': 'CapabilityStatement', 'status': 'active', 'kind': 'instance', 'fhirVersion': '4.0.1',
+                         'format': ['json'], 'date': _now().isoformat()}
+        if len(segments) == 1:
+            return 200, self._search_bundle(segments[0], params)
+        if segments == ['Observation', '$lastn']:
+            return 200, self._lastn(params)
+        if len(segments) == 3 and segments[0] == 'Patient' and segments[2] == '$everything':
+            bundle = self._everything(segments[1], params)
+            return (200, bundle) if bundle else (404, _outcome('error', 'not-found', f'Patient/{segments[1]} not found'))
+        if len(segments) == 2:
+            resource = self.server.store.get(segments[0], segments[1])
+            return (200, resource) if resource else (404, _outcome('error', 'not-found', f'{segments[0]}/{segments[1]} not found'))
+        return 400, _outcome('error', 'not-supported', f'Unsupported request: {self.path}')
+
+    def _batch(self, bundle: dict) -> dict:
+        entries = []
+        for entry in bundle.get('entry') or []:
+            request = entry.get('request') or {}
+            if request.get('method', 'GET').upper() != 'GET':
+                entries.extend(self.server.store.load_bundle({'entry': [entry]}))
+                continue
+            url = urlsplit(request.get('url', ''))
+            segments = [s for s in url.path.split('/') if s]
+            status, body = self._get(segments, {k: v[-1] for k, v in parse_qs(url.query).items()})
+            entries.append({'resource': body, 'response': {'status': f'{status} {"OK" if status == 200 else "Error"}'}})
+        return {'resourceType': 'Bundle', 'type': 'batch-response', 'entry': entries}
+
+    # --- HTTP methods ---
+    def do_GET(self):
+        route = self._route()
+        if route is None:
+            return self._send_json(404, _outcome('error', 'not-found', 'Unknown base path'))
+        if self._simulate_network():
+            status, body = self._get(*route)
+            self._send_json(status, body)
+
+    def do_POST(self):
+        route = self._route()
+        body = self._read_body()
+        if route is None:
+            return self._send_json(404, _outcome('error', 'not-found', 'Unknown base path'))
+        if not self._simulate_network():
+            return
+        segments, _ = route
+        if not segments and body.get('resourceType') == 'Bundle':
+            if body.get('type') == 'transaction':
+                entries = self.server.store.load_bundle(body)
+                return self._send_json(200, {'resourceType': 'Bundle', 'type': 'transaction-response', 'entry': entries})
+            if body.get('type') == 'batch':
+                return self._send_json(200, self._batch(body))
+        if len(segments) == 1 and body.get('resourceType') == segments[0]:
+            body.pop('id', None)
+            stored = self.server.store.put(body)
+            location = f"{self.base_url}/{stored['resourceType']}/{stored['id']}/_history/{stored['meta']['versionId']}"
+            return self._send_json(201, stored, {'Location': location})
+        self._send_json(400, _outcome('error', 'not-supported', f'Unsupported POST: {self.path}'))
+
+    def do_PUT(self):
+        route = self._route()
+        body = self._read_body()
+        if route is None or len(route[0]) != 2:
+            return self._send_json(400, _outcome('error', 'not-supported', f'Unsupported PUT: {self.path}'))
+        if not self._simulate_network():
+            return
+        existed = self.server.store.get(*route[0]) is not None
+        stored = self.server.store.put(dict(body, resourceType=route[0][0], id=route[0][1]))
+        self._send_json(200 if existed else 201, stored)
+
+    def do_DELETE(self):
+        route = self._route()
+        if route is None or len(route[0]) != 2:
+            return self._send_json(400, _outcome('error', 'not-supported', f'Unsupported DELETE: {self.path}'))
+        if not self._simulate_network():
+            return
+        self.server.store.delete(*route[0])
+        self._send_json(200, _outcome('information', 'informational', 'Deleted'))
+
+def start_stub_server(store: FhirStubStore, host: str = STUB_HOST, port: int = 0, **options):
+    """
+    Starts the stand-in server in a background thread (port 0 picks a free port),
+    for benchmarks and regression tests. Returns (server, base URL); stop it with server.shutdown().
+    Options: latency_ms, jitter_ms, page_size, error_rate, truncate_rate (see FhirStubServer).
+    """
+    server = FhirStubServer((host, port), store, **options)
+    threading.Thread(target=server.serve_forever, name="fhir-stub-server", daemon=True).start()
+    return server, f"http://{host}:{server.server_port}{STUB_BASE_PATH}"
+
+def main():
+    store = FhirStubStore()
+    if STUB_FIXTURES_PATH:
+        print(f"--- Loading fixtures from: {STUB_FIXTURES_PATH} ---")
+        total = store.load_path(STUB_FIXTURES_PATH)
+    else:
+        print(f"--- Generating {STUB_SYNTHETIC_PATIENTS} synthetic patients ---")
+        total = generate_synthetic_population(store, STUB_SYNTHETIC_PATIENTS)
+    print(f"Loaded {total} resources.")
+
+    server = FhirStubServer((STUB_HOST, STUB_PORT), store)
+    print(f"FHIR stand-in server listening on http://{STUB_HOST}:{STUB_PORT}{STUB_BASE_PATH}")
+    print(f"Latency: {STUB_LATENCY_MS} ms (+{STUB_JITTER_MS} ms jitter), page size: {STUB_PAGE_SIZE}, error rate: {STUB_ERROR_RATE}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nServer stopped.")
+        sys.exit(0)
+
+if __name__ == "__main__":
+    main()
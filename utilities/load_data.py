@@ -6,6 +6,13 @@ import json
 import requests
 import sys
 
+# Make the project packages (services/) importable when run as a script
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from services.fhir_transport import get_http_session, HTTP_CONNECT_TIMEOUT
+
+# Large transaction Bundles can take minutes to be processed by the server
+UPLOAD_READ_TIMEOUT = 600
+
 DATASET_PATH = os.getenv("DATASET_PATH")
 SERVER_URL = os.getenv("SERVER_URL")
 
@@ -25,6 +32,9 @@ def upload_fhir_bundles():
         'Accept': 'application/fhir+json'
     }
 
+    # Shared keep-alive session: every bundle POST reuses the same connection
+    session = get_http_session()
+
     print(f"--- Starting upload to: {SERVER_URL} ---")
     print(f"--- Source folder: {fhir_folder_path} ---\n")
 
@@ -86,10 +96,11 @@ def upload_fhir_bundles():
                 continue
 
             # 3. Send POST request to the FHIR Server
-            response = requests.post(
+            response = session.post(
                 url=SERVER_URL,
                 json=bundle_data,
-                headers=headers
+                headers=headers,
+                timeout=(HTTP_CONNECT_TIMEOUT, UPLOAD_READ_TIMEOUT)
             )
 
             # 4. Check the response status
@@ -7,6 +7,10 @@ from tqdm import tqdm
 # Load environment variables
 load_dotenv()
 
+# Make the project packages (services/) importable when run as a script
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from services.fhir_transport import get_http_session, HTTP_TIMEOUT
+
 FHIR_SERVER_URL = os.getenv("SERVER_URL")
 
 # List of resources to process: [ResourceType, EstimatedCount, Description]
@@ -196,6 +200,8 @@ def get_unique_types(base_url, resource_type, total_count):
     # Initialize query with a high count per page to reduce HTTP requests
     query_url = f"{base_url}/{resource_type}?_count=500"
     unique_types = set()
+    # Shared keep-alive session: pages reuse the same connection
+    session = get_http_session()
     
     print(f"Connecting to: {base_url}")
     print(f"Scanning approximately {total_count} {resource_type}s...")
@@ -203,7 +209,7 @@ def get_unique_types(base_url, resource_type, total_count):
     with tqdm(total=total_count, unit="res", desc=f"Processing {resource_type}") as pbar:
         while query_url:
             try:
-                response = requests.get(query_url)
+                response = session.get(query_url, timeout=HTTP_TIMEOUT)
                 response.raise_for_status()
                 bundle = response.json()
             except requests.exceptions.ConnectionError:
@@ -1,7 +1,12 @@
 import os
 import sys
 from dotenv import load_dotenv
-from fhirpy import SyncFHIRClient
+
+load_dotenv()
+
+# Make the project packages (services/) importable when run as a script
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from services.fhir_transport import create_fhir_client
 
 def clean_patient_docs():
     # 1. Carica l'ambiente
@@ -13,7 +18,7 @@ def clean_patient_docs():
         return
 
     try:
-        client = SyncFHIRClient(server_url)
+        client = create_fhir_client(server_url)
         print(f"✅ Connesso al server: {server_url}")
     except Exception as e:
         print(f"❌ Errore di connessione: {e}")
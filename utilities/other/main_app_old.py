@@ -2,7 +2,6 @@ import os
 import sys
 
 from dotenv import load_dotenv
-from fhirpy import SyncFHIRClient
 from collections import defaultdict
 
 from resources.administration.device import AppDevice
@@ -17,6 +16,7 @@ from resources.diagnostics.observation import AppObservation
 from resources.medications.immunization import AppImmunization
 from resources.medications.medication import AppMedication
 from resources.medications.medicationRequests import AppMedicationRequest
+from services.fhir_transport import create_fhir_client
 
 
 load_dotenv()
@@ -26,7 +26,7 @@ def main():
    
     #CLIENT INITIALIZATION
     try:
-        client = SyncFHIRClient(SERVER_URL)
+        client = create_fhir_client(SERVER_URL)
     except Exception as e:
         print(f"Error: Could not create client. {e}")
         sys.exit(1)
@@ -5,10 +5,11 @@ import streamlit as st
 import torch
 import transformers
 import huggingface_hub
-from fhirpy import SyncFHIRClient
 from dotenv import load_dotenv
 from datetime import datetime
 
+from services.fhir_transport import create_fhir_client
+
 # --- 1. CONFIGURATION ---
 load_dotenv()
 SERVER_URL = os.getenv("SERVER_URL")
@@ -72,7 +73,7 @@ def load_llm():
     )
 
 llm = load_llm()
-client = SyncFHIRClient(SERVER_URL)
+client = create_fhir_client(SERVER_URL)
 
 # --- 5. SIDEBAR (CLEAN) ---
 with st.sidebar: